@@ -0,0 +1,191 @@
+"""Micro-benchmarks for the CPU-bound code that runs on every update.
+
+Times the pure helpers in main_bot.py (caption rendering, phone normalization,
+price validation, keyboard construction), Update.de_json on representative
+webhook payloads and the /post ConversationHandler's filter dispatch. Each
+case is run in batches; the best batch gives ns per call.
+
+    python bench_hot_paths.py --json results.json
+    python bench_hot_paths.py --baseline results.json --threshold 10
+
+With --baseline, cases more than --threshold percent slower than the saved
+run are flagged and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+# main_bot opens its listing store at import time; keep the benchmark off disk
+os.environ.setdefault("LISTINGS_DB", ":memory:")
+os.environ.setdefault("BOT_TOKEN", "123456:bench-token")
+
+import logging
+
+from telegram import Bot, Update, User
+
+import main_bot
+from listing_draft import CHOICES, ListingDraft
+from texts_am import TEXTS
+
+logging.disable(logging.CRITICAL)
+
+USER = {"id": 123456789, "is_bot": False, "first_name": "Abebe", "username": "abebe", "language_code": "am"}
+CHAT = {"id": 123456789, "type": "private", "first_name": "Abebe", "username": "abebe"}
+
+PAYLOADS = {
+    "text": {
+        "update_id": 100000001,
+        "message": {"message_id": 42, "date": 1700000000, "chat": CHAT, "from": USER,
+                    "text": TEXTS["buttons"]["residence"]},
+    },
+    "command": {
+        "update_id": 100000002,
+        "message": {"message_id": 43, "date": 1700000000, "chat": CHAT, "from": USER, "text": "/post",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 5}]},
+    },
+    "contact": {
+        "update_id": 100000003,
+        "message": {"message_id": 44, "date": 1700000000, "chat": CHAT, "from": USER,
+                    "contact": {"phone_number": "+251911223344", "first_name": "Abebe", "user_id": 123456789}},
+    },
+    "photo": {
+        "update_id": 100000004,
+        "message": {"message_id": 45, "date": 1700000000, "chat": CHAT, "from": USER, "photo": [
+            {"file_id": f"AgACAgQAAxkBAAIB{size}", "file_unique_id": f"AQAD{size}", "file_size": size * 40,
+             "width": size, "height": size * 3 // 4}
+            for size in (90, 320, 800, 1280)
+        ]},
+    },
+}
+
+LISTING = {
+    "property_id": "A1B2C3D4",
+    "rent_or_sell": TEXTS["buttons"]["rent"],
+    "property_use": TEXTS["buttons"]["residence"],
+    "house_type": TEXTS["buttons"]["apartment"],
+    "rooms": TEXTS["buttons"]["two_bedroom"],
+    "area": TEXTS["buttons"]["area_51_75"],
+    "location": "Bole, near <Edna Mall> & Friendship",
+    "price": "25,000",
+    "info": "Water tank, parking, 3rd floor. Available from next month.",
+    "contact": " 0911223344",
+    "posted_by": 123456789,
+    "date": "2024-05-01 10:30",
+}
+
+
+def listing_draft():
+    draft = ListingDraft()
+    for field, value in LISTING.items():
+        if field in CHOICES:
+            draft.set_choice(field, value)
+        else:
+            setattr(draft, field, value)
+    return draft
+
+
+def dispatcher(handlers, update):
+    """First handler of a state whose filters accept the update, as ConversationHandler does"""
+    def dispatch():
+        for handler in handlers:
+            if handler.check_update(update):
+                return handler
+        return None
+    return dispatch
+
+
+def build_cases():
+    bot = Bot("123456:bench-token")
+    # CommandHandler needs the bot's username; set what Bot.initialize() would fetch with getMe
+    bot._bot_user = User(123456, "Bench", is_bot=True, username="bench_bot")
+    updates = {name: Update.de_json(payload, bot) for name, payload in PAYLOADS.items()}
+    conv = main_bot.build_conversation_handler()
+    preview_text = Update.de_json({**PAYLOADS["text"], "message": {**PAYLOADS["text"]["message"],
+                                                                  "text": TEXTS["buttons"]["preview"]}}, bot)
+    return {
+        "render_caption": lambda: main_bot.captions.render(LISTING, "abebe"),
+        "cached_caption": lambda draft=listing_draft(): main_bot.captions.cached(draft, "abebe"),
+        "draft_set_choice": lambda draft=listing_draft(): draft.set_choice("property_use", TEXTS["buttons"]["office"]),
+        "normalize_shared_phone": lambda: main_bot.normalize_shared_phone("+251911223344"),
+        "normalize_typed_phone": lambda: main_bot.normalize_typed_phone("0911 22 33 44"),
+        "price_regex": lambda: main_bot.PRICE_RE.match("1,250,000.50"),
+        "create_keyboard": lambda: main_bot.create_keyboard(main_bot.PROPERTY_USE_KEYS),
+        **{f"de_json_{name}": (lambda payload=payload: Update.de_json(payload, bot))
+           for name, payload in PAYLOADS.items()},
+        "dispatch_entry": dispatcher(conv.entry_points, updates["command"]),
+        "dispatch_text_state": dispatcher(conv.states[main_bot.PROPERTY_USE], updates["text"]),
+        "dispatch_contact_state": dispatcher(conv.states[main_bot.CONTACT], updates["contact"]),
+        "dispatch_photos_photo": dispatcher(conv.states[main_bot.PHOTOS], updates["photo"]),
+        "dispatch_photos_preview": dispatcher(conv.states[main_bot.PHOTOS], preview_text),
+    }
+
+
+def measure(func, repeat, min_batch_seconds=0.05):
+    """ns per call: best and median over ``repeat`` batches sized to take ~min_batch_seconds"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - started >= min_batch_seconds:
+            break
+        number *= 2
+    per_call = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        per_call.append((time.perf_counter() - started) / number * 1e9)
+    return {"ns_per_call": min(per_call), "median_ns": statistics.median(per_call), "calls_per_batch": number}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7, help="batches per case")
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    parser.add_argument("--threshold", type=float, default=10.0, help="percent slowdown counted as a regression")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    regressions = []
+    print(f"{'case':<26}{'ns/call':>12}{'median':>12}{'vs baseline':>14}")
+    for name, func in build_cases().items():
+        if args.filter and args.filter not in name:
+            continue
+        result = results[name] = measure(func, args.repeat)
+        change = ""
+        if name in baseline:
+            delta = (result["ns_per_call"] / baseline[name]["ns_per_call"] - 1) * 100
+            change = f"{delta:+.1f}%"
+            if delta > args.threshold:
+                regressions.append(name)
+                change += " !"
+        print(f"{name:<26}{result['ns_per_call']:>12,.0f}{result['median_ns']:>12,.0f}{change:>14}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0f}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
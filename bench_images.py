@@ -0,0 +1,141 @@
+"""Benchmark of the image stage: images/s per core and bytes saved.
+
+Runs image_stage.process_image on sample photos, first inline in this
+process (one core), then through an ImageStage process pool with
+--workers processes. Sample photos are synthesized at --size unless
+--images gives real ones (e.g. the archive in PHOTO_DIR).
+
+    python bench_images.py --workers 4 --format webp
+    python bench_images.py --images 'photos/*.jpg' --max-side 1024 --quality 75
+
+Needs Pillow.
+"""
+import argparse
+import asyncio
+import glob
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+import image_stage
+from image_stage import ImageStage, process_image
+
+
+def synthetic_photos(count, width, height, quality):
+    """Noisy gradients saved as JPEG; noise keeps them about as hard to compress as photos"""
+    from PIL import Image
+
+    photos = []
+    for i in range(count):
+        gradient = Image.linear_gradient("L").rotate(i * 37 % 360).resize((width, height))
+        noise = Image.effect_noise((width, height), 24 + i % 16)
+        image = Image.merge("RGB", (gradient, noise, Image.blend(gradient, noise, 0.5)))
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=quality)
+        photos.append(out.getvalue())
+    return photos
+
+
+def load_photos(pattern):
+    photos = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            photos.append(f.read())
+    return photos
+
+
+def inline_rate(photos, options, rounds):
+    """Best images/s over ``rounds`` passes, in this process"""
+    rates = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for data in photos:
+            process_image(data, **options)
+        rates.append(len(photos) / (time.perf_counter() - started))
+    return max(rates), statistics.median(rates)
+
+
+async def pool_rate(photos, stage, rounds):
+    """Best images/s over ``rounds`` passes through the process pool, plus total output bytes"""
+    stage.start()
+    try:
+        # Start the worker processes before timing anything
+        await asyncio.gather(*(stage.process(data) for data in photos[:stage.workers]))
+        rates = []
+        out_bytes = 0
+        for _ in range(rounds):
+            started = time.perf_counter()
+            results = await asyncio.gather(*(stage.process(data) for data in photos))
+            rates.append(len(photos) / (time.perf_counter() - started))
+        web_bytes = sum(len(web) for web, _ in results)
+        thumb_bytes = sum(len(thumb) for _, thumb in results)
+        return max(rates), web_bytes, thumb_bytes
+    finally:
+        stage.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="glob of sample photos (default: synthesized)")
+    parser.add_argument("--count", type=int, default=24, help="synthesized photos")
+    parser.add_argument("--size", default="2560x1920", help="synthesized photo size, WxH")
+    parser.add_argument("--source-quality", type=int, default=92, help="JPEG quality of synthesized photos")
+    parser.add_argument("--format", choices=sorted(image_stage.FORMATS), default="jpeg")
+    parser.add_argument("--max-side", type=int, default=1280)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--thumb-side", type=int, default=320)
+    parser.add_argument("--thumb-quality", type=int, default=70)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes in the pool")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if not image_stage.available():
+        sys.exit("Pillow isn't installed")
+
+    if args.images:
+        photos = load_photos(args.images)
+        if not photos:
+            sys.exit(f"No photos match {args.images}")
+    else:
+        width, height = map(int, args.size.split("x"))
+        photos = synthetic_photos(args.count, width, height, args.source_quality)
+
+    options = dict(pil_format=image_stage.FORMATS[args.format][0], max_side=args.max_side, quality=args.quality,
+                   thumb_side=args.thumb_side, thumb_quality=args.thumb_quality)
+    stage = ImageStage(args.format, max_side=args.max_side, quality=args.quality, thumb_side=args.thumb_side,
+                       thumb_quality=args.thumb_quality, workers=args.workers)
+
+    best_inline, median_inline = inline_rate(photos, options, args.rounds)
+    best_pool, web_bytes, thumb_bytes = asyncio.run(pool_rate(photos, stage, args.rounds))
+    in_bytes = sum(map(len, photos))
+
+    results = {
+        "photos": len(photos),
+        "format": args.format,
+        "workers": args.workers,
+        "images_per_s_one_core": best_inline,
+        "images_per_s_one_core_median": median_inline,
+        "images_per_s_pool": best_pool,
+        "images_per_s_per_worker": best_pool / args.workers,
+        "bytes_in": in_bytes,
+        "bytes_web": web_bytes,
+        "bytes_thumb": thumb_bytes,
+        "web_size_ratio": in_bytes / web_bytes,
+    }
+    print(f"{len(photos)} photos, {in_bytes / len(photos) / 1024:.0f} KiB each on average")
+    print(f"one core:          {best_inline:8.1f} images/s (median {median_inline:.1f})")
+    print(f"{args.workers} worker process(es): {best_pool:8.1f} images/s, {best_pool / args.workers:.1f} per worker")
+    print(f"web-size {args.format}: {web_bytes / len(photos) / 1024:.0f} KiB each "
+          f"({results['web_size_ratio']:.1f}x smaller), thumbnails {thumb_bytes / len(photos) / 1024:.1f} KiB each")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
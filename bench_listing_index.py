@@ -0,0 +1,142 @@
+"""Benchmark of ListingIndex: load time and search latency over synthetic listings.
+
+Builds an index of --rows sheet rows (facet values from the bot's buttons,
+a few dozen locations, round prices spread over 1,000 to 50,000,000 birr),
+then times a set of searches. Each case is run in batches; the best batch
+gives ms per search.
+
+    python bench_listing_index.py --rows 100000
+    python bench_listing_index.py --max-ms 1 --json results.json
+
+Cases listed in NARROW are expected to stay under --max-ms; if one doesn't,
+the exit status is 1.
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+from listing_index import FACET_COLUMNS, ListingIndex
+from texts_am import TEXTS
+
+# Facet cells hold the button texts, as written by the /post conversation
+FACET_KEYS = {
+    "rent_or_sell": ["rent", "sell"],
+    "property_use": ["residence", "shop", "office", "cafe", "warehouse", "other"],
+    "house_type": ["traditional", "condominium", "apartment", "compound_villa"],
+    "rooms": ["single_room", "one_bedroom", "two_bedroom", "three_bedroom", "more_than_three"],
+    "area": ["area_small", "area_16_25", "area_26_50", "area_51_75", "area_76_110", "area_large"],
+}
+LOCATIONS = [
+    "Bole", "Bole Atlas", "Bole Bulbula", "CMC", "Summit", "Ayat", "Gerji", "Megenagna", "Piassa", "Kazanchis",
+    "Sarbet", "Mexico", "Lebu", "Jemo", "Kality", "Akaki", "Kotebe", "Lafto", "Gullele", "Shiro Meda",
+    "ቦሌ", "ሲኤምሲ", "አያት", "ገርጂ", "መገናኛ", "ፒያሳ", "ካዛንችስ", "ሳርቤት", "ለቡ", "ጀሞ",
+]
+
+BUTTONS = TEXTS["buttons"]
+
+# Searches that have to stay interactive whatever the index size
+NARROW = ("price_narrow", "price_narrow_facets", "price_narrow_location", "price_narrow_empty")
+
+
+def synthetic_rows(count, seed):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        price = 10 ** rng.uniform(3, 7.7)
+        # Asking prices are round: two or three significant figures
+        price = round(price, rng.choice((1, 2)) - len(str(int(price))))
+        row = [f"AM{i:07d}", *([""] * len(FACET_COLUMNS)),
+               f"{rng.choice(LOCATIONS)} {rng.randrange(1, 30)}", f"{price:,.0f}"]
+        for field, column in FACET_COLUMNS.items():
+            row[column] = BUTTONS[rng.choice(FACET_KEYS[field])]
+        rows.append(row)
+    return rows
+
+
+def build_cases(index):
+    return {
+        "price_narrow": lambda: index.search(min_price=5001, max_price=5999),
+        "price_narrow_facets": lambda: index.search(
+            facets={"rent_or_sell": BUTTONS["rent"], "house_type": BUTTONS["condominium"]},
+            min_price=5001, max_price=5999),
+        "price_narrow_location": lambda: index.search(location="bole", min_price=5001, max_price=5999),
+        "price_narrow_empty": lambda: index.search(min_price=5001, max_price=5099),
+        "price_exact": lambda: index.search(min_price=15000, max_price=15000),
+        "price_min_only": lambda: index.search(min_price=1_000_000),
+        "price_max_only": lambda: index.search(max_price=8000),
+        "price_wide": lambda: index.search(min_price=2000, max_price=20_000_000),
+        "facets_only": lambda: index.search(
+            facets={"rent_or_sell": BUTTONS["sell"], "rooms": BUTTONS["three_bedroom"]}),
+        "location_only": lambda: index.search(location="ayat"),
+        "no_match": lambda: index.search(
+            facets={"rooms": BUTTONS["single_room"], "area": BUTTONS["area_large"]}, min_price=1, max_price=2),
+    }
+
+
+def measure(func, repeat, min_batch_seconds=0.05):
+    """ms per call: best and median over ``repeat`` batches sized to take ~min_batch_seconds"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - started >= min_batch_seconds:
+            break
+        number *= 2
+    per_call = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        per_call.append((time.perf_counter() - started) / number * 1e3)
+    return {"ms_per_call": min(per_call), "median_ms": statistics.median(per_call), "calls_per_batch": number}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="listings in the index")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=7, help="batches per case")
+    parser.add_argument("--max-ms", type=float, default=1.0, help="latency budget for the NARROW cases")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows, args.seed)
+    index = ListingIndex()
+    started = time.perf_counter()
+    index.load(rows)
+    load_seconds = time.perf_counter() - started
+    # Then some listings confirmed while the bot runs, one at a time
+    started = time.perf_counter()
+    for row in synthetic_rows(1000, args.seed + 1):
+        row[0] = "N" + row[0]
+        index.add(row)
+    add_us = (time.perf_counter() - started) / 1000 * 1e6
+    print(f"{len(index):,} listings: load {load_seconds:.2f} s, add {add_us:.0f} us each")
+
+    results = {}
+    over_budget = []
+    print(f"{'case':<24}{'ms/search':>12}{'median':>12}{'results':>10}")
+    for name, func in build_cases(index).items():
+        result = results[name] = measure(func, args.repeat)
+        flag = ""
+        if name in NARROW and result["ms_per_call"] > args.max_ms:
+            over_budget.append(name)
+            flag = " !"
+        print(f"{name:<24}{result['ms_per_call']:>12.3f}{result['median_ms']:>12.3f}{len(func()):>10}{flag}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": len(index), "load_seconds": load_seconds, "add_us": add_us, "results": results},
+                      f, indent=2)
+
+    if over_budget:
+        print(f"\n{len(over_budget)} case(s) over {args.max_ms} ms: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Micro-benchmark for the webhook ingestion path.
+
+Runs WebhookIngestor in a separate single-threaded process (so the figure is
+requests/s for one core) and hammers /webhook with concurrent POSTs of a
+representative update. Decoded updates are drained as fast as they arrive.
+
+    python bench_webhook.py --seconds 10 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+
+import aiohttp
+from aiohttp import web
+
+SECRET = "bench-secret"
+
+SAMPLE_UPDATE = {
+    "update_id": 100000001,
+    "message": {
+        "message_id": 42,
+        "date": 1700000000,
+        "chat": {"id": 123456789, "type": "private", "first_name": "Abebe", "username": "abebe"},
+        "from": {"id": 123456789, "is_bot": False, "first_name": "Abebe", "username": "abebe",
+                 "language_code": "am"},
+        "text": "🏠 #የመኖሪያ",
+    },
+}
+
+
+def serve(port, ready):
+    from telegram import Bot
+    from webhook_ingest import WebhookIngestor
+
+    async def run():
+        update_queue = asyncio.Queue()
+        ingestor = WebhookIngestor(Bot("123456:bench-token"), update_queue, SECRET, max_pending=10000)
+        ingestor.start()
+
+        async def drain():
+            while True:
+                await update_queue.get()
+
+        asyncio.create_task(drain())
+        app = web.Application()
+        app.router.add_post("/webhook", ingestor.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+async def hammer(port, seconds, concurrency):
+    url = f"http://127.0.0.1:{port}/webhook"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET, "Content-Type": "application/json"}
+    counts = {"ok": 0, "other": 0}
+    deadline = time.perf_counter() + seconds
+
+    async def worker(session, offset):
+        update = dict(SAMPLE_UPDATE)
+        n = offset
+        while time.perf_counter() < deadline:
+            update["update_id"] = n
+            n += concurrency
+            async with session.post(url, data=json.dumps(update), headers=headers) as resp:
+                await resp.read()
+                counts["ok" if resp.status == 200 else "other"] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session, i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return counts, elapsed
+
+
+def bench_decoders(rounds=20000):
+    from webhook_ingest import json_loads
+
+    body = json.dumps(SAMPLE_UPDATE).encode()
+    results = {}
+    for name, loads in (("json", json.loads), ("webhook_ingest", json_loads)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            loads(body)
+        results[name] = rounds / (time.perf_counter() - started)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=18443)
+    args = parser.parse_args()
+
+    for name, rate in bench_decoders().items():
+        print(f"decode {name:<16} {rate:12,.0f} bodies/s")
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.port, ready), daemon=True)
+    server.start()
+    ready.wait(30)
+    try:
+        counts, elapsed = asyncio.run(hammer(args.port, args.seconds, args.concurrency))
+    finally:
+        server.terminate()
+    total = counts["ok"] + counts["other"]
+    print(f"webhook: {total} requests in {elapsed:.1f}s, {counts['other']} non-200, "
+          f"{total / elapsed:,.0f} requests/s on one server core")
+
+
+if __name__ == "__main__":
+    main()
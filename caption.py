@@ -0,0 +1,126 @@
+import html
+
+# Telegram's limit for a photo caption, counted after HTML entities are parsed,
+# in UTF-16 code units (most emoji are two)
+CAPTION_LIMIT = 1024
+
+# Caption lines in order: (TEXTS["messages"] template, listing field)
+LINES = (
+    ("property_id", "property_id"),
+    ("rent_or_sell", "rent_or_sell"),
+    ("property_use", "property_use"),
+    ("house_type", "house_type"),
+    ("rooms", "rooms"),
+    ("area", "area"),
+    ("location", "location"),
+    ("price", "price"),
+    ("details", "info"),
+    ("contact", "contact"),
+    ("posted_by", "username"),
+    ("date", "date"),
+)
+# Lines left out when the listing has no value for them (non-residential)
+OPTIONAL_FIELDS = ("house_type", "rooms")
+# Free-text fields shortened, in this order, when a caption is over the limit
+TRUNCATABLE_FIELDS = ("info", "location")
+
+FULL = tuple(field for _, field in LINES)
+VARIANTS = {
+    "preview": FULL,
+    "channel": FULL,
+    "no_id": tuple(field for field in FULL if field != "property_id"),
+}
+
+
+def utf16_len(text):
+    """Length as Telegram counts it"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _utf16_prefix(text, units):
+    """The longest prefix of text at most ``units`` UTF-16 code units long"""
+    # A surrogate pair cut in half can't be decoded and is dropped
+    return text.encode("utf-16-le")[:units * 2].decode("utf-16-le", errors="ignore")
+
+
+class CaptionRenderer:
+    """Listing captions from the TEXTS templates, compiled once.
+
+    For each variant's layout and each combination of optional lines the
+    templates are joined into one str.format template with named fields, so
+    rendering is a single format_map call over the escaped values. Length is
+    checked against the unescaped values (Telegram counts &amp; as one
+    character), in UTF-16 code units like Telegram, and the free-text fields are shortened if it's over the limit.
+
+    ``cached`` keeps the result on a ListingDraft, which drops it whenever
+    one of its fields is assigned.
+    """
+
+    def __init__(self, messages, limit=CAPTION_LIMIT):
+        self.limit = limit
+        self._layouts = {}
+        self._variant_layout = {}
+        for variant, fields in VARIANTS.items():
+            for name, (layout_fields, _) in self._layouts.items():
+                if layout_fields == fields:
+                    self._variant_layout[variant] = name
+                    break
+            else:
+                self._layouts[variant] = (fields, self._compile(messages, fields))
+                self._variant_layout[variant] = variant
+
+    @staticmethod
+    def _compile(messages, fields):
+        """{(has house_type, has rooms): (template, length of its literal text)}"""
+        compiled = {}
+        for present in ((True, True), (True, False), (False, True), (False, False)):
+            skipped = {field for field, on in zip(OPTIONAL_FIELDS, present) if not on}
+            literal = messages["preview_title"].replace("{", "{{").replace("}", "}}")
+            literal_len = utf16_len(messages["preview_title"])
+            for template_key, field in LINES:
+                if field not in fields or field in skipped:
+                    continue
+                before, after = messages[template_key].split("{}")
+                literal += before.replace("{", "{{").replace("}", "}}") + "{" + field + "}"
+                literal += after.replace("{", "{{").replace("}", "}}")
+                literal_len += utf16_len(before) + utf16_len(after)
+            footer = "\n\n" + messages["footer"]
+            literal += footer.replace("{", "{{").replace("}", "}}")
+            literal_len += utf16_len(footer)
+            compiled[present] = (literal, literal_len)
+        return compiled
+
+    def _values(self, data, username, fields):
+        values = {field: str(data[field]) for field in fields if field != "username" and field in data}
+        if "username" in fields:
+            values["username"] = str(username)
+        return values
+
+    def render(self, data, username, variant="preview"):
+        """Caption for a mapping of field values (see LINES) and the poster's name"""
+        fields, compiled = self._layouts[self._variant_layout[variant]]
+        values = self._values(data, username, fields)
+        template, literal_len = compiled[tuple(field in values for field in OPTIONAL_FIELDS)]
+
+        overflow = literal_len + sum(map(utf16_len, values.values())) - self.limit
+        for field in TRUNCATABLE_FIELDS:
+            if overflow <= 0:
+                break
+            if field in values:
+                text = values[field]
+                keep = max(0, utf16_len(text) - overflow - 1)
+                values[field] = _utf16_prefix(text, keep) + "…"
+                overflow -= utf16_len(text) - utf16_len(values[field])
+
+        return template.format_map({field: html.escape(value) for field, value in values.items()})
+
+    def cached(self, draft, username, variant="preview"):
+        """Rendered caption kept on the draft until one of its fields changes"""
+        cache = draft.captions
+        if cache is None or cache.get("username") != username:
+            cache = draft.captions = {"username": username}
+        layout = self._variant_layout[variant]
+        caption = cache.get(layout)
+        if caption is None:
+            caption = cache[layout] = self.render(draft.caption_values(), username, variant)
+        return caption
@@ -0,0 +1,311 @@
+import asyncio
+import base64
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+from telegram.error import BadRequest, Forbidden
+
+from metrics import REGISTRY
+from sheets_client import a1
+from sheets_quota import READ, WRITE
+
+logger = logging.getLogger(__name__)
+
+DRIVE_CALL_SECONDS = REGISTRY.histogram("drive_call_seconds", "Latency of Google Drive calls", ["call"])
+DRIVE_CALL_ERRORS = REGISTRY.counter("drive_call_errors", "Failed Google Drive calls", ["call"])
+DRIVE_PHOTOS_UPLOADED = REGISTRY.counter("drive_photos_uploaded", "Listing photos uploaded to Google Drive")
+DRIVE_LISTINGS_ABANDONED = REGISTRY.counter("drive_listings_abandoned",
+                                            "Listings whose photos couldn't be archived, left for the next start")
+DRIVE_WRITEBACKS_ABANDONED = REGISTRY.counter(
+    "drive_writebacks_abandoned", "Archived listings whose sheet row never turned up, left for the next start"
+)
+
+# Drive accepts at most 100 calls in one batch request
+MAX_BATCH_CALLS = 100
+# Resumable upload chunks must be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _permanent(error):
+    """Errors that retrying the same upload won't fix (e.g. a file_id Telegram rejects)"""
+    if isinstance(error, (BadRequest, Forbidden)):
+        return True
+    if isinstance(error, HttpError):
+        return 400 <= error.resp.status < 500 and error.resp.status not in (408, 429)
+    return False
+
+
+class DriveArchiver:
+    """Copies posted listings' photos to a Drive folder in the background.
+
+    ``enqueue`` records the listing in the store and returns at once. Upload
+    workers fetch each photo from Telegram with ``fetch_photo(bot, file_id)`` and
+    upload it with a resumable upload on a bounded thread pool (the
+    discovery client blocks, and each pool thread has a client of its own).
+    Every finished photo is saved to the store, so after a restart only the
+    missing ones are uploaded. With an ``image_stage`` the web-size version
+    is uploaded instead of the original, and its thumbnail goes along as the
+    file's Drive thumbnail in the same call. A failed listing is queued
+    again after a backoff, without holding up its worker, up to
+    ``max_attempts`` times; after that, or straight away on an error that
+    won't go away (Telegram rejecting a file_id, a 4xx from Drive), it is
+    left in the store and tried again on the next start.
+
+    Uploaded listings are then handled in batches: one batch request makes
+    the files readable by link (when ``public``), and one read of the sheet's
+    ID column plus one batch_update writes the Drive file IDs into the
+    listing's row starting at ``drive_column``. Listings whose row hasn't
+    reached the sheet yet wait for the next batch; while a batch finds none
+    of its rows, the sheet is read less and less often, and a listing still
+    missing after ``max_attempts`` reads is left in the store for the next
+    start. Sheets calls go through the shared ``governor``. Failures are
+    retried with backoff; nothing here ever blocks a handler.
+    """
+
+    def __init__(self, fetch_photo, new_drive_service, sheets, governor, store, folder_id, drive_column,
+                 workers=2, batch_size=20, flush_interval=5.0, public=True, image_stage=None,
+                 retry_delay=5.0, max_retry_delay=300.0, max_attempts=8):
+        self._fetch_photo = fetch_photo
+        self._new_drive_service = new_drive_service
+        self.sheets = sheets
+        self.governor = governor
+        self.store = store
+        self.folder_id = folder_id
+        self.drive_column = drive_column
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.public = public
+        self.image_stage = image_stage
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self._retries = set()
+        self._local = threading.local()
+        self._pool = None
+        self._queue = None
+        self._uploaded = []  # (property_id, drive_ids) waiting for sharing and the sheet
+        self._uploaded_event = None
+        self._shared = set()
+        self._misses = {}  # property_id -> sheet reads that didn't find its row
+        self._tasks = []
+        self.bot = None
+
+    def start(self, bot):
+        """Start the workers and pick up listings left over from the last run."""
+        if self._tasks:
+            return
+        self.bot = bot
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="drive")
+        self._queue = asyncio.Queue()
+        self._uploaded_event = asyncio.Event()
+        for property_id, file_ids, drive_ids in self.store.pending_photo_uploads():
+            self._queue.put_nowait((property_id, file_ids, drive_ids, 0))
+        self._tasks = [asyncio.create_task(self._upload_worker(), name=f"drive-upload-{i}")
+                       for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._finish_worker(), name="drive-finish"))
+
+    async def stop(self):
+        """Stop the workers; unfinished listings stay in the store for the next start."""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def enqueue(self, property_id, file_ids):
+        """Queue a posted listing's photos (Telegram file_ids) for the archive."""
+        if not file_ids:
+            return
+        self.store.queue_photo_upload(property_id, file_ids)
+        self._queue.put_nowait((property_id, list(file_ids), [None] * len(file_ids), 0))
+
+    def depth(self):
+        """Listings not yet archived and written back to the sheet."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._retries) + len(self._uploaded)
+
+    def _drive(self):
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self._new_drive_service()
+        return service
+
+    async def _in_pool(self, call, func, *args):
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+        except Exception:
+            DRIVE_CALL_ERRORS.labels(call).inc()
+            raise
+        finally:
+            DRIVE_CALL_SECONDS.labels(call).observe(time.perf_counter() - started)
+
+    def _upload(self, name, data, mime_type="image/jpeg", thumbnail=None):
+        media = MediaIoBaseUpload(io.BytesIO(data), mimetype=mime_type,
+                                  chunksize=UPLOAD_CHUNK_SIZE, resumable=True)
+        body = {"name": name, "parents": [self.folder_id]}
+        if thumbnail is not None:
+            body["contentHints"] = {"thumbnail": {
+                "image": base64.urlsafe_b64encode(thumbnail).decode(), "mimeType": mime_type,
+            }}
+        request = self._drive().files().create(body=body, media_body=media, fields="id")
+        response = None
+        while response is None:
+            # Each chunk is retried on its own; a dropped connection resumes where it stopped
+            _, response = request.next_chunk(num_retries=3)
+        return response["id"]
+
+    async def _upload_listing(self, property_id, file_ids, drive_ids):
+        for i, file_id in enumerate(file_ids):
+            if drive_ids[i] is not None:
+                continue
+            data = await self._fetch_photo(self.bot, file_id)
+            name, mime_type, thumbnail = f"{property_id}_{i + 1}.jpg", "image/jpeg", None
+            if self.image_stage is not None:
+                try:
+                    data, thumbnail = await self.image_stage.process(data)
+                except Exception as e:
+                    logger.warning(f"Could not resize photo {i + 1} of listing {property_id}, "
+                                   f"uploading it as downloaded: {e}")
+                else:
+                    name = f"{property_id}_{i + 1}{self.image_stage.extension}"
+                    mime_type = self.image_stage.mime_type
+            drive_ids[i] = await self._in_pool("upload", self._upload, name, data, mime_type, thumbnail)
+            DRIVE_PHOTOS_UPLOADED.inc()
+            self.store.save_drive_ids(property_id, drive_ids)
+
+    def _retry(self, item):
+        def requeue():
+            self._retries.discard(handle)
+            self._queue.put_nowait(item)
+
+        handle = asyncio.get_running_loop().call_later(
+            min(self.retry_delay * 2 ** (item[3] - 1), self.max_retry_delay), requeue
+        )
+        self._retries.add(handle)
+
+    async def _upload_worker(self):
+        while True:
+            property_id, file_ids, drive_ids, attempts = await self._queue.get()
+            try:
+                await self._upload_listing(property_id, file_ids, drive_ids)
+            except Exception as e:
+                attempts += 1
+                if _permanent(e) or attempts >= self.max_attempts:
+                    DRIVE_LISTINGS_ABANDONED.inc()
+                    logger.error(f"Giving up on the photos of listing {property_id} after {attempts} attempts "
+                                 f"until the next start: {e}")
+                else:
+                    logger.error(f"Uploading photos of listing {property_id} failed, retrying later: {e}")
+                    self._retry((property_id, file_ids, drive_ids, attempts))
+                continue
+            self._uploaded.append((property_id, drive_ids))
+            if len(self._uploaded) >= self.batch_size:
+                self._uploaded_event.set()
+
+    def _share(self, drive_ids):
+        failures = []
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                failures.append(exception)
+
+        for start in range(0, len(drive_ids), MAX_BATCH_CALLS):
+            service = self._drive()
+            batch = service.new_batch_http_request(callback=collect)
+            for drive_id in drive_ids[start:start + MAX_BATCH_CALLS]:
+                batch.add(service.permissions().create(
+                    fileId=drive_id, body={"type": "anyone", "role": "reader"}, fields="id"
+                ))
+            batch.execute()
+        if failures:
+            raise failures[0]
+
+    async def _write_back(self, listings):
+        """Write Drive IDs into the listings' rows; returns the property IDs found in the sheet"""
+        (columns,) = await self.governor.call(READ, "batch_get", self.sheets.batch_get, ["A:A"], "COLUMNS")
+        ids = columns[0] if columns else []
+        rows = {property_id: n for n, property_id in enumerate(ids, start=1)}
+        data = []
+        written = []
+        for property_id, drive_ids in listings:
+            n = rows.get(property_id)
+            if n is None:
+                continue
+            first = a1(n, self.drive_column)
+            last = a1(n, self.drive_column + len(drive_ids) - 1)
+            data.append({"range": f"{first}:{last}", "values": [drive_ids]})
+            written.append(property_id)
+        if data:
+            await self.governor.call(WRITE, "batch_update", self.sheets.batch_update, data)
+        return written
+
+    def _requeue_missing(self, batch, written):
+        """Put back the batch's listings whose rows weren't found, unless they've been missing too long"""
+        for property_id, drive_ids in batch:
+            if property_id in written:
+                self._misses.pop(property_id, None)
+                continue
+            misses = self._misses.get(property_id, 0) + 1
+            if misses < self.max_attempts:
+                self._misses[property_id] = misses
+                self._uploaded.append((property_id, drive_ids))
+                continue
+            del self._misses[property_id]
+            self._shared.discard(property_id)
+            DRIVE_WRITEBACKS_ABANDONED.inc()
+            logger.error(f"Row of listing {property_id} not in the sheet after {misses} reads, "
+                         f"leaving its Drive IDs for the next start")
+
+    async def _finish_worker(self):
+        delay = self.retry_delay
+        wait = self.flush_interval
+        while True:
+            try:
+                await asyncio.wait_for(self._uploaded_event.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            self._uploaded_event.clear()
+            if not self._uploaded:
+                continue
+            batch = self._uploaded[:self.batch_size]
+            try:
+                unshared = [item for item in batch if item[0] not in self._shared]
+                if self.public and unshared:
+                    await self._in_pool("share", self._share,
+                                        [drive_id for _, drive_ids in unshared for drive_id in drive_ids])
+                    self._shared.update(property_id for property_id, _ in unshared)
+                written = await self._write_back(batch)
+            except Exception as e:
+                logger.error(f"Finishing {len(batch)} archived listings failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            delay = self.retry_delay
+            del self._uploaded[:len(batch)]
+            self.store.mark_photos_archived(written)
+            self._shared.difference_update(written)
+            # Rows still on their way to the sheet are tried again with a later batch
+            self._requeue_missing(batch, set(written))
+            if written:
+                wait = self.flush_interval
+                logger.info(f"Archived photos of {len(written)} listings to Google Drive")
+            else:
+                wait = min(wait * 2, self.max_retry_delay)
+            if len(self._uploaded) >= self.batch_size:
+                self._uploaded_event.set()
@@ -0,0 +1,55 @@
+from urllib.parse import urlsplit
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from google.oauth2.service_account import Credentials
+
+# Hosts the Drive client talks to; redirected as a whole when api_url is set
+GOOGLE_API_HOSTS = ("https://www.googleapis.com/",)
+DRIVE_SCOPES = ("https://www.googleapis.com/auth/drive",)
+
+
+class _RedirectHttp(httplib2.Http):
+    """Sends requests for the Google API hosts to another root URL instead.
+
+    The discovery-based Drive client builds upload and batch URLs from the discovery document's
+    rootUrl, which ``client_options`` doesn't change, so they are rewritten here.
+    """
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root.rstrip("/")
+
+    def request(self, uri, *args, **kwargs):
+        if uri.startswith(GOOGLE_API_HOSTS):
+            parts = urlsplit(uri)
+            uri = self.root + parts.path + (f"?{parts.query}" if parts.query else "")
+        return super().request(uri, *args, **kwargs)
+
+
+class GoogleClients:
+    """Builds Drive clients (Sheets calls go through AsyncSheetsClient).
+
+    Nothing touches the network until a client is requested, and nothing
+    requests one unless the Drive archive is enabled, so module import and
+    process start stay fast.
+
+    ``api_url`` points the clients at another server (e.g. the local stand-in
+    used by loadtest_bot.py) instead of googleapis.com.
+
+    Discovery clients aren't thread-safe; code that uses Drive from several
+    threads at once gets one client per thread from ``new_drive_service``.
+    """
+
+    def __init__(self, credentials_file, api_url=None):
+        self.credentials_file = credentials_file
+        self.api_url = api_url
+
+    def new_drive_service(self):
+        """A Drive client of its own (blocking), e.g. for one worker thread"""
+        creds = Credentials.from_service_account_file(self.credentials_file, scopes=DRIVE_SCOPES)
+        if self.api_url:
+            http = AuthorizedHttp(creds, http=_RedirectHttp(self.api_url))
+            return build('drive', 'v3', http=http, cache_discovery=False)
+        return build('drive', 'v3', credentials=creds, cache_discovery=False)
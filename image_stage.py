@@ -0,0 +1,96 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it photos are archived as downloaded
+    Image = None
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STAGE_SECONDS = REGISTRY.histogram("image_stage_seconds", "Time to resize and recompress one photo")
+IMAGE_STAGE_BYTES = REGISTRY.counter("image_stage_bytes", "Photo bytes going into and out of the image stage",
+                                     ["direction"])
+
+FORMATS = {
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+}
+
+
+def available():
+    return Image is not None
+
+
+def _encode(image, pil_format, quality):
+    out = io.BytesIO()
+    if pil_format == "JPEG":
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(out, "WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+def process_image(data, pil_format="JPEG", max_side=1280, quality=80, thumb_side=320, thumb_quality=70):
+    """(web-size image, thumbnail) for a downloaded photo. CPU-bound; runs in a worker process."""
+    with Image.open(io.BytesIO(data)) as source:
+        # Phones store rotation in EXIF, which re-encoding would drop
+        image = ImageOps.exif_transpose(source).convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    web = _encode(image, pil_format, quality)
+    image.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+    thumb = _encode(image, pil_format, thumb_quality)
+    return web, thumb
+
+
+class ImageStage:
+    """Resizes and recompresses photos on their way into an archive.
+
+    Each photo becomes a web-size image (longer side at most ``max_side``) and
+    a thumbnail (at most ``thumb_side``), both JPEG or WebP. The work runs in
+    a pool of ``workers`` processes so neither the event loop nor the other
+    threads wait on it. The workers are forked as soon as the stage starts:
+    start it before anything else creates threads. (spawn and forkserver
+    workers would re-import the bot's main module.)
+    """
+
+    def __init__(self, image_format="jpeg", max_side=1280, quality=80, thumb_side=320, thumb_quality=70,
+                 workers=1):
+        if image_format not in FORMATS:
+            raise ValueError(f"Unknown image format {image_format!r}")
+        self.pil_format, self.extension, self.mime_type = FORMATS[image_format]
+        self.max_side = max_side
+        self.quality = quality
+        self.thumb_side = thumb_side
+        self.thumb_quality = thumb_quality
+        self.workers = workers
+        self._pool = None
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+            # A fork pool creates all its workers on the first submit
+            self._pool.submit(available).result()
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def process(self, data):
+        """(web-size image, thumbnail) bytes for a photo"""
+        started = time.perf_counter()
+        web, thumb = await asyncio.get_running_loop().run_in_executor(
+            self._pool, process_image, data, self.pil_format, self.max_side, self.quality,
+            self.thumb_side, self.thumb_quality,
+        )
+        IMAGE_STAGE_SECONDS.observe(time.perf_counter() - started)
+        IMAGE_STAGE_BYTES.labels("in").inc(len(data))
+        IMAGE_STAGE_BYTES.labels("out").inc(len(web) + len(thumb))
+        return web, thumb
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import time
+
+from metrics import REGISTRY
+from photo_spool import DRAFT_PHOTO_PREFIX, LISTING_PHOTO_PREFIX
+
+logger = logging.getLogger(__name__)
+
+DRAFTS_EVICTED = REGISTRY.counter("janitor_drafts_evicted", "Abandoned /post drafts evicted")
+FILES_REMOVED = REGISTRY.counter("janitor_files_removed", "Photo files deleted by the janitor", ["reason"])
+
+
+class Janitor:
+    """Evicts abandoned /post drafts and keeps the photo directory bounded.
+
+    Every ``interval`` seconds, drafts idle for longer than ``ttl`` have their
+    photos discarded from ``spool`` and their user's data and conversation state dropped,
+    in memory and in the persistence. Users whose saved state hasn't been
+    touched for ``ttl`` (they never came back after a restart) are dropped
+    from the persistence too. The photo directory is then swept: draft photos
+    older than ``ttl`` that no live draft refers to are deleted (drafts saved
+    in the persistence count as live, even before their user's data is
+    loaded again after a restart), and if the
+    directory is over ``disk_quota`` bytes the oldest files that nothing
+    refers to go first, archived listing photos before draft leftovers.
+    ``on_evict(user_id)`` is called for every user dropped.
+    """
+
+    def __init__(self, application, persistence, spool, ttl, conversation_name,
+                 interval=600, disk_quota=200 * 1024 * 1024, listing_store=None, on_evict=None):
+        self.application = application
+        self.persistence = persistence
+        self.spool = spool
+        self.photo_dir = spool.photo_dir
+        self.ttl = ttl
+        self.conversation_name = conversation_name
+        self.interval = interval
+        self.disk_quota = disk_quota
+        self.listing_store = listing_store
+        self.on_evict = on_evict
+        self.photo_bytes = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Janitor pass failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        now = time.time()
+        evicted = await self.evict_idle_drafts(now)
+        evicted += await self.evict_stale_saved_users(now)
+        referenced = self.referenced_photos()
+        removed = await asyncio.to_thread(self.sweep_photos, referenced, now)
+        if self.listing_store is not None:
+            await asyncio.to_thread(self.listing_store.prune_delivered)
+        if evicted or removed:
+            logger.info(f"Janitor evicted {evicted} idle drafts and removed {removed} photo files "
+                        f"({self.photo_bytes / 1e6:.1f} MB of photos kept)")
+
+    def _remove(self, path, reason):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+            return False
+        FILES_REMOVED.labels(reason).inc()
+        return True
+
+    async def _drop_user(self, user_id):
+        self.application.drop_user_data(user_id)
+        # /post runs in private chats, so the conversation key is (chat, user) = (user, user)
+        await self.persistence.update_conversation(self.conversation_name, (user_id, user_id), None)
+        if self.on_evict is not None:
+            self.on_evict(user_id)
+
+    async def evict_idle_drafts(self, now):
+        evicted = 0
+        for user_id, data in list(self.application.user_data.items()):
+            draft = data.get("draft")
+            if draft is None:
+                continue
+            if draft.updated_at is None:
+                # Restored from an older save without a timestamp; start its clock now
+                draft.updated_at = now
+                continue
+            if now - draft.updated_at < self.ttl:
+                continue
+            await self.spool.discard(draft.photo_refs)
+            await self._drop_user(user_id)
+            DRAFTS_EVICTED.inc()
+            evicted += 1
+        return evicted
+
+    async def evict_stale_saved_users(self, now):
+        stale = [user_id for user_id in self.persistence.stale_user_ids(now - self.ttl)
+                 if user_id not in self.application.user_data]
+        for user_id in stale:
+            await self._drop_user(user_id)
+        return len(stale)
+
+    def referenced_photos(self):
+        """Photo refs of every live draft, in memory or saved but not loaded since a restart"""
+        in_memory = self.application.user_data
+        saved = self.persistence.saved_user_data(skip=in_memory.keys())
+        return {
+            path
+            for data in (*in_memory.values(), *(data for _, data in saved))
+            if data.get("draft") is not None
+            for path in data["draft"].photo_refs
+        }
+
+    def sweep_photos(self, referenced, now=None):
+        """Delete orphaned draft photos, then the oldest unreferenced files while over quota"""
+        now = time.time() if now is None else now
+        files = []
+        try:
+            with os.scandir(self.photo_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith((".jpg", ".webp")) or not entry.is_file():
+                        continue
+                    if not entry.name.startswith((DRAFT_PHOTO_PREFIX, LISTING_PHOTO_PREFIX)):
+                        continue
+                    stat = entry.stat()
+                    files.append((entry.path, entry.name, stat.st_size, stat.st_mtime))
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        kept = []
+        for path, name, size, mtime in files:
+            orphan = (name.startswith(DRAFT_PHOTO_PREFIX) and path not in referenced
+                      and now - mtime > self.ttl)
+            if orphan and self._remove(path, "orphan"):
+                removed += 1
+            else:
+                kept.append((path, name, size, mtime))
+
+        total = sum(size for _, _, size, _ in kept)
+        if total > self.disk_quota:
+            # Oldest first; archived listing photos before draft leftovers
+            candidates = sorted(
+                (f for f in kept if f[0] not in referenced),
+                key=lambda f: (not f[1].startswith(LISTING_PHOTO_PREFIX), f[3]),
+            )
+            for path, _, size, _ in candidates:
+                if total <= self.disk_quota:
+                    break
+                if self._remove(path, "quota"):
+                    removed += 1
+                    total -= size
+            if total > self.disk_quota:
+                logger.warning(f"Photo directory still over quota ({total / 1e6:.1f} MB) with live drafts only")
+        self.photo_bytes = total
+        return removed
@@ -0,0 +1,154 @@
+from texts_am import TEXTS
+
+# Keyboard answers are stored as their index in these tuples. The codes are
+# persisted with in-progress drafts: only ever append, never reorder or remove.
+CHOICES = {
+    "rent_or_sell": ("rent", "sell"),
+    "property_use": ("residence", "shop", "office", "cafe", "warehouse", "other"),
+    "house_type": ("traditional", "condominium", "apartment", "compound_villa"),
+    "rooms": ("single_room", "one_bedroom", "two_bedroom", "three_bedroom", "more_than_three"),
+    "area": ("area_small", "area_16_25", "area_26_50", "area_51_75", "area_76_110", "area_large"),
+}
+NOT_APPLICABLE = -1  # house type and rooms of warehouse / other listings
+NOT_APPLICABLE_TEXT = "N/A"
+
+# Button text -> code for each field. Telegram drops trailing spaces from
+# message text, and some button labels end in one.
+CHOICE_CODES = {
+    field: {TEXTS["buttons"][key].strip(): code for code, key in enumerate(keys)}
+    for field, keys in CHOICES.items()
+}
+
+# Assigning these doesn't change what the caption shows
+_KEEPS_CAPTIONS = frozenset(("captions", "updated_at"))
+
+REQUIRED_FIELDS = ("rent_or_sell", "property_use", "area", "location", "price", "info", "contact")
+
+# Bump when the compact form changes incompatibly; older drafts are dropped
+FORMAT_VERSION = 1
+
+
+class ListingDraft:
+    """One in-progress /post listing, kept in ``user_data["draft"]``.
+
+    Keyboard answers are small integer codes into CHOICES rather than the
+    Amharic button labels, and the object has fixed slots instead of a dict.
+    ``to_compact`` turns it into a positional list for persistence (see
+    ``encode``/``decode``). Assigning any field other than ``updated_at``
+    (last activity, read by the janitor) drops the cached captions.
+    """
+
+    __slots__ = (
+        "rent_or_sell", "property_use", "house_type", "rooms", "area",
+        "location", "price", "info", "contact", "posted_by",
+        "photos", "photo_refs", "property_id", "date", "posted_to_channel",
+        "updated_at", "captions",
+    )
+    # Order of the compact form; new fields go at the end
+    FIELDS = __slots__[:-1]
+
+    def __init__(self):
+        for name in self.FIELDS:
+            object.__setattr__(self, name, None)
+        object.__setattr__(self, "photos", [])
+        object.__setattr__(self, "photo_refs", [])
+        object.__setattr__(self, "posted_to_channel", False)
+        object.__setattr__(self, "captions", None)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name not in _KEEPS_CAPTIONS:
+            object.__setattr__(self, "captions", None)
+
+    def __repr__(self):
+        return f"ListingDraft({self.property_id!r}, {self.to_compact()[1:]!r})"
+
+    def set_choice(self, field, text):
+        """Store a keyboard answer; False if the text isn't one of the field's buttons"""
+        code = CHOICE_CODES[field].get(text.strip()) if text else None
+        if code is None:
+            return False
+        setattr(self, field, code)
+        return True
+
+    def choice_key(self, field):
+        """TEXTS["buttons"] key of a keyboard answer, or None"""
+        code = getattr(self, field)
+        if code is None or code == NOT_APPLICABLE:
+            return None
+        return CHOICES[field][code]
+
+    def choice_text(self, field):
+        """Button label of a keyboard answer as shown to users"""
+        code = getattr(self, field)
+        if code is None:
+            return None
+        if code == NOT_APPLICABLE:
+            return NOT_APPLICABLE_TEXT
+        return TEXTS["buttons"][CHOICES[field][code]]
+
+    def is_complete(self):
+        return all(getattr(self, field) is not None for field in REQUIRED_FIELDS)
+
+    def caption_values(self):
+        """Field values for CaptionRenderer; unanswered optional fields are left out"""
+        values = {
+            "property_id": self.property_id,
+            "location": self.location,
+            "price": self.price,
+            "info": self.info,
+            "contact": self.contact,
+            "date": self.date,
+        }
+        for field in CHOICES:
+            text = self.choice_text(field)
+            if text is not None:
+                values[field] = text
+        return values
+
+    def sheet_row(self, posted_by):
+        """The listing as a sheet row (HEADERS order); photo columns hold file_ids"""
+        row = [
+            self.property_id,
+            self.choice_text("rent_or_sell"),
+            self.choice_text("property_use"),
+            self.choice_text("house_type") or NOT_APPLICABLE_TEXT,
+            self.choice_text("rooms") or NOT_APPLICABLE_TEXT,
+            self.choice_text("area"),
+            self.location,
+            self.price,
+            self.info,
+            self.contact,
+            posted_by,
+            self.date,
+        ]
+        for i in range(3):
+            row.append(self.photos[i] if i < len(self.photos) else "")
+        return row
+
+    def to_compact(self):
+        return [FORMAT_VERSION] + [getattr(self, name) for name in self.FIELDS]
+
+    @classmethod
+    def from_compact(cls, values):
+        """Rebuild a draft from ``to_compact`` output; None if it's from an unknown version"""
+        if not values or values[0] != FORMAT_VERSION:
+            return None
+        draft = cls()
+        for name, value in zip(cls.FIELDS, values[1:]):
+            object.__setattr__(draft, name, value)
+        return draft
+
+
+def encode(obj):
+    """json.dumps ``default`` hook for SQLitePersistence"""
+    if isinstance(obj, ListingDraft):
+        return {"__draft__": obj.to_compact()}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def decode(obj):
+    """json.loads ``object_hook`` for SQLitePersistence"""
+    if "__draft__" in obj:
+        return ListingDraft.from_compact(obj["__draft__"])
+    return obj
@@ -0,0 +1,204 @@
+import bisect
+import math
+import re
+
+# Sheet row columns used by the index
+ID_COLUMN = 0
+LOCATION_COLUMN = 6
+PRICE_COLUMN = 7
+FACET_COLUMNS = {
+    "rent_or_sell": 1,
+    "property_use": 2,
+    "house_type": 3,
+    "rooms": 4,
+    "area": 5,
+}
+
+# Prices are bucketed on a log scale; 64 buckets cover 1 to 10^10 birr with
+# each bucket spanning about 44%
+PRICE_BUCKETS = 64
+_BUCKET_SCALE = (PRICE_BUCKETS - 1) / math.log(1e10)
+
+_PRICE_CLEANUP = re.compile(r"[,\s]")
+
+
+def parse_price(text):
+    """Parse a price like '12,500' or '1 200 000.50'; None when it isn't a number"""
+    try:
+        return float(_PRICE_CLEANUP.sub("", str(text)))
+    except ValueError:
+        return None
+
+
+def price_bucket(price):
+    if price < 1:
+        return 0
+    return min(PRICE_BUCKETS - 1, int(math.log(price) * _BUCKET_SCALE))
+
+
+def _pair_bucket(pair):
+    return price_bucket(pair[0])
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _mask_from_ordinals(ordinals, size):
+    bits = bytearray(size // 8 + 1)
+    for ordinal in ordinals:
+        bits[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(bits, "little")
+
+
+class ListingIndex:
+    """In-memory inverted index over listing rows.
+
+    Every listing gets an increasing ordinal and each index key maps to a
+    bitmask of ordinals: one key per facet value (the enumerated button texts),
+    per location trigram and per log-scale price bucket. A query ANDs a few
+    masks, then reads set bits from the top down so results come out newest
+    first. A price range takes the buckets wholly inside it from their masks
+    and cuts the two edge buckets exactly by bisecting (price, ordinal) pairs
+    kept in price order, so only trigram matches need an exact check. Masks
+    are built in bulk by load() and updated one bit at a time by add().
+    """
+
+    def __init__(self):
+        self._rows = []
+        self._prices = []
+        self._locations = []
+        self._ordinals = {}
+        self._masks = {}
+        self._by_price = []
+        self._live = 0
+
+    def __len__(self):
+        return self._live.bit_count()
+
+    def _keys(self, row):
+        """Index keys and derived values for one row"""
+        keys = [(field, row[column]) for field, column in FACET_COLUMNS.items()]
+        location = str(row[LOCATION_COLUMN]).strip().casefold()
+        keys += [("trigram", gram) for gram in trigrams(location)]
+        price = parse_price(row[PRICE_COLUMN])
+        if price is not None:
+            keys.append(("price", price_bucket(price)))
+        return keys, location, price
+
+    def _append(self, row):
+        property_id = row[ID_COLUMN]
+        previous = self._ordinals.get(property_id)
+        ordinal = len(self._rows)
+        keys, location, price = self._keys(row)
+        self._rows.append(row)
+        self._locations.append(location)
+        self._prices.append(price)
+        self._ordinals[property_id] = ordinal
+        return ordinal, previous, keys
+
+    def add(self, row):
+        """Index a sheet row; a row with a known Property ID replaces the old one"""
+        ordinal, previous, keys = self._append(row)
+        bit = 1 << ordinal
+        for key in keys:
+            self._masks[key] = self._masks.get(key, 0) | bit
+        if self._prices[ordinal] is not None:
+            bisect.insort(self._by_price, (self._prices[ordinal], ordinal))
+        if previous is not None:
+            self._live &= ~(1 << previous)
+        self._live |= bit
+
+    def load(self, rows):
+        """Bulk-index rows, building each mask once instead of bit by bit"""
+        postings = {}
+        replaced = []
+        for row in rows:
+            if len(row) <= PRICE_COLUMN or not row[ID_COLUMN]:
+                continue
+            ordinal, previous, keys = self._append(row)
+            for key in keys:
+                postings.setdefault(key, []).append(ordinal)
+            if self._prices[ordinal] is not None:
+                self._by_price.append((self._prices[ordinal], ordinal))
+            if previous is not None:
+                replaced.append(previous)
+
+        size = len(self._rows)
+        for key, ordinals in postings.items():
+            self._masks[key] = self._masks.get(key, 0) | _mask_from_ordinals(ordinals, size)
+        self._live |= (1 << size) - 1
+        self._live &= ~_mask_from_ordinals(replaced, size)
+        self._by_price.sort()
+
+    def get(self, property_id):
+        ordinal = self._ordinals.get(property_id)
+        return self._rows[ordinal] if ordinal is not None else None
+
+    def _price_mask(self, min_price, max_price):
+        """Mask of listings priced within [min_price, max_price]; either end may be None"""
+        by_price = self._by_price
+        start, stop = 0, len(by_price)
+        first, last = 0, PRICE_BUCKETS - 1
+        if min_price is not None:
+            start = bisect.bisect_left(by_price, (min_price, -1))
+            first = price_bucket(min_price)
+        if max_price is not None:
+            stop = bisect.bisect_right(by_price, (max_price, math.inf))
+            last = price_bucket(max_price)
+
+        # by_price[start:stop] is the range exactly. Buckets from inner_first
+        # to inner_last are wholly inside it; of the edge buckets a bound cuts
+        # through, take either their pairs inside the range or the pairs
+        # outside it, whichever are fewer.
+        inner_first = first + 1 if min_price is not None else first
+        inner_last = last - 1 if max_price is not None else last
+        first_end = bisect.bisect_left(by_price, inner_first, start, stop, key=_pair_bucket)
+        last_start = max(first_end, bisect.bisect_right(by_price, inner_last, start, stop, key=_pair_bucket))
+        first_start = bisect.bisect_left(by_price, first, 0, start, key=_pair_bucket)
+        last_end = bisect.bisect_right(by_price, last, stop, len(by_price), key=_pair_bucket)
+        inside = (first_end - start) + (stop - last_start)
+        outside = (start - first_start) + (last_end - stop)
+
+        mask = 0
+        whole = range(first, last + 1) if outside < inside else range(inner_first, inner_last + 1)
+        for bucket in whole:
+            mask |= self._masks.get(("price", bucket), 0)
+        size = len(self._rows)
+        if outside < inside:
+            pairs = by_price[first_start:start] + by_price[stop:last_end]
+            return mask & ~_mask_from_ordinals([ordinal for _, ordinal in pairs], size)
+        pairs = by_price[start:first_end] + by_price[last_start:stop]
+        return mask | _mask_from_ordinals([ordinal for _, ordinal in pairs], size)
+
+    def search(self, facets=None, location=None, min_price=None, max_price=None, limit=10):
+        """Return up to ``limit`` matching rows, newest first.
+
+        ``facets`` maps a field from FACET_COLUMNS to the exact stored value.
+        """
+        mask = self._live
+        for field, value in (facets or {}).items():
+            mask &= self._masks.get((field, value), 0)
+            if not mask:
+                return []
+
+        needle = location.strip().casefold() if location else None
+        if needle:
+            for gram in trigrams(needle):
+                mask &= self._masks.get(("trigram", gram), 0)
+                if not mask:
+                    return []
+
+        if min_price is not None or max_price is not None:
+            if min_price is not None and max_price is not None and min_price > max_price:
+                return []
+            mask &= self._price_mask(min_price, max_price)
+
+        results = []
+        while mask and len(results) < limit:
+            ordinal = mask.bit_length() - 1
+            mask ^= 1 << ordinal
+            if needle and needle not in self._locations[ordinal]:
+                continue
+            results.append(self._rows[ordinal])
+        return results
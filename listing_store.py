@@ -0,0 +1,210 @@
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    property_id TEXT PRIMARY KEY,
+    row TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    property_id TEXT NOT NULL,
+    row TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    delivered_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (id) WHERE delivered_at IS NULL;
+CREATE TABLE IF NOT EXISTS photo_uploads (
+    property_id TEXT PRIMARY KEY,
+    file_ids TEXT NOT NULL,
+    drive_ids TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    archived_at REAL
+);
+CREATE TABLE IF NOT EXISTS publications (
+    property_id TEXT PRIMARY KEY,
+    channel_id TEXT NOT NULL,
+    photos TEXT NOT NULL,
+    caption TEXT NOT NULL,
+    outbox_id INTEGER NOT NULL,
+    message_ids TEXT,
+    created_at REAL NOT NULL,
+    published_at REAL,
+    sheet_written_at REAL
+);
+CREATE INDEX IF NOT EXISTS publications_unpublished ON publications (created_at) WHERE published_at IS NULL;
+"""
+
+PUBLICATION_COLUMNS = "property_id, channel_id, photos, caption, outbox_id, message_ids, published_at, sheet_written_at"
+
+
+def _publication(found):
+    property_id, channel_id, photos, caption, outbox_id, message_ids, published_at, sheet_written_at = found
+    return (property_id, channel_id, json.loads(photos), caption, outbox_id,
+            json.loads(message_ids) if message_ids else None, published_at, sheet_written_at)
+
+
+class ListingStore:
+    """Local SQLite system of record for listings.
+
+    Saving a listing writes the listing row and an outbox entry in one
+    transaction. The outbox is drained to Google Sheets in the background and
+    entries are only marked delivered after the sheet write succeeds, so every
+    row reaches the sheet at least once even across restarts.
+
+    Confirmed listings also get a ``publications`` entry (see PublishLedger)
+    recording which steps of publishing them are done.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self.last_delivery_lag = 0.0
+
+    def close(self):
+        self._conn.close()
+
+    def claim_publication(self, property_id, row, channel_id, photos, caption):
+        """Store a confirmed listing, queue its sheet row and record its channel post as due, all at once.
+
+        Returns the outbox id, or None (and changes nothing) if the listing was claimed before.
+        """
+        payload = json.dumps(row, ensure_ascii=False)
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if self._conn.execute("SELECT 1 FROM publications WHERE property_id = ?", (property_id,)).fetchone():
+                return None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO listings (property_id, row, created_at) VALUES (?, ?, ?)",
+                (property_id, payload, now),
+            )
+            outbox_id = self._conn.execute(
+                "INSERT INTO outbox (property_id, row, enqueued_at) VALUES (?, ?, ?)",
+                (property_id, payload, now),
+            ).lastrowid
+            self._conn.execute(
+                "INSERT INTO publications (property_id, channel_id, photos, caption, outbox_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (property_id, str(channel_id), json.dumps(photos), caption, outbox_id, now),
+            )
+        return outbox_id
+
+    def get_publication(self, property_id):
+        """(property_id, channel_id, photos, caption, outbox_id, message_ids, published_at, sheet_written_at) or None"""
+        cur = self._conn.execute(f"SELECT {PUBLICATION_COLUMNS} FROM publications WHERE property_id = ?", (property_id,))
+        found = cur.fetchone()
+        return _publication(found) if found else None
+
+    def unpublished(self):
+        """Publications whose channel post hasn't gone out yet, oldest first."""
+        cur = self._conn.execute(
+            f"SELECT {PUBLICATION_COLUMNS} FROM publications WHERE published_at IS NULL ORDER BY created_at"
+        )
+        return [_publication(found) for found in cur]
+
+    def mark_published(self, property_id, message_ids):
+        """Record a listing's channel post (message_ids None: outcome unknown)."""
+        now = time.time()
+        with self._conn:
+            self._conn.execute(
+                "UPDATE publications SET message_ids = ?, published_at = ? WHERE property_id = ?",
+                (json.dumps(message_ids) if message_ids is not None else None, now, property_id),
+            )
+        return now
+
+    def unknown_publications(self):
+        """Channel posts given up on without knowing whether Telegram posted them."""
+        cur = self._conn.execute(
+            "SELECT COUNT(*) FROM publications WHERE published_at IS NOT NULL AND message_ids IS NULL"
+        )
+        return cur.fetchone()[0]
+
+    def all_listings(self):
+        """Yield every stored listing row, oldest first."""
+        cur = self._conn.execute("SELECT row FROM listings ORDER BY created_at")
+        for (payload,) in cur:
+            yield json.loads(payload)
+
+    def pending_outbox(self):
+        """Return (outbox_id, row) pairs that have not reached the sheet yet."""
+        cur = self._conn.execute("SELECT id, row FROM outbox WHERE delivered_at IS NULL ORDER BY id")
+        return [(outbox_id, json.loads(payload)) for outbox_id, payload in cur]
+
+    def mark_delivered(self, outbox_ids):
+        if not outbox_ids:
+            return
+        now = time.time()
+        marks = ",".join("?" * len(outbox_ids))
+        with self._conn:
+            self._conn.execute("BEGIN")
+            cur = self._conn.execute(
+                f"SELECT MAX(enqueued_at) FROM outbox WHERE id IN ({marks})", list(outbox_ids)
+            )
+            newest = cur.fetchone()[0]
+            self._conn.execute(
+                f"UPDATE outbox SET delivered_at = ? WHERE id IN ({marks})", [now, *outbox_ids]
+            )
+            self._conn.execute(
+                f"UPDATE publications SET sheet_written_at = ? WHERE outbox_id IN ({marks})", [now, *outbox_ids]
+            )
+        if newest is not None:
+            self.last_delivery_lag = now - newest
+        return now
+
+    def replication_lag(self):
+        """Seconds the oldest undelivered outbox entry has been waiting (0 when caught up)."""
+        cur = self._conn.execute("SELECT MIN(enqueued_at) FROM outbox WHERE delivered_at IS NULL")
+        oldest = cur.fetchone()[0]
+        return time.time() - oldest if oldest is not None else 0.0
+
+    def outbox_depth(self):
+        """Listings stored but not yet written to the sheet."""
+        cur = self._conn.execute("SELECT COUNT(*) FROM outbox WHERE delivered_at IS NULL")
+        return cur.fetchone()[0]
+
+    def queue_photo_upload(self, property_id, file_ids):
+        """Record a listing's Telegram photos as waiting for the Drive archive."""
+        drive_ids = json.dumps([None] * len(file_ids))
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO photo_uploads (property_id, file_ids, drive_ids, queued_at) VALUES (?, ?, ?, ?)",
+                (property_id, json.dumps(file_ids), drive_ids, time.time()),
+            )
+
+    def save_drive_ids(self, property_id, drive_ids):
+        """Remember uploaded photos (None for those still to do) so a restart doesn't repeat them."""
+        with self._conn:
+            self._conn.execute(
+                "UPDATE photo_uploads SET drive_ids = ? WHERE property_id = ?", (json.dumps(drive_ids), property_id)
+            )
+
+    def pending_photo_uploads(self):
+        """Return (property_id, file_ids, drive_ids) for listings not fully archived yet, oldest first."""
+        cur = self._conn.execute(
+            "SELECT property_id, file_ids, drive_ids FROM photo_uploads WHERE archived_at IS NULL ORDER BY queued_at"
+        )
+        return [(property_id, json.loads(file_ids), json.loads(drive_ids)) for property_id, file_ids, drive_ids in cur]
+
+    def mark_photos_archived(self, property_ids):
+        if not property_ids:
+            return
+        marks = ",".join("?" * len(property_ids))
+        with self._conn:
+            self._conn.execute(
+                f"UPDATE photo_uploads SET archived_at = ? WHERE property_id IN ({marks})", [time.time(), *property_ids]
+            )
+
+    def prune_delivered(self, older_than_seconds=7 * 24 * 3600):
+        """Delete delivered outbox entries older than the given age."""
+        cutoff = time.time() - older_than_seconds
+        with self._conn:
+            self._conn.execute("DELETE FROM outbox WHERE delivered_at IS NOT NULL AND delivered_at < ?", (cutoff,))
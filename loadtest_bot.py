@@ -0,0 +1,549 @@
+"""End-to-end load test: full /post conversations against local stand-ins.
+
+Starts main_bot.py as a child process pointed at two local aiohttp servers
+started here: a fake Telegram Bot API (TELEGRAM_API_URL) and a fake Google
+Sheets/Drive backend with its own OAuth token endpoint (GOOGLE_API_URL and a
+throwaway service-account file). Both have configurable latency and error
+injection. Synthetic users then walk the whole RENT_SELL -> CONFIRM flow,
+photos included, by POSTing updates to the bot's /webhook, and each step is
+timed from the first POST until the bot's reply reaches the fake Bot API.
+
+The report has p50/p95/p99 per step, throughput, the bot process' memory
+high-water mark and how long the sheet took to catch up afterwards.
+
+    python loadtest_bot.py --users 2000 --concurrency 500 --bot-latency-ms 40 --sheets-error-rate 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import rsa
+from aiohttp import web
+
+from texts_am import TEXTS
+
+BOT_TOKEN = "123456:loadtest"
+SECRET = "loadtest-secret"
+SHEET_ID = "loadtest-sheet"
+SHEET_TITLE = "Sheet1"
+USER_ID_BASE = 700000000
+PHOTO_BYTES = os.urandom(64 * 1024)
+
+BUTTONS = TEXTS["buttons"]
+MESSAGES = TEXTS["messages"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class FakeService:
+    """Shared latency and error injection for the stand-in servers"""
+
+    def __init__(self, latency_ms, error_rate):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.calls = {}
+
+    async def delay(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(max(0.0, random.gauss(self.latency, self.latency / 4)))
+
+    def fail(self):
+        return self.error_rate and random.random() < self.error_rate
+
+
+class FakeBotAPI(FakeService):
+    """Answers Bot API methods and hands each private-chat message to the waiting user"""
+
+    def __init__(self, latency_ms, error_rate, flood_rate):
+        super().__init__(latency_ms, error_rate)
+        self.flood_rate = flood_rate
+        self.inboxes = {}
+        self.message_ids = itertools.count(1)
+
+    def app(self):
+        app = web.Application(client_max_size=10 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/file/bot{token}/{path:.*}", self.download)
+        return app
+
+    def message(self, chat_id, **fields):
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+            **fields,
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        await self.delay(method)
+
+        if self.flood_rate and random.random() < self.flood_rate:
+            return web.json_response(
+                {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                 "parameters": {"retry_after": 1}}, status=429)
+        if self.fail():
+            return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "Loadtest", "username": "loadtest_bot"}
+        elif method == "sendMessage":
+            result = self.message(chat_id, text=params.get("text", ""))
+            inbox = self.inboxes.get(chat_id)
+            if inbox is not None:
+                inbox.put_nowait(result["text"])
+        elif method == "sendMediaGroup":
+            media = params["media"]
+            media = json.loads(media) if isinstance(media, str) else media
+            result = [self.message(chat_id, photo=[{"file_id": item["media"], "file_unique_id": item["media"],
+                                                    "width": 1280, "height": 960}]) for item in media]
+        elif method == "getFile":
+            file_id = params["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": len(PHOTO_BYTES),
+                      "file_path": f"photos/{file_id}.jpg"}
+        elif method in ("editMessageText", "editMessageReplyMarkup"):
+            result = self.message(chat_id, text=params.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def download(self, request):
+        await self.delay("download")
+        return web.Response(body=PHOTO_BYTES, content_type="image/jpeg")
+
+
+class FakeGoogle(FakeService):
+    """Just enough OAuth, Drive and Sheets v4 for the Sheets client to open the sheet and append rows,
+    and for the Drive archiver to upload photos and write their IDs back"""
+
+    def __init__(self, latency_ms, error_rate):
+        super().__init__(latency_ms, error_rate)
+        self.rows = []
+        self.last_append = None
+        self.uploads = itertools.count(1)
+        self.uploaded = 0
+        self.backfilled = 0
+
+    def app(self):
+        app = web.Application(client_max_size=10 * 1024 * 1024)
+        app.router.add_post("/token", self.token)
+        app.router.add_get("/drive/v3/files", self.list_files)
+        app.router.add_route("*", "/upload/drive/v3/files", self.upload)
+        app.router.add_post("/batch/drive/v3", self.batch)
+        app.router.add_route("*", "/v4/spreadsheets/{tail:.*}", self.spreadsheets)
+        return app
+
+    async def token(self, request):
+        await self.delay("token")
+        return web.json_response({"access_token": "loadtest", "expires_in": 3600, "token_type": "Bearer"})
+
+    async def list_files(self, request):
+        await self.delay("drive.files.list")
+        return web.json_response({"files": [{"id": SHEET_ID, "name": "RentalListings"}]})
+
+    async def upload(self, request):
+        """Resumable upload: POST opens a session, PUT sends the (single-chunk) file"""
+        await request.read()
+        if request.method == "POST":
+            await self.delay("drive.upload.start")
+            location = f"http://{request.host}{request.path}?uploadType=resumable&upload_id={next(self.uploads)}"
+            return web.Response(headers={"Location": location})
+        await self.delay("drive.upload")
+        self.uploaded += 1
+        return web.json_response({"id": f"drive-{request.query['upload_id']}"})
+
+    async def batch(self, request):
+        """Answers every call of a batch request with 200"""
+        await self.delay("drive.batch")
+        body = await request.text()
+        parts = []
+        for line in body.splitlines():
+            if line.lower().startswith("content-id:"):
+                call_id = line.split(":", 1)[1].strip()[1:-1]
+                parts.append(f"--loadtest\r\nContent-Type: application/http\r\nContent-ID: <response-{call_id}>\r\n\r\n"
+                             f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n{{}}\r\n")
+        return web.Response(body="".join(parts) + "--loadtest--",
+                            headers={"Content-Type": "multipart/mixed; boundary=loadtest"})
+
+    async def spreadsheets(self, request):
+        tail = request.match_info["tail"]
+        if tail.endswith(":append"):
+            name = "values.append"
+        elif tail.endswith("values:batchUpdate"):
+            name = "values.batchUpdate"
+        elif tail.endswith("values:batchGet"):
+            name = "values.batchGet"
+        else:
+            name = "spreadsheets.get"
+        await self.delay(name)
+        if self.fail():
+            return web.json_response(
+                {"error": {"code": 429, "message": "Quota exceeded", "status": "RESOURCE_EXHAUSTED"}}, status=429)
+
+        if name == "values.append":
+            body = await request.json()
+            self.rows.extend(body.get("values", []))
+            self.last_append = time.perf_counter()
+            return web.json_response({"spreadsheetId": SHEET_ID, "updates": {"updatedRows": len(body["values"])}})
+        if name == "values.batchGet":
+            value_ranges = []
+            columns = request.query.get("majorDimension") == "COLUMNS"
+            for label in request.query.getall("ranges", []):
+                first, _, last = label.split("!")[-1].partition(":")
+                start = "".join(c for c in first if c.isdigit())
+                end = "".join(c for c in last if c.isdigit())
+                rows = self.rows[int(start or 1) - 1:int(end) if end else None]
+                if columns:
+                    # Only single-column reads (the ID column) are needed
+                    rows = [[row[0] for row in rows]] if rows else []
+                value_ranges.append({"range": label, "majorDimension": "COLUMNS" if columns else "ROWS",
+                                     "values": rows})
+            return web.json_response({"spreadsheetId": SHEET_ID, "valueRanges": value_ranges})
+        if name == "values.batchUpdate":
+            body = await request.json()
+            for item in body.get("data", []):
+                if item["range"].endswith("!A1"):
+                    # The header row
+                    self.rows[:1] = item["values"]
+                else:
+                    self.backfilled += 1
+            return web.json_response({"spreadsheetId": SHEET_ID, "totalUpdatedRows": len(body.get("data", []))})
+        return web.json_response({
+            "spreadsheetId": SHEET_ID,
+            "properties": {"title": "RentalListings"},
+            "sheets": [{"properties": {"sheetId": 0, "title": SHEET_TITLE, "index": 0,
+                                       "gridProperties": {"rowCount": 1000, "columnCount": 26}}}],
+        })
+
+
+def write_credentials(path, google_url):
+    """A throwaway service account whose token endpoint is the fake server"""
+    _, private_key = rsa.newkeys(1024)
+    with open(path, "w") as f:
+        json.dump({
+            "type": "service_account",
+            "project_id": "loadtest",
+            "private_key_id": "loadtest",
+            "private_key": private_key.save_pkcs1().decode(),
+            "client_email": "loadtest@loadtest.iam.gserviceaccount.com",
+            "client_id": "1",
+            "token_uri": f"{google_url}/token",
+        }, f)
+
+
+# Each step: (name, messages to send, key of the reply that ends the step)
+def conversation(user_id, album=False):
+    contact = {"contact": {"phone_number": "+251911223344", "first_name": "u", "user_id": user_id}}
+    photos = [{"photo": [{"file_id": f"p{user_id}-{n}-{size}", "file_unique_id": f"p{user_id}-{n}-{size}",
+                          "width": size, "height": size * 3 // 4, "file_size": size * 40}
+                         for size in (90, 320, 1280)]} for n in range(3)]
+    if album:
+        for photo in photos:
+            photo["media_group_id"] = f"album{user_id}"
+    return [
+        ("post", [{"text": "/post", "entities": [{"type": "bot_command", "offset": 0, "length": 5}]}], "post_start"),
+        ("rent_sell", [{"text": BUTTONS["rent"]}], "ask_property_use"),
+        ("property_use", [{"text": BUTTONS["residence"]}], "ask_house_type"),
+        ("house_type", [{"text": BUTTONS["apartment"]}], "ask_rooms"),
+        ("rooms", [{"text": BUTTONS["two_bedroom"]}], "ask_area"),
+        ("area", [{"text": BUTTONS["area_51_75"]}], "ask_location"),
+        ("location", [{"text": "Bole, Addis Ababa"}], "ask_price"),
+        ("price", [{"text": "15,000"}], "ask_info"),
+        ("info", [{"text": "Near the ring road, water tank, parking"}], "ask_contact"),
+        ("contact", [contact], "ask_photos"),
+        ("photos", photos, "all_photos_added"),
+        ("preview", [{"text": BUTTONS["preview"]}], "confirm_prompt"),
+        ("confirm", [{"text": BUTTONS["confirm"]}], "success"),
+    ]
+
+
+class LoadRun:
+    def __init__(self, args, bot_api, webhook_url):
+        self.args = args
+        self.bot_api = bot_api
+        self.webhook_url = webhook_url
+        self.update_ids = itertools.count(1)
+        self.latencies = {}
+        self.failures = {}
+        self.completed = 0
+        self.updates_sent = 0
+        self.rejected = 0
+        self.redelivered = 0
+
+    def update(self, user_id, fields):
+        return {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": self.updates_sent + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": "u"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "u", "username": f"user{user_id}"},
+                **fields,
+            },
+        }
+
+    async def post_update(self, session, body, deadline):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET, "Content-Type": "application/json"}
+        while True:
+            async with session.post(self.webhook_url, data=body, headers=headers) as resp:
+                await resp.read()
+                if resp.status == 200:
+                    self.updates_sent += 1
+                    break
+            # 503 means the bot is shedding load; back off like Telegram would
+            self.rejected += 1
+            if time.perf_counter() > deadline:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(0.05)
+        if random.random() < self.args.redeliver_rate:
+            # Telegram sends an update again when it thinks the first delivery failed
+            async with session.post(self.webhook_url, data=body, headers=headers) as resp:
+                await resp.read()
+            self.redelivered += 1
+
+    async def run_user(self, session, user_id):
+        inbox = self.bot_api.inboxes[user_id] = asyncio.Queue()
+        try:
+            for name, messages, reply_key in conversation(user_id, self.args.albums):
+                expected = MESSAGES[reply_key]
+                started = time.perf_counter()
+                deadline = started + self.args.step_timeout
+                try:
+                    for fields in messages:
+                        await self.post_update(session, json.dumps(self.update(user_id, fields)), deadline)
+                    while not (await asyncio.wait_for(inbox.get(), deadline - time.perf_counter())).startswith(expected):
+                        pass
+                except asyncio.TimeoutError:
+                    self.failures[name] = self.failures.get(name, 0) + 1
+                    return
+                self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+                if self.args.think_ms:
+                    await asyncio.sleep(random.expovariate(1000 / self.args.think_ms))
+            self.completed += 1
+        finally:
+            del self.bot_api.inboxes[user_id]
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(user_id):
+            async with semaphore:
+                await self.run_user(session, user_id)
+
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(limited(USER_ID_BASE + i) for i in range(self.args.users)))
+            return time.perf_counter() - started
+
+
+async def serve(app, port):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def wait_until_healthy(url, bot, timeout):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if bot.poll() is not None:
+                raise RuntimeError(f"bot exited with status {bot.returncode}")
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("bot did not become healthy in time")
+
+
+async def scrape_metrics(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await resp.text()
+
+
+def metric_value(metrics, name):
+    """Sum of a metric's samples in a /metrics scrape (0 if it has none)"""
+    return sum(float(line.rsplit(" ", 1)[1]) for line in metrics.splitlines()
+               if line.split("{", 1)[0].split(" ", 1)[0] == name)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="conversations to run")
+    parser.add_argument("--concurrency", type=int, default=200, help="users in a conversation at once")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's steps")
+    parser.add_argument("--step-timeout", type=float, default=30, help="seconds before a step counts as failed")
+    parser.add_argument("--bot-latency-ms", type=float, default=30)
+    parser.add_argument("--bot-error-rate", type=float, default=0.0, help="fraction of Bot API calls answered 502")
+    parser.add_argument("--bot-flood-rate", type=float, default=0.0, help="fraction answered 429 retry_after=1")
+    parser.add_argument("--sheets-latency-ms", type=float, default=150)
+    parser.add_argument("--sheets-error-rate", type=float, default=0.0, help="fraction of Sheets calls answered 429")
+    parser.add_argument("--redeliver-rate", type=float, default=0.0,
+                        help="fraction of updates posted to the webhook a second time")
+    parser.add_argument("--archive-photos", action="store_true", help="run the bot with PHOTO_ARCHIVE=1")
+    parser.add_argument("--drive", action="store_true", help="archive posted photos to the fake Drive")
+    parser.add_argument("--albums", action="store_true", help="send the three photos as one album")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="seconds to wait for the sheet to catch up")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="NAME=VALUE",
+                        help="extra environment for the bot, e.g. MAX_CONCURRENT_UPDATES=16")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    bot_api = FakeBotAPI(args.bot_latency_ms, args.bot_error_rate, args.bot_flood_rate)
+    google = FakeGoogle(args.sheets_latency_ms, args.sheets_error_rate)
+    bot_api_port, google_port, bot_port = free_port(), free_port(), free_port()
+    runners = [await serve(bot_api.app(), bot_api_port), await serve(google.app(), google_port)]
+
+    workdir = tempfile.mkdtemp(prefix="loadtest_bot_")
+    google_url = f"http://127.0.0.1:{google_port}"
+    credentials = os.path.join(workdir, "credentials.json")
+    write_credentials(credentials, google_url)
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{bot_api_port}",
+        GOOGLE_API_URL=google_url,
+        GOOGLE_CREDENTIALS_JSON=credentials,
+        PORT=str(bot_port),
+        WEBHOOK_URL=f"http://127.0.0.1:{bot_port}",
+        SECRET_TOKEN=SECRET,
+        CHANNEL_ID="-1000000000001",
+        CHANNEL_ID2="-1000000000002",
+        LISTINGS_DB=os.path.join(workdir, "listings.db"),
+        STATE_DB=os.path.join(workdir, "bot_state.db"),
+        PHOTO_DIR=workdir,
+        PHOTO_ARCHIVE="1" if args.archive_photos else "0",
+    )
+    if args.drive:
+        env["DRIVE_FOLDER_ID"] = "loadtest-folder"
+    env.update(item.split("=", 1) for item in args.bot_env)
+
+    log_path = os.path.join(workdir, "bot.log")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main_bot.py")
+    with open(log_path, "w") as log:
+        bot = subprocess.Popen([sys.executable, script], env=env, stdout=log, stderr=subprocess.STDOUT,
+                               cwd=os.path.dirname(script))
+    bot_url = f"http://127.0.0.1:{bot_port}"
+    try:
+        await wait_until_healthy(f"{bot_url}/health", bot, timeout=60)
+        print(f"bot up (log: {log_path}); {args.users} users, {args.concurrency} at a time")
+
+        load = LoadRun(args, bot_api, f"{bot_url}/webhook")
+        elapsed = await load.run()
+        finished = time.perf_counter()
+
+        # Rows reach the sheet in the background; wait for the writer to catch up
+        expected_rows = load.completed + 1  # plus the header row
+        drain_deadline = finished + args.drain_timeout
+        while len(google.rows) < expected_rows and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.1)
+        caught_up = google.last_append is not None and len(google.rows) >= expected_rows
+        sheet_lag = max(0.0, google.last_append - finished) if caught_up else None
+        if args.drive:
+            while google.backfilled < load.completed and time.perf_counter() < drain_deadline:
+                await asyncio.sleep(0.1)
+        metrics = await scrape_metrics(f"{bot_url}/metrics")
+    finally:
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+            bot.wait()
+        for runner in runners:
+            await runner.cleanup()
+
+    # ru_maxrss is KiB on Linux (bytes on macOS) and covers waited-for children only
+    peak_rss_mib = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    steps = {}
+    for name, _, _ in conversation(0):
+        values = sorted(load.latencies.get(name, []))
+        steps[name] = {
+            "count": len(values),
+            "failed": load.failures.get(name, 0),
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": (values[-1] if values else float("nan")) * 1000,
+        }
+    results = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "completed": load.completed,
+        "elapsed_s": elapsed,
+        "conversations_per_s": load.completed / elapsed,
+        "updates_per_s": load.updates_sent / elapsed,
+        "webhook_rejected": load.rejected,
+        "webhook_redelivered": load.redelivered,
+        "webhook_duplicates_dropped": metric_value(metrics, "webhook_duplicate_updates_total"),
+        "sheet_rows": len(google.rows) - 1 if google.rows else 0,
+        "sheet_catch_up_s": sheet_lag,
+        "drive_uploads": google.uploaded,
+        "drive_rows_backfilled": google.backfilled,
+        "peak_rss_mib": peak_rss_mib,
+        "bot_api_calls": bot_api.calls,
+        "google_calls": google.calls,
+        "steps": steps,
+    }
+
+    print(f"\n{'step':<14}{'count':>7}{'failed':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in steps.items():
+        print(f"{name:<14}{s['count']:>7}{s['failed']:>8}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}"
+              f"{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    print(f"\ncompleted {load.completed}/{args.users} conversations in {elapsed:.1f}s: "
+          f"{results['conversations_per_s']:.1f} conversations/s, {results['updates_per_s']:.0f} updates/s")
+    print(f"webhook 503s: {load.rejected}   sheet rows: {results['sheet_rows']}   "
+          f"sheet caught up: {'%.1fs after the last user' % sheet_lag if sheet_lag is not None else 'NO'}")
+    if args.redeliver_rate:
+        print(f"updates redelivered: {load.redelivered}   dropped by the bot as duplicates: "
+              f"{results['webhook_duplicates_dropped']:.0f}")
+    if args.drive:
+        print(f"Drive uploads: {google.uploaded}   rows back-filled with Drive IDs: {google.backfilled}")
+    print(f"bot peak RSS: {peak_rss_mib:.1f} MiB")
+    print(f"Bot API calls: {json.dumps(bot_api.calls)}")
+    print(f"Google calls:  {json.dumps(google.calls)}")
+    errors = [line for line in metrics.splitlines() if line.startswith(("bot_api_call_errors", "sheets_call_errors", "drive_call_errors"))]
+    if errors:
+        print("errors seen by the bot:\n  " + "\n  ".join(errors))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Load test for PerUserUpdateProcessor.
+
+Feeds interleaved updates from many users through the processor the same way
+Application does (one task per update, in arrival order). Each handler
+simulates I/O latency. For each concurrency limit it prints throughput and
+checks that every user's updates ran strictly in order.
+
+    python loadtest_concurrency.py --users 200 --updates-per-user 10 --latency-ms 50
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from telegram import Update
+
+from update_processor import PerUserUpdateProcessor
+
+
+def make_update(update_id, user_id, seq):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": seq,
+            "date": 1700000000,
+            "chat": {"id": user_id, "type": "private", "first_name": "u"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": str(seq),
+        },
+    }, None)
+
+
+async def run_once(concurrency, updates, latency, jitter):
+    processor = PerUserUpdateProcessor(concurrency)
+    seen = {}
+
+    async def handle(update):
+        user_id = update.effective_user.id
+        await asyncio.sleep(max(0.0, random.gauss(latency, jitter)))
+        seen.setdefault(user_id, []).append(update.message.message_id)
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(processor.process_update(update, handle(update))) for update in updates]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    in_order = all(seqs == sorted(seqs) for seqs in seen.values())
+    return len(updates) / elapsed, in_order, processor.active_keys()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates-per-user", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64, 256])
+    args = parser.parse_args()
+
+    # Users' updates arrive interleaved, as they would from the webhook
+    updates = []
+    update_id = 0
+    for seq in range(args.updates_per_user):
+        for user_id in range(1, args.users + 1):
+            update_id += 1
+            updates.append(make_update(update_id, user_id, seq))
+
+    latency = args.latency_ms / 1000
+    baseline = None
+    print(f"{len(updates)} updates from {args.users} users, ~{args.latency_ms:.0f} ms per handler")
+    for concurrency in args.concurrency:
+        rate, in_order, leftover = await run_once(concurrency, updates, latency, latency / 4)
+        baseline = baseline or rate
+        print(f"concurrency {concurrency:>4}: {rate:9,.0f} updates/s  x{rate / baseline:6.1f}  "
+              f"per-user order {'OK' if in_order else 'BROKEN'}  leftover locks {leftover}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
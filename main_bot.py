@@ -1,17 +1,22 @@
+import time
+_import_started = time.perf_counter()
+
 import os
 import logging
+import functools
 import html
 import re
 import aiohttp
 import uuid
 import asyncio
-import telegram
 from aiohttp import web
 from dotenv import load_dotenv
 from telegram import (
     Update,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     InputMediaPhoto,
     ReplyKeyboardRemove
 )
@@ -19,17 +24,40 @@ from telegram.constants import ParseMode
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     filters,
     ConversationHandler,
     ContextTypes,
+    TypeHandler,
 )
-from telegram.error import TimedOut
-import gspread
+from telegram.error import BadRequest, NetworkError
 from datetime import datetime
-from googleapiclient.discovery import build
-from google.oauth2.service_account import Credentials
 from texts_am import TEXTS
+from caption import CaptionRenderer
+from listing_draft import NOT_APPLICABLE, ListingDraft, decode as decode_draft, encode as encode_draft
+from sheets_writer import SheetWriteQueue
+from sheets_quota import READ, QuotaGovernor
+from listing_store import ListingStore
+from publish_ledger import PublishLedger
+from listing_index import ListingIndex, parse_price
+from google_clients import GoogleClients
+from sheets_client import AsyncSheetsClient, column_letter
+from outbound import OutboundScheduler, PRIORITY_CHANNEL, PRIORITY_INTERACTIVE
+from webhook_ingest import WebhookIngestor
+from update_processor import PerUserUpdateProcessor
+from janitor import Janitor
+from drive_archiver import DriveArchiver
+from sheet_replica import SheetReplica
+import image_stage
+from photo_spool import PhotoSpool, SpoolFull
+from sqlite_persistence import SQLitePersistence
+from metrics import REGISTRY
+from resilience import CircuitBreaker, RetryPolicy, call_with_policy, clear_budget, start_budget
+from startup_timer import StartupTimer
+
+startup_timer = StartupTimer(started=_import_started)
+startup_timer.record("imports", time.perf_counter() - _import_started)
 
 # Load environment variables
 load_dotenv()
@@ -37,9 +65,47 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHANNEL_ID = os.getenv("CHANNEL_ID")  # For rentals
 CHANNEL_ID2 = os.getenv("CHANNEL_ID2")  # For sales
 CREDENTIALS_JSON = os.getenv("GOOGLE_CREDENTIALS_JSON", "credentials.json")
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")  # Bot API server (local stand-in for load tests)
+GOOGLE_API_URL = os.environ.get("GOOGLE_API_URL")  # Overrides googleapis.com (local stand-in for load tests)
 PORT = int(os.environ.get("PORT", 10000))
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # Webhook URL from Render
 SECRET_TOKEN = os.environ.get("SECRET_TOKEN", str(uuid.uuid4()))  # Random secret if not set
+SHEET_BATCH_SIZE = int(os.environ.get("SHEET_BATCH_SIZE", 20))  # Rows per append_rows call
+SHEET_FLUSH_MS = int(os.environ.get("SHEET_FLUSH_MS", 500))  # Max wait before a partial batch is written
+SHEET_MAX_BATCH_SIZE = int(os.environ.get("SHEET_MAX_BATCH_SIZE", 500))  # Rows per call when write quota runs low
+SHEETS_READS_PER_MINUTE = int(os.environ.get("SHEETS_READS_PER_MINUTE", 60))  # Google's per-user read quota
+SHEETS_WRITES_PER_MINUTE = int(os.environ.get("SHEETS_WRITES_PER_MINUTE", 60))  # Google's per-user write quota
+LISTINGS_DB = os.environ.get("LISTINGS_DB", "listings.db")  # Local SQLite system of record
+PHOTO_ARCHIVE = os.environ.get("PHOTO_ARCHIVE", "0") == "1"  # Also keep a local copy of every photo
+PHOTO_DIR = os.environ.get("PHOTO_DIR", ".")  # Where archived photos are written
+PHOTO_SPOOL = os.environ.get("PHOTO_SPOOL", "disk")  # "memory": hold draft photos in RAM until the listing is posted
+PHOTO_MIN_SIDE = int(os.environ.get("PHOTO_MIN_SIDE", 1280))  # Archive the smallest photo size at least this many px on its long side
+PHOTO_USER_BUDGET_MB = float(os.environ.get("PHOTO_USER_BUDGET_MB", 10))  # Photo bytes one user's draft may hold in memory
+PHOTO_SPOOL_BUDGET_MB = float(os.environ.get("PHOTO_SPOOL_BUDGET_MB", 64))  # Photo bytes held in memory across all drafts
+UPDATE_BUDGET = float(os.environ.get("UPDATE_BUDGET", 20))  # Seconds of Bot API time allowed per update
+WEBHOOK_MAX_PENDING = int(os.environ.get("WEBHOOK_MAX_PENDING", 1000))  # Backlog before answering 503
+WEBHOOK_MAX_BODY = int(os.environ.get("WEBHOOK_MAX_BODY", 256 * 1024))  # Largest accepted update, in bytes
+WEBHOOK_DEDUP_WINDOW = int(os.environ.get("WEBHOOK_DEDUP_WINDOW", 1000))  # Recent update_ids checked for redeliveries
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", 64))  # Updates handled in parallel (1 = sequential)
+STATE_DB = os.environ.get("STATE_DB", "bot_state.db")  # In-progress conversations survive restarts here
+STATE_FLUSH_SECONDS = float(os.environ.get("STATE_FLUSH_SECONDS", 5))  # How often changed state is written
+DRAFT_TTL = float(os.environ.get("DRAFT_TTL", 24 * 3600))  # Seconds before an untouched /post draft is evicted
+JANITOR_INTERVAL = float(os.environ.get("JANITOR_INTERVAL", 600))  # Seconds between janitor passes
+PHOTO_DISK_QUOTA_MB = float(os.environ.get("PHOTO_DISK_QUOTA_MB", 200))  # Cap on photo files kept in PHOTO_DIR
+IMAGE_STAGE = os.environ.get("IMAGE_STAGE", "0") == "1"  # Resize and recompress photos before archiving (needs Pillow)
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "jpeg")  # "jpeg" or "webp" for archived photos
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE", 1280))  # Longer side of the web-size copy, in px
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 80))  # Encoder quality of the web-size copy
+THUMB_MAX_SIDE = int(os.environ.get("THUMB_MAX_SIDE", 320))  # Longer side of the thumbnail, in px
+THUMB_QUALITY = int(os.environ.get("THUMB_QUALITY", 70))  # Encoder quality of the thumbnail
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 1))  # Processes resizing photos
+SHEET_REPLICA_POLL_SECONDS = float(os.environ.get("SHEET_REPLICA_POLL_SECONDS", 0))  # Off (0); set e.g. 60 to keep an in-memory copy of the sheet, re-read that often
+DRIVE_FOLDER_ID = os.environ.get("DRIVE_FOLDER_ID")  # Drive folder that posted listings' photos are copied to (off if unset)
+DRIVE_UPLOAD_WORKERS = int(os.environ.get("DRIVE_UPLOAD_WORKERS", 2))  # Photos uploaded to Drive in parallel
+DRIVE_PHOTOS_PUBLIC = os.environ.get("DRIVE_PHOTOS_PUBLIC", "1") == "1"  # Make archived photos viewable by link
+PUBLISH_RETRY_SECONDS = float(os.environ.get("PUBLISH_RETRY_SECONDS", 30))  # First retry of a failed channel post (doubles, max 1h)
+ALBUM_WINDOW_MS = int(os.environ.get("ALBUM_WINDOW_MS", 800))  # Quiet time that ends an album (media group)
+MAX_PHOTOS = 3
 
 # Logging configuration
 logging.basicConfig(
@@ -48,56 +114,265 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Google Sheets setup (keep your existing setup)
-try:
-    gc = gspread.service_account(CREDENTIALS_JSON)
-    SHEET_NAME = "RentalListings"
-    sh = gc.open(SHEET_NAME)
-    worksheet = sh.sheet1
-    logger.info("Google Sheets initialized successfully")
-except Exception as e:
-    logger.error(f"Error setting up Google Sheets: {e}")
-    raise SystemExit("Failed to initialize Google Sheets connection.")
-
-# Initialize Google Drive API (keep your existing setup)
-try:
-    creds = Credentials.from_service_account_file(CREDENTIALS_JSON)
-    drive_service = build('drive', 'v3', credentials=creds)
-    logger.info("Google Drive API initialized successfully")
-except Exception as e:
-    logger.error(f"Error setting up Google Drive: {e}")
-    drive_service = None
-
+SHEET_NAME = "RentalListings"
 
 # Sheet headers
 HEADERS = [
     "Property ID", "Rent/Sell", "Property Use", "House Type", "Rooms",
     "Area", "Location", "Price", "Additional Info", "Contact Info", 
-    "Posted By", "Date", "Photo 1", "Photo 2", "Photo 3"
+    "Posted By", "Date", "Photo 1", "Photo 2", "Photo 3",
+    "Drive Photo 1", "Drive Photo 2", "Drive Photo 3"
 ]
 
-# Ensure headers exist
-if not worksheet.get_all_values():
-    worksheet.append_row(HEADERS)
+# Google Sheets / Drive clients connect on first use (or in the warm-up task
+# once the webhook is serving), never at import time
+google_clients = GoogleClients(CREDENTIALS_JSON, api_url=GOOGLE_API_URL)
+sheets_client = AsyncSheetsClient(CREDENTIALS_JSON, SHEET_NAME, HEADERS, api_url=GOOGLE_API_URL)
+
+# Listings are stored locally first; the sheet is a mirror fed from the outbox
+with startup_timer.phase("listing_store"):
+    listing_store = ListingStore(LISTINGS_DB)
+
+# Which steps of publishing each confirmed listing are done, so none runs twice
+publish_ledger = PublishLedger(listing_store, retry_delay=PUBLISH_RETRY_SECONDS)
+
+# Optional resize/recompress step in front of both photo archives
+photo_stage = None
+if IMAGE_STAGE:
+    if image_stage.available():
+        photo_stage = image_stage.ImageStage(
+            IMAGE_FORMAT,
+            max_side=IMAGE_MAX_SIDE,
+            quality=IMAGE_QUALITY,
+            thumb_side=THUMB_MAX_SIDE,
+            thumb_quality=THUMB_QUALITY,
+            workers=IMAGE_WORKERS,
+        )
+    else:
+        logger.warning("IMAGE_STAGE is set but Pillow isn't installed; photos are archived as downloaded")
+
+# Archive copies of draft photos, in memory or in PHOTO_DIR until posted
+photo_spool = PhotoSpool(
+    PHOTO_DIR,
+    mode=PHOTO_SPOOL,
+    min_side=PHOTO_MIN_SIDE,
+    user_budget=int(PHOTO_USER_BUDGET_MB * 1024 * 1024),
+    total_budget=int(PHOTO_SPOOL_BUDGET_MB * 1024 * 1024),
+    image_stage=photo_stage,
+)
+
+# Caption templates are compiled once; rendered captions are cached on the draft
+captions = CaptionRenderer(TEXTS["messages"])
+
+# In-memory search index, loaded from the store at startup
+listing_index = ListingIndex()
+
+# Every Sheets call shares one read and one write quota
+sheets_governor = QuotaGovernor(SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE)
+
+# Rows are written to the sheet in the background, off the event loop
+sheet_writer = SheetWriteQueue(
+    sheets_client,
+    batch_size=SHEET_BATCH_SIZE,
+    flush_interval_ms=SHEET_FLUSH_MS,
+    on_written=publish_ledger.mark_written,
+    governor=sheets_governor,
+    max_batch_size=SHEET_MAX_BATCH_SIZE,
+)
+
+# In-memory copy of the sheet for read paths, synced by polling
+sheet_replica = SheetReplica(
+    sheets_client,
+    sheets_governor,
+    columns=len(HEADERS),
+    poll_interval=SHEET_REPLICA_POLL_SECONDS,
+) if SHEET_REPLICA_POLL_SECONDS > 0 else None
+
+async def fetch_listing_photo(bot, file_id):
+    """A posted photo's bytes, downloaded again from Telegram for the Drive archive"""
+    photo_file = await retry_telegram_request(bot.get_file, file_id, priority=PRIORITY_CHANNEL)
+    return bytes(await photo_file.download_as_bytearray())
+
+# Posted listings' photos are copied to Drive in the background; their Drive
+# file IDs are written back to the sheet's Drive Photo columns
+drive_archiver = DriveArchiver(
+    fetch_listing_photo,
+    google_clients.new_drive_service,
+    sheets_client,
+    sheets_governor,
+    listing_store,
+    DRIVE_FOLDER_ID,
+    drive_column=HEADERS.index("Drive Photo 1") + 1,
+    workers=DRIVE_UPLOAD_WORKERS,
+    public=DRIVE_PHOTOS_PUBLIC,
+    image_stage=photo_stage,
+) if DRIVE_FOLDER_ID else None
 
 # Conversation states
 RENT_SELL, PROPERTY_USE, HOUSE_TYPE, ROOMS, AREA, LOCATION, PRICE, INFO, CONTACT, PHOTOS, CONFIRM = range(11)
+STATE_NAMES = [
+    "RENT_SELL", "PROPERTY_USE", "HOUSE_TYPE", "ROOMS", "AREA", "LOCATION",
+    "PRICE", "INFO", "CONTACT", "PHOTOS", "CONFIRM"
+]
+
+# Metrics exported on /metrics
+HANDLER_SECONDS = REGISTRY.histogram("handler_seconds", "Handler latency by conversation state", ["state"])
+BOT_API_SECONDS = REGISTRY.histogram("bot_api_call_seconds", "Bot API call latency by method", ["method"])
+BOT_API_ERRORS = REGISTRY.counter("bot_api_call_errors", "Failed Bot API calls by method and error", ["method", "error"])
 
-# Retry configuration for Telegram API
-MAX_RETRIES = 3
-RETRY_DELAY = 2
+# user id -> conversation state, maintained by the instrumented handlers
+active_conversations = {}
 
-async def retry_telegram_request(coroutine_func, *args, **kwargs):
-    """Helper function to retry Telegram API calls"""
-    for attempt in range(MAX_RETRIES):
+def instrumented(state_name, callback):
+    """Wrap a conversation handler to time it and track the state it moves to"""
+    latency = HANDLER_SECONDS.labels(state_name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
         try:
-            return await coroutine_func(*args, **kwargs)
-        except TimedOut:
-            if attempt < MAX_RETRIES - 1:
-                await asyncio.sleep(RETRY_DELAY)
-                continue
-            raise
-    return None
+            new_state = await callback(update, context)
+        finally:
+            latency.observe(time.perf_counter() - started)
+        if update.effective_user is not None and new_state is not None:
+            if new_state == ConversationHandler.END:
+                active_conversations.pop(update.effective_user.id, None)
+            else:
+                active_conversations[update.effective_user.id] = new_state
+        return new_state
+    return wrapper
+
+def conversations_by_state():
+    counts = {(name,): 0 for name in STATE_NAMES}
+    for state in active_conversations.values():
+        counts[(STATE_NAMES[state],)] += 1
+    return counts
+
+REGISTRY.gauge("active_conversations", "In-progress /post conversations by state",
+               conversations_by_state, ["state"])
+
+# Retry configuration for Telegram API, per endpoint. Sends are not idempotent:
+# after a timeout they may already be delivered, so call_with_policy would only
+# retry them on RetryAfter, and the outbound scheduler already re-queues those
+# itself. They get one attempt here; failed channel posts are retried later by
+# retry_channel_posts
+REPLY_POLICY = RetryPolicy("reply", max_attempts=1, base_delay=0.5, max_delay=4)
+PUBLISH_POLICY = RetryPolicy("publish", max_attempts=1, base_delay=2, max_delay=60)
+IDEMPOTENT_POLICY = RetryPolicy("idempotent", max_attempts=4, base_delay=0.5, max_delay=8, idempotent=True)
+ENDPOINT_POLICIES = {
+    "send_message": PUBLISH_POLICY,
+    "send_media_group": PUBLISH_POLICY,
+    "get_file": IDEMPOTENT_POLICY,
+    "set_webhook": IDEMPOTENT_POLICY,
+    "answer": IDEMPOTENT_POLICY,
+    "edit_message_text": IDEMPOTENT_POLICY,
+    "edit_message_reply_markup": IDEMPOTENT_POLICY,
+}
+
+# Sheds Bot API calls while Telegram is failing instead of piling up retries
+bot_api_breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+
+# Every outgoing Bot API call goes through the rate-limited scheduler;
+# interactive replies run ahead of queued channel posts
+outbound = OutboundScheduler()
+
+# Channel posts run in the background; keep references so they aren't collected
+background_tasks = set()
+
+async def retry_telegram_request(coroutine_func, *args, policy=None, **kwargs):
+    """Call the Telegram API with the endpoint's retry policy (``priority`` picks the outbound queue)"""
+    method = getattr(coroutine_func, "__name__", "unknown")
+    if policy is None:
+        policy = ENDPOINT_POLICIES.get(method, REPLY_POLICY)
+    started = time.perf_counter()
+    try:
+        return await call_with_policy(policy, bot_api_breaker, outbound.run, coroutine_func, *args, **kwargs)
+    except Exception as e:
+        BOT_API_ERRORS.labels(method, type(e).__name__).inc()
+        raise
+    finally:
+        BOT_API_SECONDS.labels(method).observe(time.perf_counter() - started)
+
+async def begin_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Runs before the real handlers: gives the update its Bot API time budget"""
+    start_budget(UPDATE_BUDGET)
+
+def build_media_group(file_ids, caption):
+    """Build an album from Telegram file_ids, captioning the first photo"""
+    return [
+        InputMediaPhoto(
+            media=file_id,
+            caption=caption if i == 0 else None,
+            parse_mode=ParseMode.HTML
+        )
+        for i, file_id in enumerate(file_ids)
+    ]
+
+async def publish_listing(bot, channel_id, photos, caption, property_id):
+    """Post a listing to its channel, falling back to text if Telegram rejects the album"""
+    # Runs in its own task; the budget of the update that queued it doesn't apply
+    clear_budget()
+    if not publish_ledger.begin(property_id):
+        return
+    try:
+        if photos:
+            try:
+                messages = await retry_telegram_request(
+                    bot.send_media_group,
+                    chat_id=channel_id,
+                    media=build_media_group(photos, caption),
+                    priority=PRIORITY_CHANNEL
+                )
+                publish_ledger.mark_published(property_id, [message.message_id for message in messages])
+                return
+            except BadRequest as e:
+                # Telegram refused the album, so nothing was posted yet
+                logger.error(f"Error sending media to channel: {e}")
+        message = await retry_telegram_request(
+            bot.send_message,
+            chat_id=channel_id,
+            text=caption,
+            parse_mode=ParseMode.HTML,
+            priority=PRIORITY_CHANNEL
+        )
+        publish_ledger.mark_published(property_id, [message.message_id])
+    except NetworkError as e:
+        if isinstance(e, BadRequest):
+            logger.error(f"Failed to publish listing {property_id} to channel: {e}")
+            publish_ledger.mark_failed(property_id)
+            return
+        # The request may have reached Telegram before the connection failed;
+        # posting again could put the listing in the channel twice
+        publish_ledger.mark_unknown(property_id)
+        logger.error(f"Channel post of listing {property_id} may or may not have gone out, not posting it again: {e}")
+    except Exception as e:
+        logger.error(f"Failed to publish listing {property_id} to channel: {e}")
+        publish_ledger.mark_failed(property_id)
+    finally:
+        publish_ledger.end(property_id)
+
+async def retry_channel_posts(bot):
+    """Post confirmed listings whose channel post failed or was cut off by a restart"""
+    while True:
+        due = publish_ledger.due()
+        for entry in due:
+            schedule_channel_post(bot, entry.channel_id, entry.photos, entry.caption, entry.property_id)
+        if due:
+            logger.info(f"Retrying {len(due)} channel posts from the publish ledger")
+        await asyncio.sleep(min(PUBLISH_RETRY_SECONDS, 60))
+
+async def archive_listing_photos(refs, property_id):
+    try:
+        await photo_spool.archive(refs, property_id)
+    except Exception as e:
+        logger.error(f"Failed to archive photos of listing {property_id}: {e}")
+
+def schedule_channel_post(bot, channel_id, photos, caption, property_id):
+    """Queue a channel post without making the user wait for it"""
+    task = asyncio.create_task(publish_listing(bot, channel_id, photos, caption, property_id))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 # ======================================================================
 # BUTTON CONFIGURATIONS
@@ -110,36 +385,70 @@ def create_keyboard(button_keys, one_time=True):
         rows.append(row)
     return ReplyKeyboardMarkup(rows, one_time_keyboard=one_time, resize_keyboard=True)
 
-# Button configurations
-RENT_SELL_BUTTONS = create_keyboard([["rent", "sell"]])
-PROPERTY_USE_BUTTONS = create_keyboard([
+# Button layouts (shared by the /post keyboards and the /search filters)
+RENT_SELL_KEYS = [["rent", "sell"]]
+PROPERTY_USE_KEYS = [
     ["residence", "shop"],
     ["office", "cafe"],
     ["warehouse", "other"]
-])
-HOUSE_TYPE_BUTTONS = create_keyboard([
+]
+HOUSE_TYPE_KEYS = [
     ["traditional", "condominium"],
     ["apartment", "compound_villa"]
-])
-ROOMS_BUTTONS = create_keyboard([
+]
+ROOMS_KEYS = [
     ["single_room", "one_bedroom"],
     ["two_bedroom", "three_bedroom"],
     ["more_than_three"]
-])
-AREA_BUTTONS = create_keyboard([
+]
+AREA_KEYS = [
     ["area_small", "area_16_25"],
     ["area_26_50", "area_51_75"],
     ["area_76_110", "area_large"]
-])
+]
+
+# Button configurations
+RENT_SELL_BUTTONS = create_keyboard(RENT_SELL_KEYS)
+PROPERTY_USE_BUTTONS = create_keyboard(PROPERTY_USE_KEYS)
+HOUSE_TYPE_BUTTONS = create_keyboard(HOUSE_TYPE_KEYS)
+ROOMS_BUTTONS = create_keyboard(ROOMS_KEYS)
+AREA_BUTTONS = create_keyboard(AREA_KEYS)
 PREVIEW_BUTTON = create_keyboard([["preview"]])
 CONTACT_BUTTON = create_keyboard([["share_contact"]])
 CONFIRM_BUTTONS = create_keyboard([["confirm", "cancel"]])
 
+# ======================================================================
+# INPUT HELPERS (pure functions; benchmarked by bench_hot_paths.py)
+# ======================================================================
+PRICE_RE = re.compile(r'^[0-9,.\s]+$')
+NON_DIGIT_RE = re.compile(r"\D")
+
+def normalize_shared_phone(raw_phone):
+    """Normalize a shared contact's number to 10-digit local format with space before 0"""
+    digits = NON_DIGIT_RE.sub("", raw_phone)
+    if digits.startswith("251") and len(digits) == 12:
+        return " 0" + digits[3:]  # 251911223344 →  0911223344
+    if digits.startswith("9") and len(digits) == 9:
+        return " 0" + digits  # 911223344 →  0911223344
+    if digits.startswith("0") and len(digits) == 10:
+        return "  " + digits  # 0911223344 →  0911223344
+    return "  " + raw_phone  # fallback
+
+def normalize_typed_phone(text):
+    """Normalize a typed phone number, or return None if it isn't one"""
+    digits = NON_DIGIT_RE.sub("", text.strip())
+    if len(digits) == 10 and digits.startswith("0"):
+        return " " + digits
+    if len(digits) == 9:
+        return " 0" + digits
+    return None
+
 # ======================================================================
 # CONVERSATION HANDLERS (UPDATED WITH AMHARIC TEXT REFERENCES)
 # ======================================================================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # --- Cleanup like /cancel ---
+    await discard_draft(context)
     context.user_data.clear()
     context.chat_data.clear()
 
@@ -149,8 +458,43 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # --- Start fresh ---
     await retry_telegram_request(update.message.reply_text, TEXTS["messages"]["start"])
 
+def get_draft(context):
+    """The user's in-progress listing, created if missing; marks it as active"""
+    draft = context.user_data.get("draft")
+    if draft is None:
+        draft = context.user_data["draft"] = ListingDraft()
+    draft.updated_at = time.time()
+    return draft
+
+async def discard_draft(context):
+    """Drop the user's draft and its archive copies of photos"""
+    draft = context.user_data.pop("draft", None)
+    if draft is not None:
+        await photo_spool.discard(draft.photo_refs)
+
+def requires_draft(callback):
+    """End the conversation if the user's draft was evicted while they were away"""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        if context.user_data.get("draft") is None:
+            await retry_telegram_request(
+                update.message.reply_text,
+                TEXTS["messages"]["draft_expired"],
+                reply_markup=ReplyKeyboardRemove()
+            )
+            return ConversationHandler.END
+        return await callback(update, context)
+    return wrapper
+
+async def ask_again(update, message_key, keyboard, state):
+    """Repeat a keyboard question when the answer isn't one of its buttons"""
+    await retry_telegram_request(update.message.reply_text, TEXTS["messages"][message_key], reply_markup=keyboard)
+    return state
+
 async def post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await discard_draft(context)
     context.user_data.clear()
+    get_draft(context)
     await retry_telegram_request(
         update.message.reply_text,
         TEXTS["messages"]["post_start"],
@@ -166,7 +510,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     )
     
 async def get_rent_sell(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["rent_or_sell"] = update.message.text
+    if not get_draft(context).set_choice("rent_or_sell", update.message.text):
+        return await ask_again(update, "post_start", RENT_SELL_BUTTONS, RENT_SELL)
     await retry_telegram_request(
         update.message.reply_text,
         TEXTS["messages"]["ask_property_use"],
@@ -175,12 +520,14 @@ async def get_rent_sell(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return PROPERTY_USE
 
 async def get_property_use(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["property_use"] = update.message.text
+    draft = get_draft(context)
+    if not draft.set_choice("property_use", update.message.text):
+        return await ask_again(update, "ask_property_use", PROPERTY_USE_BUTTONS, PROPERTY_USE)
     
     # Skip house type and rooms for warehouse/store and other non-residential types
-    if context.user_data["property_use"] in [TEXTS["buttons"]["warehouse"], TEXTS["buttons"]["other"]]:
-        context.user_data["house_type"] = "N/A"
-        context.user_data["rooms"] = "N/A"
+    if draft.choice_key("property_use") in ("warehouse", "other"):
+        draft.house_type = NOT_APPLICABLE
+        draft.rooms = NOT_APPLICABLE
         await retry_telegram_request(
             update.message.reply_text,
             TEXTS["messages"]["ask_area"],
@@ -197,7 +544,8 @@ async def get_property_use(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     return HOUSE_TYPE
 
 async def get_house_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["house_type"] = update.message.text
+    if not get_draft(context).set_choice("house_type", update.message.text):
+        return await ask_again(update, "ask_house_type", HOUSE_TYPE_BUTTONS, HOUSE_TYPE)
     await retry_telegram_request(
         update.message.reply_text,
         TEXTS["messages"]["ask_rooms"],
@@ -206,7 +554,8 @@ async def get_house_type(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return ROOMS
 
 async def get_rooms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["rooms"] = update.message.text
+    if not get_draft(context).set_choice("rooms", update.message.text):
+        return await ask_again(update, "ask_rooms", ROOMS_BUTTONS, ROOMS)
     await retry_telegram_request(
         update.message.reply_text,
         TEXTS["messages"]["ask_area"],
@@ -215,7 +564,8 @@ async def get_rooms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return AREA
 
 async def get_area(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["area"] = update.message.text
+    if not get_draft(context).set_choice("area", update.message.text):
+        return await ask_again(update, "ask_area", AREA_BUTTONS, AREA)
     await retry_telegram_request(
         update.message.reply_text,
         TEXTS["messages"]["ask_location"],
@@ -234,7 +584,7 @@ async def get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             )
             return LOCATION
             
-        context.user_data["location"] = location
+        get_draft(context).location = location
         await retry_telegram_request(
             update.message.reply_text,
             TEXTS["messages"]["ask_price"],
@@ -253,11 +603,11 @@ async def get_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def get_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     price = update.message.text.strip()
-    if not price or not re.match(r'^[0-9,.\s]+$', price):
+    if not price or not PRICE_RE.match(price):
         await retry_telegram_request(update.message.reply_text, TEXTS["messages"]["invalid_price"])
         return PRICE
         
-    context.user_data["price"] = price
+    get_draft(context).price = price
     await retry_telegram_request(
         update.message.reply_text,
         TEXTS["messages"]["ask_info"],
@@ -266,7 +616,7 @@ async def get_price(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return INFO
 
 async def get_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    context.user_data["info"] = update.message.text
+    get_draft(context).info = update.message.text
     contact_example = TEXTS["messages"]["contact_format_example"]
     await retry_telegram_request(
         update.message.reply_text,
@@ -280,30 +630,13 @@ async def get_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return CONTACT
 
 async def get_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    draft = get_draft(context)
     if update.message.contact:
-        raw_phone = update.message.contact.phone_number
-        # Normalize to 10-digit local format with space before 0
-        digits = re.sub(r"\D", "", raw_phone)
-        if digits.startswith("251") and len(digits) == 12:
-            normalized = " 0" + digits[3:]  # 251911223344 →  0911223344
-        elif digits.startswith("9") and len(digits) == 9:
-            normalized = " 0" + digits  # 911223344 →  0911223344
-        elif digits.startswith("0") and len(digits) == 10:
-            normalized = "  " + digits  # 0911223344 →  0911223344
-        else:
-            normalized = "  " + raw_phone  # fallback
-            
-        context.user_data["contact"] = normalized
+        draft.contact = normalize_shared_phone(update.message.contact.phone_number)
     else:
         # Manual phone number input
-        phone = update.message.text.strip()
-        digits = re.sub(r"\D", "", phone)
-        
-        if len(digits) == 10 and digits.startswith("0"):
-            normalized = " " + digits
-        elif len(digits) == 9:
-            normalized = " 0" + digits
-        else:
+        normalized = normalize_typed_phone(update.message.text)
+        if normalized is None:
             contact_example = TEXTS["messages"]["contact_format_example"]
             await retry_telegram_request(
                 update.message.reply_text,
@@ -316,10 +649,10 @@ async def get_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
             )
             return CONTACT
             
-        context.user_data["contact"] = normalized
+        draft.contact = normalized
 
-    context.user_data["posted_by"] = update.message.from_user.id
-    context.user_data["photos"] = []
+    draft.posted_by = update.message.from_user.id
+    draft.photos = []
 
     await retry_telegram_request(
         update.message.reply_text,
@@ -334,10 +667,8 @@ async def get_photos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         if update.message.text == TEXTS["buttons"]["preview"]:
             return await preview_listing(update, context)
         
-        # Initialize photos list if not exists
-        if "photos" not in context.user_data:
-            context.user_data["photos"] = []
-        
+        draft = get_draft(context)
+
         # Check if message contains photo
         if not update.message.photo:
             await retry_telegram_request(
@@ -347,8 +678,13 @@ async def get_photos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return PHOTOS
         
+        # Albums are acknowledged once, when the whole group has arrived
+        if update.message.media_group_id:
+            collect_album_photo(update, context, draft)
+            return PHOTOS
+
         # Check photo count
-        if len(context.user_data["photos"]) >= 3:
+        if len(draft.photos) >= MAX_PHOTOS:
             await retry_telegram_request(
                 update.message.reply_text,
                 TEXTS["messages"]["max_photos"],
@@ -356,14 +692,18 @@ async def get_photos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return PHOTOS
         
-        # Process photo
-        photo_file = await update.message.photo[-1].get_file()
-        photo_path = f"photo_{uuid.uuid4().hex}.jpg"
-        await photo_file.download_to_drive(photo_path)
-        context.user_data["photos"].append(photo_path)
+        # Telegram keeps the photo; its file_id can be re-sent without uploading again
+        photo = update.message.photo[-1]
+        draft.photos.append(photo.file_id)
+
+        # Optional local archive copy
+        if PHOTO_ARCHIVE:
+            ref = await archive_photo(update.effective_user.id, update.message.photo)
+            if ref is not None:
+                draft.photo_refs.append(ref)
         
         # Only send message when all 3 photos are added
-        if len(context.user_data["photos"]) == 3:
+        if len(draft.photos) == MAX_PHOTOS:
             await retry_telegram_request(
                 update.message.reply_text,
                 TEXTS["messages"]["all_photos_added"],
@@ -382,59 +722,98 @@ async def get_photos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return PHOTOS
 
 
+async def archive_photo(user_id, sizes):
+    """Spool an archive copy of a photo; its reference, or None if the budget is used up"""
+    try:
+        return await photo_spool.add(user_id, sizes, lambda size: retry_telegram_request(size.get_file))
+    except SpoolFull as e:
+        logger.warning(f"Not archiving a photo of user {user_id}: {e}")
+        return None
+
+# (user id, media_group_id) -> album still arriving; see collect_album_photo
+pending_albums = {}
+
+def collect_album_photo(update, context, draft):
+    """Add one photo of an album and (re)start the timer that acknowledges the album.
+
+    Each photo of an album is its own update. They are added to the draft as
+    they come (the cap applies across the whole group); once no photo of the
+    group has arrived for ALBUM_WINDOW_MS, finish_album sends one reply and
+    archives the photos together.
+    """
+    key = (update.effective_user.id, update.message.media_group_id)
+    album = pending_albums.get(key)
+    if album is None:
+        album = pending_albums[key] = {"photos": [], "skipped": 0, "timer": None}
+
+    if len(draft.photos) < MAX_PHOTOS:
+        draft.photos.append(update.message.photo[-1].file_id)
+        album["photos"].append(update.message.photo)
+    else:
+        album["skipped"] += 1
+
+    if album["timer"] is not None:
+        album["timer"].cancel()
+    album["timer"] = asyncio.create_task(finish_album(key, update.message, context, draft))
+    background_tasks.add(album["timer"])
+    album["timer"].add_done_callback(background_tasks.discard)
+
+async def finish_album(key, message, context, draft):
+    """Archive an album's photos and send its single acknowledgement"""
+    await asyncio.sleep(ALBUM_WINDOW_MS / 1000)
+    album = pending_albums.pop(key)
+    # Detached from the update that started it; give it a budget of its own
+    start_budget(UPDATE_BUDGET)
+    try:
+        if PHOTO_ARCHIVE and album["photos"]:
+            results = await asyncio.gather(*(archive_photo(key[0], sizes) for sizes in album["photos"]),
+                                           return_exceptions=True)
+            refs = [result for result in results if isinstance(result, str)]
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Error archiving album photo: {result}")
+            if context.user_data.get("draft") is draft:
+                draft.photo_refs.extend(refs)
+                # Changed outside an update, so PTB wouldn't save it otherwise
+                context.application.mark_data_for_update_persistence(user_ids=key[0])
+            else:
+                await photo_spool.discard(refs)
+
+        if context.user_data.get("draft") is not draft:
+            # Posted or cancelled while the album was arriving
+            return
+        if album["skipped"]:
+            text = TEXTS["messages"]["max_photos"]
+        elif len(draft.photos) >= MAX_PHOTOS:
+            text = TEXTS["messages"]["all_photos_added"]
+        else:
+            text = TEXTS["messages"]["photo_added"].format(MAX_PHOTOS - len(draft.photos))
+        await retry_telegram_request(message.reply_text, text, reply_markup=PREVIEW_BUTTON)
+    except Exception as e:
+        logger.error(f"Error finishing album for user {key[0]}: {e}")
+
 async def preview_listing(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    data = context.user_data
+    draft = get_draft(context)
     
     # Check required fields
-    required_fields = ["rent_or_sell", "property_use", "area", "location", "price", "info", "contact"]
-    if not all(field in data for field in required_fields):
+    if not draft.is_complete():
         await update.message.reply_text(TEXTS["messages"]["incomplete_data"])
         return ConversationHandler.END
 
     
     # Generate ID and date if they don't exist
-    if "property_id" not in data:
-        data["property_id"] = str(uuid.uuid4().hex)[:8].upper()
-    if "date" not in data:
-        data["date"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-    
-    # Escape user inputs for safety
-    def esc(txt): return html.escape(str(txt))
-    
-    # Build caption
-    caption = TEXTS["messages"]["preview_title"]
-    caption += TEXTS["messages"]["property_id"].format(esc(data["property_id"]))
-    caption += TEXTS["messages"]["rent_or_sell"].format(esc(data["rent_or_sell"]))
-    caption += TEXTS["messages"]["property_use"].format(esc(data["property_use"]))
+    if draft.property_id is None:
+        draft.property_id = str(uuid.uuid4().hex)[:8].upper()
+    if draft.date is None:
+        draft.date = datetime.now().strftime("%Y-%m-%d %H:%M")
     
-    # Only include these if they exist
-    if "house_type" in data:
-        caption += TEXTS["messages"]["house_type"].format(esc(data["house_type"]))
-    if "rooms" in data:
-        caption += TEXTS["messages"]["rooms"].format(esc(data["rooms"]))
-        
-    caption += TEXTS["messages"]["area"].format(esc(data["area"]))
-    caption += TEXTS["messages"]["location"].format(esc(data["location"]))
-    caption += TEXTS["messages"]["price"].format(esc(data["price"]))
-    caption += TEXTS["messages"]["details"].format(esc(data["info"]))
-    caption += TEXTS["messages"]["contact"].format(esc(data["contact"]))
-    
-    username = update.message.from_user.username or str(data["posted_by"])
-    caption += TEXTS["messages"]["posted_by"].format(esc(username))
-    caption += TEXTS["messages"]["date"].format(esc(data["date"]))
-    caption += "\n\n" + TEXTS["messages"]["footer"]
+    # Build caption (user inputs are escaped); kept on the draft for confirm()
+    caption = captions.cached(draft, update.message.from_user.username or str(draft.posted_by))
 
     # Send preview to user
-    if data.get("photos"):
+    if draft.photos:
         try:
-            media = []
-            for i, path in enumerate(data["photos"]):
-                with open(path, "rb") as f:
-                    media.append(InputMediaPhoto(
-                        media=f,
-                        caption=caption if i == 0 else None,
-                        parse_mode=ParseMode.HTML
-                    ))
+            media = build_media_group(draft.photos, caption)
             await retry_telegram_request(context.bot.send_media_group, chat_id=update.message.chat_id, media=media)
         except Exception as e:
             logger.error(f"Media group error: {e}")
@@ -463,11 +842,11 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if user_input == TEXTS["buttons"]["cancel"]:
         return await cancel(update, context)
     
-    data = context.user_data
+    draft = get_draft(context)
     
     try:
         # Check if already posted (prevent duplicates)
-        if data.get("posted_to_channel"):
+        if draft.posted_to_channel:
             await retry_telegram_request(
                 update.message.reply_text,
                 TEXTS["messages"]["already_posted"],
@@ -475,93 +854,43 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             )
             return ConversationHandler.END
         
-        # Rebuild caption to ensure we have all fields
-        def esc(txt): return html.escape(str(txt))
-        caption = TEXTS["messages"]["preview_title"]
-        caption += TEXTS["messages"]["property_id"].format(esc(data["property_id"]))
-        caption += TEXTS["messages"]["rent_or_sell"].format(esc(data["rent_or_sell"]))
-        caption += TEXTS["messages"]["property_use"].format(esc(data["property_use"]))
-        if "house_type" in data:
-            caption += TEXTS["messages"]["house_type"].format(esc(data["house_type"]))
-        if "rooms" in data:
-            caption += TEXTS["messages"]["rooms"].format(esc(data["rooms"]))
-        caption += TEXTS["messages"]["area"].format(esc(data["area"]))
-        caption += TEXTS["messages"]["location"].format(esc(data["location"]))
-        caption += TEXTS["messages"]["price"].format(esc(data["price"]))
-        caption += TEXTS["messages"]["details"].format(esc(data["info"]))
-        caption += TEXTS["messages"]["contact"].format(esc(data["contact"]))
-        username = update.message.from_user.username or str(data["posted_by"])
-        caption += TEXTS["messages"]["posted_by"].format(esc(username))
-        caption += TEXTS["messages"]["date"].format(esc(data["date"]))
-        caption += "\n\n" + TEXTS["messages"]["footer"]
+        # Same caption as the preview; only rendered again if a field changed since
+        caption = captions.cached(draft, update.message.from_user.username or str(draft.posted_by), "channel")
 
         # Determine which channel to post to based on rent/sell
-        channel_id = CHANNEL_ID2 if data["rent_or_sell"] == TEXTS["buttons"]["sell"] else CHANNEL_ID
+        channel_id = CHANNEL_ID2 if draft.choice_key("rent_or_sell") == "sell" else CHANNEL_ID
         
-        # Post to channel
-        if data.get("photos"):
-            try:
-                media = []
-                for i, photo_path in enumerate(data["photos"]):
-                    with open(photo_path, "rb") as photo_file:
-                        media.append(InputMediaPhoto(
-                            media=photo_file,
-                            caption=caption if i == 0 else None,
-                            parse_mode=ParseMode.HTML
-                        ))
-                await retry_telegram_request(
-                    context.bot.send_media_group,
-                    chat_id=channel_id,
-                    media=media
-                )
-            except Exception as e:
-                logger.error(f"Error sending media to channel: {e}")
-                await retry_telegram_request(
-                    context.bot.send_message,
-                    chat_id=channel_id,
-                    text=caption,
-                    parse_mode=ParseMode.HTML
-                )
-        else:
+        # Save to Google Sheets (photo columns hold re-sendable file_ids)
+        username = update.message.from_user.username
+        row = draft.sheet_row(f"@{username}" if username else str(draft.posted_by))
+
+        # Record the listing, its sheet row and its channel post before doing any of them;
+        # a redelivered or double-tapped confirm finds the Property ID already claimed
+        entry = publish_ledger.claim(draft.property_id, row, channel_id, draft.photos, caption)
+        if entry is None:
             await retry_telegram_request(
-                context.bot.send_message,
-                chat_id=channel_id,
-                text=caption,
-                parse_mode=ParseMode.HTML
+                update.message.reply_text,
+                TEXTS["messages"]["already_posted"],
+                reply_markup=ReplyKeyboardRemove()
             )
-        
-        # Mark as posted to prevent duplicates
-        data["posted_to_channel"] = True
-        
-        # Save to Google Sheets
-        row = [
-            data["property_id"],
-            data["rent_or_sell"],
-            data["property_use"],
-            data.get("house_type", "N/A"),
-            data.get("rooms", "N/A"),
-            data["area"],
-            data["location"],
-            data["price"],
-            data["info"],
-            data["contact"],
-            f"@{update.message.from_user.username}" if update.message.from_user.username else str(data["posted_by"]),
-            data["date"],
-        ]
-        
-        # Add photo paths
-        for i in range(3):
-            row.append(data["photos"][i] if i < len(data["photos"]) else "")
-            
-        worksheet.append_row(row)
-        logger.info(f"Saved to Google Sheets: {data['property_id']}")
-        
-        # Cleanup photos
-        for photo_path in data.get("photos", []):
-            try:
-                os.remove(photo_path)
-            except OSError:
-                pass
+            return ConversationHandler.END
+        draft.posted_to_channel = True
+
+        # Post to channel (queued behind interactive replies, never awaited here)
+        schedule_channel_post(context.bot, channel_id, draft.photos, caption, draft.property_id)
+
+        listing_index.add(row)
+        sheet_writer.enqueue(row, key=entry.outbox_id)
+        if drive_archiver is not None:
+            drive_archiver.enqueue(draft.property_id, draft.photos)
+        logger.info(f"Saved listing {draft.property_id}, queued for Google Sheets")
+
+        # Archived photos now belong to the listing, not the draft (resizing may take a while)
+        if draft.photo_refs:
+            task = asyncio.create_task(archive_listing_photos(draft.photo_refs, draft.property_id))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+            draft.photo_refs = []
         
         await retry_telegram_request(
             update.message.reply_text,
@@ -583,12 +912,13 @@ async def confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def preview_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Ensure we have all required fields
-    if "property_id" not in context.user_data:
-        context.user_data["property_id"] = str(uuid.uuid4().hex)[:8].upper()
-    if "date" not in context.user_data:
-        context.user_data["date"] = datetime.now().strftime("%Y-%m-%d %H:%M")
-    if "posted_by" not in context.user_data:
-        context.user_data["posted_by"] = update.message.from_user.id
+    draft = get_draft(context)
+    if draft.property_id is None:
+        draft.property_id = str(uuid.uuid4().hex)[:8].upper()
+    if draft.date is None:
+        draft.date = datetime.now().strftime("%Y-%m-%d %H:%M")
+    if draft.posted_by is None:
+        draft.posted_by = update.message.from_user.id
     
     # Set the conversation state to CONFIRM
     context.user_data["_conversation_state"] = CONFIRM
@@ -596,15 +926,8 @@ async def preview_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    # Cleanup any uploaded photos
-    photos = context.user_data.get("photos", [])
-    for photo_path in photos:
-        try:
-            os.remove(photo_path)
-        except OSError:
-            pass
-
-    # Clear all per-user and per-chat data
+    # Cleanup any archived photos, then all per-user and per-chat data
+    await discard_draft(context)
     context.user_data.clear()
     context.chat_data.clear()
 
@@ -621,6 +944,139 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
+# ======================================================================
+# SEARCH (inline keyboard, so it never interferes with a /post flow)
+# ======================================================================
+SEARCH_FACETS = {
+    "rent_or_sell": RENT_SELL_KEYS,
+    "property_use": PROPERTY_USE_KEYS,
+    "house_type": HOUSE_TYPE_KEYS,
+    "rooms": ROOMS_KEYS,
+    "area": AREA_KEYS,
+}
+SEARCH_PRICE_RE = re.compile(r'^([0-9][0-9,.]*)?-([0-9][0-9,.]*)?$')
+SEARCH_LIMIT = 10
+
+def parse_search_args(args):
+    """Split /search arguments into a location substring and a price range"""
+    location_words = []
+    min_price = max_price = None
+    for arg in args:
+        match = SEARCH_PRICE_RE.match(arg)
+        if match and any(match.groups()):
+            min_price = parse_price(match.group(1)) if match.group(1) else None
+            max_price = parse_price(match.group(2)) if match.group(2) else None
+        else:
+            location_words.append(arg)
+    return " ".join(location_words) or None, min_price, max_price
+
+def facet_label(field):
+    """Field label taken from the caption template, e.g. '💼 አይነት'"""
+    return TEXTS["messages"][field].split(":")[0]
+
+def search_menu(search):
+    """Build the search summary text and its filter keyboard"""
+    any_text = TEXTS["buttons"]["search_any"]
+    text = TEXTS["messages"]["search_menu"] + "\n\n"
+    if search["location"]:
+        text += TEXTS["messages"]["location"].format(html.escape(search["location"]))
+    if search["min_price"] is not None or search["max_price"] is not None:
+        low = f"{search['min_price']:,.0f}" if search["min_price"] is not None else ""
+        high = f"{search['max_price']:,.0f}" if search["max_price"] is not None else ""
+        text += TEXTS["messages"]["price"].format(f"{low} - {high}")
+
+    rows = []
+    for field in SEARCH_FACETS:
+        key = search["facets"].get(field)
+        value = TEXTS["buttons"][key] if key else any_text
+        rows.append([InlineKeyboardButton(f"{facet_label(field)}: {value}", callback_data=f"s:f:{field}")])
+    rows.append([InlineKeyboardButton(TEXTS["buttons"]["search_run"], callback_data="s:go")])
+    return text, InlineKeyboardMarkup(rows)
+
+def search_options(field):
+    """Keyboard listing one facet's values plus 'any'"""
+    rows = [
+        [InlineKeyboardButton(TEXTS["buttons"][key], callback_data=f"s:v:{field}:{key}") for key in row_keys]
+        for row_keys in SEARCH_FACETS[field]
+    ]
+    rows.append([InlineKeyboardButton(TEXTS["buttons"]["search_any"], callback_data=f"s:v:{field}:*")])
+    return InlineKeyboardMarkup(rows)
+
+def search_results(search):
+    """Run the search against the in-memory index and format the matches"""
+    facets = {field: TEXTS["buttons"][key] for field, key in search["facets"].items()}
+    rows = listing_index.search(
+        facets=facets,
+        location=search["location"],
+        min_price=search["min_price"],
+        max_price=search["max_price"],
+        limit=SEARCH_LIMIT,
+    )
+    if not rows:
+        return TEXTS["messages"]["search_no_results"]
+
+    def esc(txt): return html.escape(str(txt))
+    text = TEXTS["messages"]["search_results"]
+    for row in rows:
+        text += TEXTS["messages"]["search_result"].format(
+            id=esc(row[0]), rent_or_sell=esc(row[1]), property_use=esc(row[2]),
+            location=esc(row[6]), price=esc(row[7]), contact=esc(row[9]),
+        )
+    return text
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    location, min_price, max_price = parse_search_args(context.args or [])
+    search = {"facets": {}, "location": location, "min_price": min_price, "max_price": max_price}
+    context.user_data["search"] = search
+    text, keyboard = search_menu(search)
+    await retry_telegram_request(
+        update.message.reply_text,
+        text,
+        reply_markup=keyboard,
+        parse_mode=ParseMode.HTML
+    )
+
+async def search_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await retry_telegram_request(query.answer)
+    search = context.user_data.get("search")
+    if search is None:
+        await retry_telegram_request(query.edit_message_text, TEXTS["messages"]["search_expired"])
+        return
+
+    parts = query.data.split(":")
+    if parts[1] == "f":
+        # Show the values for one facet
+        await retry_telegram_request(
+            query.edit_message_reply_markup,
+            reply_markup=search_options(parts[2])
+        )
+        return
+
+    if parts[1] == "v":
+        field, key = parts[2], parts[3]
+        if key == "*":
+            search["facets"].pop(field, None)
+        else:
+            search["facets"][field] = key
+        text, keyboard = search_menu(search)
+    else:
+        text = search_results(search)
+        _, keyboard = search_menu(search)
+
+    try:
+        await retry_telegram_request(
+            query.edit_message_text,
+            text,
+            reply_markup=keyboard,
+            parse_mode=ParseMode.HTML
+        )
+    except BadRequest as e:
+        # Re-running an unchanged search leaves the message as it is
+        if "not modified" not in str(e):
+            raise
+
+
 
 
 # Assuming other imports and handlers like start, post, get_rent_sell, etc., are defined above
@@ -629,79 +1085,229 @@ logger = logging.getLogger(__name__)
 
 
 
-async def handle_webhook(request: web.Request):
-    """Handle incoming webhook updates."""
-    bot = request.app['bot']
-    data = await request.json()
-    update = telegram.Update.de_json(data, bot)
-    await request.app['application'].update_queue.put(update)
-    return web.Response(text="OK")
+async def metrics_endpoint(request):
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
 
 async def health_check(request):
-    return web.Response(text="Bot is running")
+    lag = listing_store.replication_lag()
+    unknown = listing_store.unknown_publications()
+    depth = outbound.depth()
+    ingestor = request.app['ingestor']
+    return web.Response(text=(
+        f"Bot is running\n"
+        f"sheet_replication_lag_seconds {lag:.1f}\n"
+        f"publish_unknown_posts {unknown}\n"
+        f"outbound_queue_interactive {depth[PRIORITY_INTERACTIVE]}\n"
+        f"outbound_queue_channel {depth[PRIORITY_CHANNEL]}\n"
+        f"webhook_backlog {ingestor.depth()}\n"
+        f"webhook_rejected_total {ingestor.rejected}\n"
+        f"webhook_invalid_total {ingestor.invalid}\n"
+        f"webhook_duplicates_total {ingestor.duplicates}"
+    ))
+
+async def warm_up_google():
+    """Connect to Google Sheets once the bot is serving"""
+    await sheets_client.warm_up(startup_timer)
+
+    if sheet_replica is not None:
+        try:
+            with startup_timer.phase("sheet_replica"):
+                await sheet_replica.load()
+        except Exception as e:
+            logger.error(f"Error loading the sheet replica: {e}")
+        sheet_replica.start()
 
-async def main():
-    application = (
-        ApplicationBuilder()
-        .token(BOT_TOKEN)
-        .build()
-    )
+    # First run without a local store: seed the search index from the sheet once
+    if not len(listing_index):
+        try:
+            with startup_timer.phase("search_index_from_sheet"):
+                if sheet_replica is not None and sheet_replica.loaded:
+                    rows = sheet_replica.rows()
+                else:
+                    (rows,) = await sheets_governor.call(
+                        READ, "batch_get", sheets_client.batch_get, [f"A2:{column_letter(len(HEADERS))}"]
+                    )
+                listing_index.load(rows)
+        except Exception as e:
+            logger.error(f"Error loading listings from the sheet: {e}")
+    startup_timer.report("Startup timing incl. Google warm-up")
 
-    # Add handlers like before
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("post", post)],
+def step(state_name, callback):
+    """A conversation state's callback: timed, and only run while the draft exists"""
+    return instrumented(state_name, requires_draft(callback))
+
+def build_conversation_handler():
+    """The /post flow: one state per question, RENT_SELL through CONFIRM"""
+    return ConversationHandler(
+        entry_points=[CommandHandler("post", instrumented("POST", post))],
         states={
-            RENT_SELL: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_rent_sell)],
-            PROPERTY_USE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_property_use)],
-            HOUSE_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_house_type)],
-            ROOMS: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_rooms)],
-            AREA: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_area)],
-            LOCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_location)],
-            PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_price)],
-            INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, get_info)],
+            RENT_SELL: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("RENT_SELL", get_rent_sell))],
+            PROPERTY_USE: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("PROPERTY_USE", get_property_use))],
+            HOUSE_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("HOUSE_TYPE", get_house_type))],
+            ROOMS: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("ROOMS", get_rooms))],
+            AREA: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("AREA", get_area))],
+            LOCATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("LOCATION", get_location))],
+            PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("PRICE", get_price))],
+            INFO: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("INFO", get_info))],
             CONTACT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, get_contact),
-                MessageHandler(filters.CONTACT, get_contact),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, step("CONTACT", get_contact)),
+                MessageHandler(filters.CONTACT, step("CONTACT", get_contact)),
             ],
             PHOTOS: [
-                MessageHandler(filters.PHOTO, get_photos),
+                MessageHandler(filters.PHOTO, step("PHOTOS", get_photos)),
                 MessageHandler(
                     filters.TEXT & filters.Regex(f"^{re.escape(TEXTS['buttons']['preview'])}$"),
-                    preview_listing,
+                    step("PHOTOS", preview_listing),
                 ),
             ],
-            CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm)],
+            CONFIRM: [MessageHandler(filters.TEXT & ~filters.COMMAND, step("CONFIRM", confirm))],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", instrumented("CANCEL", cancel))],
         allow_reentry=True,
+        name="post_listing",
+        persistent=True,
+    )
+
+async def main():
+    # Image workers are forked, so before anything starts a thread
+    if photo_stage is not None:
+        with startup_timer.phase("image_stage"):
+            photo_stage.start()
+
+    build_started = time.perf_counter()
+    persistence = SQLitePersistence(
+        STATE_DB, update_interval=STATE_FLUSH_SECONDS, encode=encode_draft, decode=decode_draft
+    )
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .persistence(persistence)
+        # Different users run in parallel; each user's updates stay in order
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .build()
     )
 
+    # Add handlers like before
+    conv_handler = build_conversation_handler()
+
+    application.add_handler(TypeHandler(Update, begin_update), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("preview", preview_command))  #new added preview comand 
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CallbackQueryHandler(search_callback, pattern="^s:"))
+    startup_timer.record("build_application", time.perf_counter() - build_started)
 
+    with startup_timer.phase("search_index"):
+        listing_index.load(listing_store.all_listings())
 
     # Start the application but DO NOT call run_webhook or run_polling
-    await application.initialize()
-    await application.start()
+    with startup_timer.phase("application_start"):
+        await application.initialize()
+        await application.start()
+    outbound.start()
+    sheet_writer.start()
+    if drive_archiver is not None:
+        drive_archiver.start(application.bot)
+
+    # Evicts abandoned drafts and keeps PHOTO_DIR bounded; its first pass
+    # also sweeps photos orphaned before a restart
+    janitor = Janitor(
+        application,
+        persistence,
+        photo_spool,
+        ttl=DRAFT_TTL,
+        conversation_name=conv_handler.name,
+        interval=JANITOR_INTERVAL,
+        disk_quota=PHOTO_DISK_QUOTA_MB * 1024 * 1024,
+        listing_store=listing_store,
+        on_evict=lambda user_id: active_conversations.pop(user_id, None),
+    )
+    janitor.start()
+
+    # Replay listings that never reached the sheet (at-least-once delivery)
+    pending = listing_store.pending_outbox()
+    for outbox_id, row in pending:
+        # The process may have stopped after Google applied the append but before it was recorded
+        sheet_writer.enqueue(row, key=outbox_id, maybe_written=True)
+    if pending:
+        logger.info(f"Replaying {len(pending)} listings from the outbox to Google Sheets")
+
+    # Channel posts that failed, starting with those that hadn't gone out before the restart
+    publish_retry_task = asyncio.create_task(retry_channel_posts(application.bot))
+
+    # Setup aiohttp server (bound before the webhook is registered)
+    with startup_timer.phase("http_server"):
+        ingestor = WebhookIngestor(
+            application.bot,
+            application.update_queue,
+            SECRET_TOKEN,
+            max_pending=WEBHOOK_MAX_PENDING,
+            max_body_bytes=WEBHOOK_MAX_BODY,
+            dedup_window=WEBHOOK_DEDUP_WINDOW,
+        )
+        ingestor.start()
+        app = web.Application(client_max_size=WEBHOOK_MAX_BODY)
+        app['bot'] = application.bot
+        app['application'] = application
+        app['ingestor'] = ingestor
+        app.router.add_post("/webhook", ingestor.handle)
+        app.router.add_get("/health", health_check)
+        app.router.add_get("/metrics", metrics_endpoint)
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "0.0.0.0", PORT)
+        await site.start()
+
+    # Queue and backlog gauges read live values at scrape time
+    REGISTRY.gauge("update_queue_depth", "Updates accepted but not yet picked up by the application",
+                   lambda: application.update_queue.qsize() + ingestor.depth())
+    REGISTRY.gauge("updates_in_progress", "Updates currently being handled",
+                   lambda: application.update_processor.running_updates)
+    REGISTRY.gauge("outbound_queue_depth", "Bot API calls waiting in the outbound scheduler",
+                   lambda: {(str(p),): n for p, n in outbound.depth().items()}, ["priority"])
+    REGISTRY.gauge("photo_dir_bytes", "Photo files kept in PHOTO_DIR at the last janitor pass",
+                   lambda: janitor.photo_bytes)
+    REGISTRY.gauge("photo_spool_bytes", "Photo bytes held in memory for drafts", lambda: photo_spool.bytes_held)
+    REGISTRY.gauge("sheet_writer_pending_rows", "Rows waiting to be written to the sheet", sheet_writer.depth)
+    if drive_archiver is not None:
+        REGISTRY.gauge("drive_archive_pending_listings", "Posted listings whose photos aren't archived in Drive yet",
+                       drive_archiver.depth)
+    REGISTRY.gauge("sheet_replication_lag_seconds", "Age of the oldest listing not yet in the sheet",
+                   listing_store.replication_lag)
+    REGISTRY.gauge("sheet_outbox_depth", "Stored listings not yet written to the sheet", listing_store.outbox_depth)
+    REGISTRY.gauge("sheet_delivery_lag_seconds", "Time the last rows written to the sheet spent in the outbox",
+                   lambda: listing_store.last_delivery_lag)
+    REGISTRY.gauge("publish_unknown_posts", "Channel posts that may or may not have gone out; check them by hand",
+                   listing_store.unknown_publications)
+    if sheet_replica is not None:
+        REGISTRY.gauge("sheet_replica_rows", "Rows in the in-memory sheet replica", lambda: len(sheet_replica))
+        REGISTRY.gauge("sheet_replica_synced_timestamp_seconds", "When the sheet replica last synced",
+                       lambda: sheet_replica.synced_at or float("nan"))
+        REGISTRY.gauge("sheet_replica_age_seconds", "Seconds since the sheet replica last synced",
+                       lambda: sheet_replica.age() if sheet_replica.synced_at is not None else float("nan"))
 
     # Set the webhook manually
-    await application.bot.set_webhook(f"{WEBHOOK_URL}/webhook", drop_pending_updates=True)
-
-    # Setup aiohttp server
-    app = web.Application()
-    app['bot'] = application.bot
-    app['application'] = application
-    app.router.add_post("/webhook", handle_webhook)
-    app.router.add_get("/health", health_check)
-
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", PORT)
-    await site.start()
+    with startup_timer.phase("set_webhook"):
+        await retry_telegram_request(
+            application.bot.set_webhook,
+            f"{WEBHOOK_URL}/webhook",
+            drop_pending_updates=True,
+            secret_token=SECRET_TOKEN
+        )
 
     print(f"Webhook server running on port {PORT}")
+    startup_timer.report()
+
+    # Google clients are only needed by background work, so create them last
+    warm_up_task = asyncio.create_task(warm_up_google())
 
     # Run forever, until cancelled
     try:
@@ -710,8 +1316,23 @@ async def main():
     except asyncio.CancelledError:
         pass
     finally:
+        warm_up_task.cancel()
+        publish_retry_task.cancel()
+        if sheet_replica is not None:
+            await sheet_replica.stop()
+        await ingestor.stop()
+        await janitor.stop()
         await application.stop()
+        await outbound.stop()
+        await sheet_writer.stop()
+        if drive_archiver is not None:
+            await drive_archiver.stop()
+        await sheets_client.close()
+        if photo_stage is not None:
+            photo_stage.stop()
+        listing_store.close()
         await application.shutdown()
+        persistence.close()
         await runner.cleanup()
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+"""Minimal Prometheus-style metrics.
+
+Histograms keep a preallocated list of per-bucket counts for each label value;
+observing is a bisect plus two additions, with nothing allocated per call.
+Children for a label value are created once and can be held on to by hot
+paths. render() produces the Prometheus text exposition format.
+"""
+import math
+from bisect import bisect_left
+
+# Seconds; covers a fast local handler up to a slow Google call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _label_text(self, values, extra=None):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra is not None:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self._samples()
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def _samples(self):
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_text(values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_format(child.sum)}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {child.count}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def _samples(self):
+        return [f"{self.name}_total{self._label_text(values)} {_format(child.value)}"
+                for values, child in self._children.items()]
+
+
+class Gauge(_Metric):
+    """Gauge read from a callback at scrape time, so nothing is kept up to date in between"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, read, labelnames=()):
+        self.read = read
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def _samples(self):
+        value = self.read()
+        if not self.labelnames:
+            return [f"{self.name} {_format(value)}"]
+        # A labelled gauge's callback returns {label values tuple: value}
+        return [f"{self.name}{self._label_text(values)} {_format(v)}" for values, v in value.items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, read, labelnames=()):
+        return self._register(Gauge(name, documentation, read, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines += metric.render()
+            except Exception as e:
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Lower value runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_CHANNEL = 1
+
+# Telegram's documented limits: ~30 messages/s overall, ~1 message/s in a
+# private chat and 20 messages/minute in a group or channel
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "func", "args", "kwargs", "chat_key", "future", "not_before")
+
+    def __init__(self, priority, seq, func, args, kwargs, chat_key, future):
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_key = chat_key
+        self.future = future
+        self.not_before = 0.0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """Rate-limited, prioritised dispatcher for outgoing Bot API calls.
+
+    Every call takes a token from a global bucket and, when it targets a known
+    chat (a ``chat_id`` keyword, or the Message a bound method like
+    ``message.reply_text`` belongs to), from that chat's bucket. Jobs are
+    dispatched in priority order, so interactive replies overtake queued
+    channel posts, and a job whose chat is throttled does not hold up jobs for
+    other chats. A RetryAfter from Telegram pauses that chat's bucket for the
+    advised time, or only the job itself when it has no chat, and puts the job
+    back in the queue; Telegram's flood waits are per chat, so they never
+    stall the global bucket.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, private_rate=PRIVATE_CHAT_RATE,
+                 group_rate=GROUP_CHAT_RATE, max_in_flight=16):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_in_flight = max_in_flight
+        self._chat_buckets = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self._in_flight = set()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._task = asyncio.create_task(self._run(), name="outbound-scheduler")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for job in self._heap:
+            if not job.future.done():
+                job.future.cancel()
+        self._heap.clear()
+
+    def depth(self):
+        """Queued jobs per priority"""
+        counts = {PRIORITY_INTERACTIVE: 0, PRIORITY_CHANNEL: 0}
+        for job in self._heap:
+            counts[job.priority] = counts.get(job.priority, 0) + 1
+        return counts
+
+    def submit(self, func, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Queue a Bot API call and return a future for its result"""
+        future = asyncio.get_running_loop().create_future()
+        if self._task is None:
+            # Not started (e.g. in scripts): call straight through
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda t: _copy_result(t, future))
+            return future
+        job = _Job(priority, next(self._seq), func, args, kwargs, _chat_key(func, kwargs), future)
+        heapq.heappush(self._heap, job)
+        self._wakeup.set()
+        return future
+
+    async def run(self, func, *args, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Queue a Bot API call and wait for its result"""
+        return await self.submit(func, *args, priority=priority, **kwargs)
+
+    def _chat_bucket(self, chat_key):
+        bucket = self._chat_buckets.get(chat_key)
+        if bucket is None:
+            chat = str(chat_key)
+            if chat.startswith("-") or chat.startswith("@"):
+                bucket = TokenBucket(self.group_rate, 1)
+            else:
+                bucket = TokenBucket(self.private_rate, 1)
+            self._chat_buckets[chat_key] = bucket
+        return bucket
+
+    def _next_job(self, now):
+        """Pop the best job that may run now; otherwise return how long to wait"""
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        skipped = []
+        best_wait = None
+        job = None
+        while self._heap:
+            candidate = heapq.heappop(self._heap)
+            if candidate.future.done():
+                continue
+            if candidate.not_before > now:
+                wait = candidate.not_before - now
+                best_wait = wait if best_wait is None else min(best_wait, wait)
+                skipped.append(candidate)
+                continue
+            if candidate.chat_key is None:
+                job = candidate
+                break
+            wait = self._chat_bucket(candidate.chat_key).wait_time(now)
+            if wait == 0:
+                self._chat_bucket(candidate.chat_key).try_acquire(now)
+                job = candidate
+                break
+            best_wait = wait if best_wait is None else min(best_wait, wait)
+            skipped.append(candidate)
+        for candidate in skipped:
+            heapq.heappush(self._heap, candidate)
+        if job is not None:
+            self.global_bucket.try_acquire(now)
+        return job, best_wait
+
+    async def _run(self):
+        while True:
+            job, wait = self._next_job(time.monotonic())
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            task = asyncio.create_task(self._execute(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, job):
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            retry_after = _seconds(e.retry_after)
+            if job.chat_key is None:
+                method = getattr(job.func, "__name__", "call")
+                logger.warning(f"Telegram flood limit hit for {method}, retrying it in {retry_after:.0f}s")
+                job.not_before = time.monotonic() + retry_after
+            else:
+                logger.warning(f"Telegram flood limit hit for chat {job.chat_key}, pausing {retry_after:.0f}s")
+                self._chat_bucket(job.chat_key).block(retry_after)
+            heapq.heappush(self._heap, job)
+            self._wakeup.set()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+
+
+def _chat_key(func, kwargs):
+    """The chat a call sends to: its chat_id, or the chat of the Message it is a bound method of"""
+    chat_id = kwargs.get("chat_id")
+    if chat_id is None:
+        chat_id = getattr(getattr(func, "__self__", None), "chat_id", None)
+    return chat_id
+
+
+def _seconds(value):
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+def _copy_result(task, future):
+    if future.done():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
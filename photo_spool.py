@@ -0,0 +1,219 @@
+import asyncio
+import io
+import logging
+import os
+import time
+import uuid
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PHOTO_DOWNLOAD_SECONDS = REGISTRY.histogram("photo_download_seconds", "Time to download one photo")
+PHOTO_DOWNLOAD_BYTES = REGISTRY.counter("photo_download_bytes", "Bytes of photos downloaded")
+PHOTOS_REJECTED = REGISTRY.counter("photo_spool_rejected", "Photos not archived because a byte budget was full",
+                                   ["budget"])
+
+# Photos of drafts still in progress, and archived photos of posted listings
+DRAFT_PHOTO_PREFIX = "photo_"
+LISTING_PHOTO_PREFIX = "listing_"
+# Draft references to photos held in memory rather than in PHOTO_DIR
+MEMORY_REF_PREFIX = "memory:"
+
+
+class SpoolFull(Exception):
+    """A photo would take a user, or the whole spool, over its byte budget"""
+
+    def __init__(self, budget):
+        super().__init__(f"photo spool {budget} budget exhausted")
+        self.budget = budget
+
+
+def choose_size(sizes, min_side):
+    """Smallest PhotoSize whose longer side is at least min_side, else the largest"""
+    for size in sorted(sizes, key=lambda s: s.width * s.height):
+        if max(size.width, size.height) >= min_side:
+            return size
+    return max(sizes, key=lambda s: s.width * s.height)
+
+
+class PhotoSpool:
+    """Archive copies of draft photos, downloaded until the listing is posted.
+
+    ``add`` downloads the smallest size of a photo that meets ``min_side``
+    with ``download_to_memory`` and returns a reference for the draft. In
+    "memory" mode the bytes stay in this process and nothing touches disk
+    until ``archive`` writes a posted listing's photos to ``photo_dir``; in
+    "disk" mode they are written to ``photo_dir`` straight away (point it at a
+    tmpfs to spool in RAM that other processes can see). Either way every
+    file operation runs in a worker thread, never on the event loop.
+
+    Bytes held in memory are capped per user and in total. Space for a photo
+    is reserved from its advertised size before the download starts, so
+    concurrent downloads can't overshoot; a photo that doesn't fit raises
+    SpoolFull and is simply not archived. An ImageStage, if given, resizes
+    photos as they are archived.
+    """
+
+    def __init__(self, photo_dir, mode="disk", min_side=1280,
+                 user_budget=10 * 1024 * 1024, total_budget=64 * 1024 * 1024, image_stage=None):
+        if mode not in ("memory", "disk"):
+            raise ValueError(f"Unknown photo spool mode {mode!r}")
+        self.photo_dir = photo_dir
+        self.mode = mode
+        self.min_side = min_side
+        self.user_budget = user_budget
+        self.total_budget = total_budget
+        self.image_stage = image_stage
+        self._photos = {}  # ref -> (user id, bytes)
+        self._user_bytes = {}
+        self.bytes_held = 0
+
+    def _reserve(self, user_id, size):
+        if self._user_bytes.get(user_id, 0) + size > self.user_budget:
+            raise SpoolFull("user")
+        if self.bytes_held + size > self.total_budget:
+            raise SpoolFull("total")
+        self._user_bytes[user_id] = self._user_bytes.get(user_id, 0) + size
+        self.bytes_held += size
+
+    def _release(self, user_id, size):
+        remaining = self._user_bytes.get(user_id, 0) - size
+        if remaining > 0:
+            self._user_bytes[user_id] = remaining
+        else:
+            self._user_bytes.pop(user_id, None)
+        self.bytes_held -= size
+
+    async def add(self, user_id, sizes, get_file):
+        """Download a photo (its list of PhotoSizes) and return the draft's reference to it.
+
+        ``get_file`` is awaited with the chosen PhotoSize and returns its File.
+        """
+        size = choose_size(sizes, self.min_side)
+        # Telegram reports the size of nearly every photo; assume the worst otherwise
+        reserved = size.file_size or self.user_budget
+        try:
+            self._reserve(user_id, reserved)
+        except SpoolFull as e:
+            PHOTOS_REJECTED.labels(e.budget).inc()
+            raise
+        try:
+            photo_file = await get_file(size)
+            buffer = io.BytesIO()
+            started = time.perf_counter()
+            await photo_file.download_to_memory(buffer)
+            PHOTO_DOWNLOAD_SECONDS.observe(time.perf_counter() - started)
+            data = buffer.getvalue()
+            PHOTO_DOWNLOAD_BYTES.inc(len(data))
+        except BaseException:
+            self._release(user_id, reserved)
+            raise
+
+        # Settle the reservation on the real size
+        self._release(user_id, reserved)
+        if self.mode == "disk":
+            path = os.path.join(self.photo_dir, f"{DRAFT_PHOTO_PREFIX}{uuid.uuid4().hex}.jpg")
+            await asyncio.to_thread(_write_file, path, data)
+            return path
+        try:
+            self._reserve(user_id, len(data))
+        except SpoolFull as e:
+            PHOTOS_REJECTED.labels(e.budget).inc()
+            raise
+        ref = f"{MEMORY_REF_PREFIX}{uuid.uuid4().hex}"
+        self._photos[ref] = (user_id, data)
+        return ref
+
+    def _pop(self, ref):
+        user_id, data = self._photos.pop(ref)
+        self._release(user_id, len(data))
+        return data
+
+    async def discard(self, refs):
+        """Forget photos of a draft that won't be posted"""
+        paths = []
+        for ref in refs:
+            if ref.startswith(MEMORY_REF_PREFIX):
+                if ref in self._photos:
+                    self._pop(ref)
+            else:
+                paths.append(ref)
+        if paths:
+            await asyncio.to_thread(_remove_files, paths)
+
+    async def archive(self, refs, property_id):
+        """Keep a posted listing's photos in photo_dir as listing_<id>_<n>.jpg
+
+        With an image stage each photo is stored resized, next to a
+        listing_<id>_<n>_thumb thumbnail, in the stage's format.
+        """
+        moves = []
+        writes = []
+        sources = []
+        for i, ref in enumerate(refs, start=1):
+            base = os.path.join(self.photo_dir, f"{LISTING_PHOTO_PREFIX}{property_id}_{i}")
+            if not ref.startswith(MEMORY_REF_PREFIX):
+                if self.image_stage is None:
+                    moves.append((ref, base + ".jpg"))
+                    continue
+                try:
+                    data = await asyncio.to_thread(_read_file, ref)
+                except OSError as e:
+                    logger.warning(f"Could not archive photo {ref}: {e}")
+                    continue
+                sources.append(ref)
+            elif ref in self._photos:
+                data = self._pop(ref)
+            else:
+                # Held by a process that has since restarted
+                logger.warning(f"Photo {i} of listing {property_id} was lost before it was archived")
+                continue
+            writes.extend(await self._converted(base, data))
+        if moves or writes:
+            await asyncio.to_thread(_store_files, moves, writes)
+        if sources:
+            await asyncio.to_thread(_remove_files, sources)
+
+    async def _converted(self, base, data):
+        """(path, bytes) to write for one photo"""
+        if self.image_stage is not None:
+            try:
+                web, thumb = await self.image_stage.process(data)
+            except Exception as e:
+                logger.warning(f"Could not resize photo for {base}, keeping it as downloaded: {e}")
+            else:
+                extension = self.image_stage.extension
+                return [(base + extension, web), (f"{base}_thumb{extension}", thumb)]
+        return [(base + ".jpg", data)]
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _store_files(moves, writes):
+    for source, target in moves:
+        try:
+            os.replace(source, target)
+        except OSError as e:
+            logger.warning(f"Could not archive photo {source}: {e}")
+    for target, data in writes:
+        try:
+            _write_file(target, data)
+        except OSError as e:
+            logger.warning(f"Could not archive photo {target}: {e}")
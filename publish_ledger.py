@@ -0,0 +1,160 @@
+import logging
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_CONFIRMS = REGISTRY.counter("publish_duplicate_confirms", "Confirms of listings that were already published")
+PUBLISH_FAILURES = REGISTRY.counter("publish_failures", "Channel posts that failed and will be retried")
+
+
+class Publication:
+    """Where a confirmed listing is on its way to the channel and the sheet"""
+
+    __slots__ = ("property_id", "channel_id", "photos", "caption", "outbox_id", "message_ids",
+                 "published_at", "sheet_written_at")
+
+    def __init__(self, property_id, channel_id, photos, caption, outbox_id, message_ids=None,
+                 published_at=None, sheet_written_at=None):
+        self.property_id = property_id
+        self.channel_id = channel_id
+        self.photos = photos
+        self.caption = caption
+        self.outbox_id = outbox_id
+        self.message_ids = message_ids
+        self.published_at = published_at
+        self.sheet_written_at = sheet_written_at
+
+    @property
+    def published(self):
+        return self.published_at is not None
+
+    @property
+    def done(self):
+        return self.published_at is not None and self.sheet_written_at is not None
+
+
+class PublishLedger:
+    """Exactly-once publishing of confirmed listings, keyed by Property ID.
+
+    ``claim`` stores the listing, queues its sheet row and records the channel
+    post as due in one SQLite transaction, and refuses a Property ID that was
+    claimed before, so a double tap on confirm or a redelivered update can't
+    post or write the row twice. The post itself is recorded (with its
+    message IDs) by ``mark_published``, or by ``mark_unknown`` when it
+    failed in a way that leaves open whether Telegram posted it (it is not
+    tried again then), and the sheet row by ``mark_written``
+    (the sheet writer's callback). Posts that never went out, e.g. because
+    the process died after the claim, are returned by ``unpublished`` for
+    resuming at startup. A crash between Telegram accepting a post and
+    ``mark_published`` still posts it twice; Telegram has no idempotency key
+    to close that window.
+
+    A post that failed without reaching Telegram (open circuit, rejected,
+    retries spent) is marked with ``mark_failed`` and offered again by
+    ``due`` after a backoff that doubles from ``retry_delay`` up to
+    ``max_retry_delay``. ``begin`` makes sure only one attempt per listing
+    runs at a time.
+
+    Entries still in progress are cached in memory, so checks are a dict
+    lookup; once a listing is both posted and written to the sheet it is
+    dropped from the cache and later checks read its row by primary key.
+    The ledger is only used from the event loop.
+    """
+
+    def __init__(self, store, retry_delay=30.0, max_retry_delay=3600.0):
+        self.store = store
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._entries = {}
+        self._by_outbox = {}
+        self._in_flight = set()
+        self._retries = {}
+
+    def _cache(self, found):
+        entry = Publication(*found)
+        if not entry.done:
+            self._entries[entry.property_id] = entry
+        if entry.sheet_written_at is None:
+            self._by_outbox[entry.outbox_id] = entry
+        return entry
+
+    def _settle(self, entry):
+        if entry.done:
+            self._entries.pop(entry.property_id, None)
+
+    def get(self, property_id):
+        """The listing's Publication, or None if it was never confirmed"""
+        entry = self._entries.get(property_id)
+        if entry is None:
+            found = self.store.get_publication(property_id)
+            if found is not None:
+                entry = self._cache(found)
+        return entry
+
+    def claim(self, property_id, row, channel_id, photos, caption):
+        """Record a confirmed listing; returns its Publication, or None if it was already claimed"""
+        if self.get(property_id) is not None:
+            DUPLICATE_CONFIRMS.inc()
+            return None
+        outbox_id = self.store.claim_publication(property_id, row, channel_id, photos, caption)
+        if outbox_id is None:
+            DUPLICATE_CONFIRMS.inc()
+            self.get(property_id)
+            return None
+        return self._cache((property_id, str(channel_id), list(photos), caption, outbox_id))
+
+    def begin(self, property_id):
+        """Start an attempt at the listing's channel post; False if it is posted or already being tried"""
+        entry = self.get(property_id)
+        if entry is None or entry.published or property_id in self._in_flight:
+            return False
+        self._in_flight.add(property_id)
+        return True
+
+    def end(self, property_id):
+        self._in_flight.discard(property_id)
+
+    def mark_failed(self, property_id):
+        """The attempt didn't post the listing; offer it again after a backoff"""
+        attempts = self._retries.get(property_id, (0, 0.0))[0] + 1
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+        self._retries[property_id] = (attempts, time.monotonic() + delay)
+        PUBLISH_FAILURES.inc()
+        logger.info(f"Retrying the channel post of listing {property_id} in {delay:.0f}s")
+
+    def due(self):
+        """Unposted listings that aren't being tried and whose backoff has passed, oldest first"""
+        now = time.monotonic()
+        return [
+            entry for entry in self.unpublished()
+            if entry.property_id not in self._in_flight
+            and self._retries.get(entry.property_id, (0, 0.0))[1] <= now
+        ]
+
+    def mark_unknown(self, property_id):
+        """Stop trying to post a listing whose last attempt may or may not have gone out"""
+        self.mark_published(property_id, None)
+
+    def mark_published(self, property_id, message_ids):
+        published_at = self.store.mark_published(property_id, message_ids)
+        self._retries.pop(property_id, None)
+        entry = self._entries.get(property_id)
+        if entry is not None:
+            entry.message_ids = message_ids
+            entry.published_at = published_at
+            self._settle(entry)
+
+    def mark_written(self, outbox_ids):
+        """Sheet writer callback: the rows with these outbox ids are in the sheet"""
+        written_at = self.store.mark_delivered(outbox_ids)
+        for outbox_id in outbox_ids:
+            entry = self._by_outbox.pop(outbox_id, None)
+            if entry is not None:
+                entry.sheet_written_at = written_at
+                self._settle(entry)
+
+    def unpublished(self):
+        """Claimed listings whose channel post hasn't been recorded, oldest first"""
+        return [self._entries.get(found[0]) or self._cache(found) for found in self.store.unpublished()]
@@ -0,0 +1,51 @@
+import time
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second.
+
+    ``block(seconds)`` empties the bucket until the given time has passed,
+    which is how server-advised waits (Telegram RetryAfter, HTTP 429) are
+    honoured.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now=None, tokens=1):
+        """Seconds until ``tokens`` can be taken (0 when available now)"""
+        now = time.monotonic() if now is None else now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def try_acquire(self, now=None, tokens=1):
+        now = time.monotonic() if now is None else now
+        if self.wait_time(now, tokens) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+
+    def block(self, seconds, now=None):
+        now = time.monotonic() if now is None else now
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.updated = self.blocked_until
+
+    def available(self, now=None):
+        now = time.monotonic() if now is None else now
+        if now < self.blocked_until:
+            return 0.0
+        self._refill(now)
+        return self.tokens
@@ -0,0 +1,144 @@
+import asyncio
+import contextvars
+import logging
+import random
+import time
+
+from telegram.error import BadRequest, Forbidden, InvalidToken, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Monotonic deadline for the update currently being handled (None = no budget)
+_deadline = contextvars.ContextVar("update_deadline", default=None)
+
+
+def start_budget(seconds):
+    """Give the current update (task) a total time budget for Bot API calls"""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def clear_budget():
+    _deadline.set(None)
+
+
+def remaining_budget():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the Bot API while the circuit breaker is open"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of calling the Bot API once the update's budget is spent"""
+
+
+class RetryPolicy:
+    """How one kind of Bot API call is retried.
+
+    Delays grow exponentially with full jitter. A non-idempotent call (a send
+    that may have reached Telegram before the error) is only retried when
+    Telegram explicitly rejected it (RetryAfter), unless the caller supplies
+    its own de-duplication.
+    """
+
+    def __init__(self, name, max_attempts=3, base_delay=0.5, max_delay=8.0, idempotent=False):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.idempotent = idempotent
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Opens after consecutive transient failures and sheds calls until a probe succeeds"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            # Let a single probe through
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Bot API circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Bot API circuit opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def abandon_probe(self):
+        """The probe ended without telling us anything; let the next call probe"""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic() - self.reset_timeout
+
+
+def _seconds(value):
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+async def call_with_policy(policy, breaker, func, *args, dedupe=False, **kwargs):
+    """Call ``func`` under ``policy``, the circuit ``breaker`` and the update budget.
+
+    Pass ``dedupe=True`` when a duplicate delivery is handled elsewhere, which
+    makes a non-idempotent call safe to retry after a timeout.
+    """
+    retry_unsure = policy.idempotent or dedupe
+    for attempt in range(policy.max_attempts):
+        budget = remaining_budget()
+        if budget is not None and budget <= 0:
+            raise DeadlineExceeded(f"Update time budget spent, not calling {policy.name}")
+        if not breaker.allow():
+            raise CircuitOpenError(f"Bot API circuit open, not calling {policy.name}")
+        try:
+            result = await func(*args, **kwargs)
+        except RetryAfter as e:
+            # Rejected before processing: always safe to retry
+            breaker.abandon_probe()
+            wait = _seconds(e.retry_after)
+            error = e
+        except (BadRequest, Forbidden, InvalidToken):
+            # Telegram answered; not a transport problem
+            breaker.record_success()
+            raise
+        except (TimedOut, NetworkError) as e:
+            breaker.record_failure()
+            if not retry_unsure:
+                raise
+            wait = policy.backoff(attempt)
+            error = e
+        except BaseException:
+            breaker.abandon_probe()
+            raise
+        else:
+            breaker.record_success()
+            return result
+
+        budget = remaining_budget()
+        if attempt == policy.max_attempts - 1 or (budget is not None and wait > budget):
+            raise error
+        logger.warning(f"{policy.name} failed ({error}), retry {attempt + 1} in {wait:.1f}s")
+        await asyncio.sleep(wait)
@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from metrics import REGISTRY
+from sheets_client import column_letter
+from sheets_quota import READ
+
+logger = logging.getLogger(__name__)
+
+REPLICA_CHANGES = REGISTRY.counter("sheet_replica_changes", "Rows the sheet replica picked up", ["kind"])
+
+ID_COLUMN = 0
+
+
+def _block_hash(rows):
+    return hashlib.blake2b(json.dumps(rows, ensure_ascii=False).encode(), digest_size=16).digest()
+
+
+class SheetReplica:
+    """Read-only in-memory copy of the listings sheet, kept in sync by polling.
+
+    ``start`` loads every data row with one ranged batch read. After that,
+    each poll is again a single batchGet with two ranges: the rows past the
+    last known row count (new listings), and one block of ``block_rows``
+    already known rows, compared by checksum to catch manual edits in the
+    sheet. The checked block moves on every poll, so the whole sheet is
+    verified every (rows / block_rows) polls. If rows were deleted the next
+    poll reloads everything.
+
+    The Sheets calls go through the shared ``governor`` as reads; the copy
+    is only changed on the event loop, so reads (``get``, ``rows``) are
+    plain lookups.
+    ``synced_at`` is the time of the last successful sync.
+    """
+
+    def __init__(self, sheets, governor, columns, poll_interval=60.0, block_rows=200):
+        self.sheets = sheets
+        self.governor = governor
+        self.last_column = column_letter(columns)
+        self.columns = columns
+        self.poll_interval = poll_interval
+        self.block_rows = block_rows
+        self._rows = []
+        self._by_id = {}
+        self._block_hashes = []
+        self._next_block = 0
+        self.loaded = False
+        self.synced_at = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="sheet-replica")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def get(self, property_id):
+        """The sheet row of a listing, or None"""
+        index = self._by_id.get(property_id)
+        return self._rows[index] if index is not None else None
+
+    def rows(self):
+        """Every data row, in sheet order"""
+        return list(self._rows)
+
+    def age(self):
+        """Seconds since the last successful sync (None before the first)"""
+        return time.time() - self.synced_at if self.synced_at is not None else None
+
+    async def _run(self):
+        while True:
+            try:
+                if self.loaded:
+                    await self.poll()
+                else:
+                    await self.load()
+            except Exception as e:
+                logger.error(f"Sheet replica sync failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def _range(self, first_row, last_row=""):
+        # Sheet row 1 is the header; data row i is sheet row i + 2
+        return f"A{first_row + 2}:{self.last_column}{last_row + 2 if last_row != '' else ''}"
+
+    async def _read(self, ranges):
+        results = await self.governor.call(READ, "batch_get", self.sheets.batch_get, ranges)
+        return [[self._padded(row) for row in rows] for rows in results]
+
+    def _padded(self, row):
+        # The API leaves out trailing empty cells
+        return row + [""] * (self.columns - len(row)) if len(row) < self.columns else row
+
+    async def load(self):
+        """Replace the copy with a full read of the sheet"""
+        (rows,) = await self._read([self._range(0)])
+        self._rows = rows
+        self._by_id = {row[ID_COLUMN]: i for i, row in enumerate(rows)}
+        self._block_hashes = [
+            _block_hash(rows[start:start + self.block_rows]) for start in range(0, len(rows), self.block_rows)
+        ]
+        self._next_block = 0
+        self.loaded = True
+        self.synced_at = time.time()
+        logger.info(f"Sheet replica loaded {len(rows)} rows")
+
+    async def poll(self):
+        """Fetch new rows and verify one block of known rows"""
+        known = len(self._rows)
+        block = self._next_block if self._block_hashes else None
+        ranges = [self._range(known)]
+        if block is not None:
+            first = block * self.block_rows
+            ranges.append(self._range(first, min(first + self.block_rows, known) - 1))
+        results = await self._read(ranges)
+
+        if block is not None:
+            first = block * self.block_rows
+            expected = min(self.block_rows, known - first)
+            checked = results[1]
+            if len(checked) < expected:
+                logger.warning("Rows were deleted from the sheet; reloading the replica")
+                self.loaded = False
+                return
+            if _block_hash(checked) != self._block_hashes[block]:
+                self._replace_block(first, checked)
+            self._next_block = (block + 1) % len(self._block_hashes)
+
+        new_rows = results[0]
+        if new_rows:
+            self._append(new_rows)
+            REPLICA_CHANGES.labels("new").inc(len(new_rows))
+        self.synced_at = time.time()
+
+    def _replace_block(self, first, rows):
+        edited = 0
+        for offset, row in enumerate(rows):
+            index = first + offset
+            old = self._rows[index]
+            if row == old:
+                continue
+            edited += 1
+            if self._by_id.get(old[ID_COLUMN]) == index:
+                del self._by_id[old[ID_COLUMN]]
+            self._rows[index] = row
+            self._by_id[row[ID_COLUMN]] = index
+        self._block_hashes[first // self.block_rows] = _block_hash(rows)
+        REPLICA_CHANGES.labels("edited").inc(edited)
+        logger.info(f"Sheet replica picked up {edited} edited rows")
+
+    def _append(self, rows):
+        for row in rows:
+            self._by_id[row[ID_COLUMN]] = len(self._rows)
+            self._rows.append(row)
+        # Re-hash the last, possibly partial, block and any new ones
+        start = (len(self._block_hashes) - 1) * self.block_rows if self._block_hashes else 0
+        del self._block_hashes[start // self.block_rows:]
+        for block_start in range(start, len(self._rows), self.block_rows):
+            self._block_hashes.append(_block_hash(self._rows[block_start:block_start + self.block_rows]))
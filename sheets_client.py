@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import quote
+
+import aiohttp
+from google.auth import crypt, jwt
+
+from sheets_quota import SHEET_CALL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ("https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive")
+SHEETS_ROOT = "https://sheets.googleapis.com"
+DRIVE_ROOT = "https://www.googleapis.com"
+SPREADSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+# Tokens live an hour; get a new one this long before the old one expires
+TOKEN_REFRESH_MARGIN = 300
+
+
+class SheetsAPIError(Exception):
+    """An error answer from the Sheets or Drive API"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def column_letter(column):
+    """1 -> A, 27 -> AA"""
+    letters = ""
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def a1(row, column):
+    return f"{column_letter(column)}{row}"
+
+
+class AsyncSheetsClient:
+    """Google Sheets v4 over one pooled aiohttp session, for the first sheet of a spreadsheet.
+
+    Every call reuses the session's keep-alive connections, so only the first
+    one pays for DNS and the TLS handshake. The service account's access token
+    is minted by posting a signed JWT to its token_uri, cached, and renewed
+    TOKEN_REFRESH_MARGIN seconds before it expires; concurrent callers share
+    one refresh. Signing runs in a worker thread (google-auth signs with pure
+    Python RSA here).
+
+    ``open`` finds the spreadsheet by name through Drive (unless its ID is
+    given), looks up the first sheet's title and writes the header row if it
+    is missing or shorter than ``headers``. Ranges passed to the value calls
+    are relative to that sheet. ``warm_up`` opens it ahead of the first real
+    call. ``api_url`` replaces both googleapis.com hosts, as in GoogleClients.
+    """
+
+    def __init__(self, credentials_file, sheet_name, headers, api_url=None, spreadsheet_id=None,
+                 max_connections=10, timeout=30.0):
+        self.credentials_file = credentials_file
+        self.sheet_name = sheet_name
+        self.headers = headers
+        self.sheets_root = (api_url or SHEETS_ROOT).rstrip("/")
+        self.drive_root = (api_url or DRIVE_ROOT).rstrip("/")
+        self.spreadsheet_id = spreadsheet_id
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.title = None
+        self._session = None
+        self._signer = None
+        self._service_account = None
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = None
+        self._open_lock = None
+
+    def _ensure_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._token_lock = asyncio.Lock()
+            self._open_lock = asyncio.Lock()
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _assertion(self):
+        if self._signer is None:
+            with open(self.credentials_file) as f:
+                self._service_account = json.load(f)
+            self._signer = crypt.RSASigner.from_service_account_info(self._service_account)
+        now = int(time.time())
+        payload = {
+            "iss": self._service_account["client_email"],
+            "scope": " ".join(SCOPES),
+            "aud": self._service_account["token_uri"],
+            "iat": now,
+            "exp": now + 3600,
+        }
+        return jwt.encode(self._signer, payload).decode()
+
+    async def _access_token(self):
+        if self._token is not None and time.time() < self._token_expires - TOKEN_REFRESH_MARGIN:
+            return self._token
+        async with self._token_lock:
+            # Someone else may have refreshed it while we waited
+            if self._token is not None and time.time() < self._token_expires - TOKEN_REFRESH_MARGIN:
+                return self._token
+            assertion = await asyncio.to_thread(self._assertion)
+            async with self._session.post(self._service_account["token_uri"], data={
+                "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
+                "assertion": assertion,
+            }) as resp:
+                body = await resp.json(content_type=None)
+                if resp.status != 200:
+                    raise SheetsAPIError(resp.status, body.get("error_description") or body.get("error"))
+            self._token = body["access_token"]
+            self._token_expires = time.time() + float(body.get("expires_in", 3600))
+            return self._token
+
+    async def _request(self, method, url, params=None, body=None):
+        session = self._ensure_session()
+        for attempt in range(2):
+            token = await self._access_token()
+            async with session.request(method, url, params=params, json=body,
+                                       headers={"Authorization": f"Bearer {token}"}) as resp:
+                if resp.status == 401 and attempt == 0:
+                    # Revoked or expired early; mint a new token once
+                    self._token = None
+                    continue
+                payload = await resp.json(content_type=None) if resp.content_length != 0 else {}
+                if resp.status >= 400:
+                    error = payload.get("error", {}) if isinstance(payload, dict) else {}
+                    retry_after = resp.headers.get("Retry-After")
+                    raise SheetsAPIError(
+                        resp.status,
+                        error.get("message", resp.reason) if isinstance(error, dict) else error,
+                        float(retry_after) if retry_after and retry_after.isdigit() else None,
+                    )
+                return payload
+
+    def _values_url(self, suffix):
+        return f"{self.sheets_root}/v4/spreadsheets/{self.spreadsheet_id}/values{suffix}"
+
+    def _qualified(self, range_name):
+        return "'{}'!{}".format(self.title.replace("'", "''"), range_name)
+
+    async def open(self):
+        """Resolve the spreadsheet and sheet and make sure the header row is there"""
+        self._ensure_session()
+        if self.title is not None:
+            return
+        async with self._open_lock:
+            if self.title is not None:
+                return
+            started = time.perf_counter()
+            if self.spreadsheet_id is None:
+                query = f"name = '{self.sheet_name}' and mimeType = '{SPREADSHEET_MIME_TYPE}' and trashed = false"
+                found = await self._request("GET", f"{self.drive_root}/drive/v3/files", params={
+                    "q": query, "fields": "files(id,name)",
+                    "supportsAllDrives": "true", "includeItemsFromAllDrives": "true",
+                })
+                if not found.get("files"):
+                    raise SheetsAPIError(404, f"Spreadsheet {self.sheet_name!r} not found")
+                self.spreadsheet_id = found["files"][0]["id"]
+            meta = await self._request("GET", f"{self.sheets_root}/v4/spreadsheets/{self.spreadsheet_id}",
+                                       params={"fields": "sheets.properties"})
+            title = meta["sheets"][0]["properties"]["title"]
+            await self._ensure_headers(title)
+            self.title = title
+            SHEET_CALL_SECONDS.labels("open").observe(time.perf_counter() - started)
+            logger.info("Google Sheets initialized successfully")
+
+    async def _ensure_headers(self, title):
+        quoted = "'{}'!".format(title.replace("'", "''"))
+        found = await self._request("GET", self._values_url(":batchGet"), params={"ranges": quoted + "A1:1"})
+        existing = (found.get("valueRanges", [{}])[0].get("values") or [[]])[0]
+        if existing == self.headers[:len(existing)] and len(existing) < len(self.headers):
+            # Empty sheet, or one created before columns were added at the end
+            await self._request("POST", self._values_url(":batchUpdate"), body={
+                "valueInputOption": "RAW",
+                "data": [{"range": quoted + "A1", "values": [self.headers]}],
+            })
+
+    async def warm_up(self, timer=None):
+        """Mint a token and open the sheet now rather than on the first real call"""
+        try:
+            if timer is not None:
+                with timer.phase("google_sheets"):
+                    await self.open()
+            else:
+                await self.open()
+        except Exception as e:
+            logger.error(f"Error warming up google_sheets: {e}")
+
+    async def append(self, rows, value_input_option="RAW"):
+        """values.append of rows after the last row of the sheet"""
+        await self.open()
+        return await self._request(
+            "POST", self._values_url("/" + quote(self._qualified("A1"), safe="") + ":append"),
+            params={"valueInputOption": value_input_option, "insertDataOption": "INSERT_ROWS"},
+            body={"values": rows},
+        )
+
+    async def batch_get(self, ranges, major_dimension="ROWS"):
+        """values.batchGet; one list of rows (or columns) per range"""
+        await self.open()
+        found = await self._request("GET", self._values_url(":batchGet"), params=[
+            ("majorDimension", major_dimension), *(("ranges", self._qualified(r)) for r in ranges),
+        ])
+        return [value_range.get("values", []) for value_range in found.get("valueRanges", [])]
+
+    async def batch_update(self, data, value_input_option="RAW"):
+        """values.batchUpdate of [{"range": ..., "values": [[...]]}, ...]"""
+        await self.open()
+        return await self._request("POST", self._values_url(":batchUpdate"), body={
+            "valueInputOption": value_input_option,
+            "data": [{"range": self._qualified(item["range"]), "values": item["values"]} for item in data],
+        })
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import random
+import time
+
+from metrics import REGISTRY
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+SHEET_CALL_SECONDS = REGISTRY.histogram("sheets_call_seconds", "Latency of Google Sheets calls", ["call"])
+SHEET_CALL_ERRORS = REGISTRY.counter("sheets_call_errors", "Failed Google Sheets calls", ["call"])
+QUOTA_WAIT_SECONDS = REGISTRY.histogram("sheets_quota_wait_seconds", "Time Sheets calls waited for quota", ["kind"])
+QUOTA_THROTTLED = REGISTRY.counter("sheets_quota_throttled", "Sheets calls answered 429 by Google", ["kind"])
+
+READ, WRITE = "read", "write"
+
+
+def retry_after(error):
+    """Seconds Google asked us to wait in a 429 answer (SheetsAPIError), or None"""
+    return getattr(error, "retry_after", None)
+
+
+def is_throttled(error):
+    return getattr(error, "status", None) == 429
+
+
+class QuotaGovernor:
+    """The Sheets API's per-minute quotas, shared by every Sheets call in the process.
+
+    Google counts reads and writes separately, so there is one token bucket
+    for each, refilled at ``reads_per_minute`` / ``writes_per_minute`` and
+    holding at most a minute's worth. ``call`` waits for a token, awaits the
+    AsyncSheetsClient call and records its latency. A 429 empties that
+    bucket for the advised Retry-After, or for an exponentially growing
+    backoff when Google gives none, so every caller pauses instead of making
+    it worse; the error is re-raised for the caller's own retry.
+
+    Callers that batch (the sheet writer) ask ``batch_size`` how much to put
+    in one call: the base size while the bucket is full, growing towards the
+    maximum as it drains, so the same rows cost fewer calls under pressure.
+    """
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, base_backoff=5.0, max_backoff=120.0):
+        self.buckets = {
+            READ: TokenBucket(reads_per_minute / 60, reads_per_minute),
+            WRITE: TokenBucket(writes_per_minute / 60, writes_per_minute),
+        }
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._throttled = {READ: 0, WRITE: 0}
+
+    async def wait(self, kind):
+        """Wait until a call of this kind could go out, without using a token"""
+        bucket = self.buckets[kind]
+        started = time.monotonic()
+        while (delay := bucket.wait_time()) > 0:
+            await asyncio.sleep(delay)
+        return time.monotonic() - started
+
+    async def acquire(self, kind):
+        bucket = self.buckets[kind]
+        waited = 0.0
+        while True:
+            waited += await self.wait(kind)
+            if bucket.try_acquire():
+                break
+        QUOTA_WAIT_SECONDS.labels(kind).observe(waited)
+
+    def headroom(self, kind):
+        """Fraction of the bucket left, 0 (empty or blocked) to 1 (full)"""
+        bucket = self.buckets[kind]
+        return bucket.available() / bucket.capacity
+
+    def batch_size(self, kind, base, maximum):
+        return max(base, min(maximum, round(base + (maximum - base) * (1 - self.headroom(kind)))))
+
+    def _backoff(self, kind, error):
+        self._throttled[kind] += 1
+        delay = retry_after(error)
+        if delay is None:
+            ceiling = min(self.max_backoff, self.base_backoff * 2 ** (self._throttled[kind] - 1))
+            delay = random.uniform(ceiling / 2, ceiling)
+        self.buckets[kind].block(delay)
+        QUOTA_THROTTLED.labels(kind).inc()
+        logger.warning(f"Sheets {kind} quota exceeded, pausing {kind}s for {delay:.0f}s")
+
+    async def call(self, kind, name, func, *args, **kwargs):
+        """Await a Sheets call of the given kind (READ or WRITE) within the quota"""
+        await self.acquire(kind)
+        started = time.perf_counter()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            SHEET_CALL_ERRORS.labels(name).inc()
+            if is_throttled(e):
+                self._backoff(kind, e)
+            raise
+        finally:
+            SHEET_CALL_SECONDS.labels(name).observe(time.perf_counter() - started)
+        self._throttled[kind] = 0
+        return result
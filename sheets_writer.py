@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+
+from metrics import REGISTRY
+from sheets_quota import READ, WRITE, QuotaGovernor
+
+logger = logging.getLogger(__name__)
+
+SHEET_ROWS_WRITTEN = REGISTRY.counter("sheet_rows_written", "Rows appended to the listings sheet")
+SHEET_ROWS_ALREADY_WRITTEN = REGISTRY.counter("sheet_rows_already_written",
+                                              "Rows found in the sheet before a retry, so not appended again")
+
+
+def _maybe_applied(error):
+    """Whether a failed append may still have reached the sheet (timeouts, 5xx)"""
+    status = getattr(error, "status", None)
+    return status is None or status >= 500
+
+
+class SheetWriteQueue:
+    """Write-behind queue that batches rows into a single values.append call.
+
+    Rows are coalesced until either ``batch_size`` rows are pending or
+    ``flush_interval_ms`` has passed since the first pending row. Writes go
+    through the shared QuotaGovernor: the writer waits for write quota
+    before it cuts a batch, and the batch widens towards ``max_batch_size``
+    as the quota runs low (rows keep queuing locally in the meantime). A
+    failed batch is kept at the front of the buffer and retried with
+    backoff, so no row is ever dropped.
+    A request that failed without a clear answer (a timeout, a 5xx) may have
+    been applied anyway, so before the next attempt the writer reads the
+    sheet's ID column and drops the rows that are already there (the first
+    cell of each row is its ID). The same check runs before writing rows
+    enqueued with ``maybe_written``, e.g. outbox entries replayed after a
+    crash, so each row lands in the sheet once.
+    Each row may carry a key (e.g. an outbox id); ``on_written`` is called with
+    the keys of every batch once it is safely in the sheet.
+    """
+
+    def __init__(self, sheets, batch_size=20, flush_interval_ms=500,
+                 retry_delay=2.0, max_retry_delay=60.0, on_written=None, governor=None, max_batch_size=500):
+        self.sheets = sheets
+        self._on_written = on_written
+        self.governor = governor if governor is not None else QuotaGovernor()
+        self.batch_size = batch_size
+        self.max_batch_size = max(batch_size, max_batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue = None
+        self._pending = []
+        self._unsure = False
+        self._task = None
+
+    def start(self):
+        """Start the background writer task on the running loop."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run(), name="sheet-writer")
+
+    def enqueue(self, row, key=None, maybe_written=False):
+        """Queue a row for the sheet and return immediately."""
+        if maybe_written:
+            self._unsure = True
+        self._queue.put_nowait((key, row))
+
+    def depth(self):
+        """Number of rows not yet written to the sheet."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._pending)
+
+    async def stop(self):
+        """Stop the writer after making a last attempt to flush pending rows."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._drain_queue()
+        if self._pending:
+            try:
+                await self._write(self._pending)
+                self._written(self._pending)
+                self._pending = []
+            except Exception as e:
+                logger.error(f"Could not flush {len(self._pending)} sheet rows on shutdown: {e}")
+
+    def _drain_queue(self):
+        while not self._queue.empty():
+            self._pending.append(self._queue.get_nowait())
+
+    async def _collect(self):
+        """Wait for the next batch of rows, honouring the size and time limits."""
+        if not self._pending:
+            self._pending.append(await self._queue.get())
+        deadline = time.monotonic() + self.flush_interval
+        while len(self._pending) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self._pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self._drain_queue()
+
+    async def _write(self, items):
+        rows = [row for _, row in items]
+        # RAW: listing text is stored as typed, never parsed as a formula, number or date
+        await self.governor.call(WRITE, "append", self.sheets.append, rows, "RAW")
+        SHEET_ROWS_WRITTEN.inc(len(rows))
+
+    async def _drop_written(self):
+        """Remove pending rows whose ID is already in the sheet, as written"""
+        (columns,) = await self.governor.call(READ, "batch_get", self.sheets.batch_get, ["A:A"], "COLUMNS")
+        ids = set(columns[0]) if columns else set()
+        written = [item for item in self._pending if item[1][0] in ids]
+        if written:
+            self._pending = [item for item in self._pending if item[1][0] not in ids]
+            SHEET_ROWS_ALREADY_WRITTEN.inc(len(written))
+            self._written(written)
+            logger.info(f"{len(written)} sheet rows were already written, not appending them again")
+        self._unsure = False
+
+    def _written(self, items):
+        if self._on_written is None:
+            return
+        keys = [key for key, _ in items if key is not None]
+        try:
+            self._on_written(keys)
+        except Exception as e:
+            logger.error(f"Failed to record written sheet rows: {e}")
+
+    async def _run(self):
+        delay = self.retry_delay
+        while True:
+            await self._collect()
+            # Rows arriving while we wait for quota join this batch
+            await self.governor.wait(WRITE)
+            self._drain_queue()
+            batch = []
+            try:
+                if self._unsure:
+                    await self._drop_written()
+                    if not self._pending:
+                        continue
+                batch = self._pending[:self.governor.batch_size(WRITE, self.batch_size, self.max_batch_size)]
+                await self._write(batch)
+            except Exception as e:
+                if batch and _maybe_applied(e):
+                    self._unsure = True
+                logger.error(f"Sheet write of {len(self._pending)} pending rows failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            del self._pending[:len(batch)]
+            self._written(batch)
+            delay = self.retry_delay
+            logger.info(f"Saved {len(batch)} rows to Google Sheets")
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(payload):
+    return hashlib.blake2b(payload.encode(), digest_size=16).digest()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """Incremental SQLite persistence for user_data and conversation states.
+
+    Only per-user data and ConversationHandler states are stored (chat_data,
+    bot_data and callback data are not used by this bot). Instead of pickling
+    everything, each changed user's data is upserted as one small row, and a
+    row is skipped when its content is unchanged since the last write, so the
+    cost of a flush depends on how many users changed, not how many exist.
+    user_data is loaded lazily: nothing is read at startup and a user's row is
+    fetched on their first update after a restart (``refresh_user_data``).
+    Conversation states are tiny and are loaded up front as PTB requires.
+    Only a digest of each user's last written row is kept in memory, and
+    users whose data is dropped are forgotten, so memory follows the users
+    with saved data, not every user seen since the start.
+
+    ``encode``/``decode`` let callers store objects that JSON can't handle;
+    ``encode`` is passed to json.dumps as ``default`` and ``decode`` as
+    ``object_hook``.
+    """
+
+    def __init__(self, path, update_interval=10, encode=None, decode=None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._encode = encode
+        self._decode = decode
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._loaded = set()
+        self._written = {}
+
+    def _dumps(self, data):
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=self._encode)
+
+    def _loads(self, payload):
+        return json.loads(payload, object_hook=self._decode)
+
+    # ---- user_data ----------------------------------------------------
+    async def get_user_data(self):
+        # Loaded per user on first use, see refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+        cur = self._conn.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,))
+        found = cur.fetchone()
+        if found is None:
+            return
+        self._written[user_id] = _digest(found[0])
+        try:
+            stored = self._loads(found[0])
+        except Exception as e:
+            logger.error(f"Discarding unreadable saved state for user {user_id}: {e}")
+            return
+        # Data set by this update before the load wins over the saved copy
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id, data):
+        self._loaded.add(user_id)
+        if not data:
+            await self.drop_user_data(user_id)
+            return
+        try:
+            payload = self._dumps(data)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Could not persist state for user {user_id}: {e}")
+            return
+        digest = _digest(payload)
+        if self._written.get(user_id) == digest:
+            return
+        self._conn.execute(
+            "INSERT INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (user_id, payload, time.time()),
+        )
+        self._written[user_id] = digest
+
+    async def drop_user_data(self, user_id):
+        stored = self._written.pop(user_id, None) is not None or user_id not in self._loaded
+        # With no row left, a later refresh_user_data just finds nothing
+        self._loaded.discard(user_id)
+        if stored:
+            self._conn.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    def saved_user_data(self, skip=()):
+        """(user_id, data) for every user with saved data, except those in ``skip``"""
+        rows = self._conn.execute("SELECT user_id, data FROM user_data").fetchall()
+        for user_id, payload in rows:
+            if user_id in skip:
+                continue
+            try:
+                yield user_id, self._loads(payload)
+            except Exception as e:
+                logger.error(f"Skipping unreadable saved state for user {user_id}: {e}")
+
+    def stale_user_ids(self, cutoff):
+        """Users whose saved data was last written before ``cutoff`` (a time.time() value)"""
+        cur = self._conn.execute("SELECT user_id FROM user_data WHERE updated_at < ?", (cutoff,))
+        return [user_id for (user_id,) in cur]
+
+    # ---- conversations ------------------------------------------------
+    async def get_conversations(self, name):
+        cur = self._conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in cur}
+
+    async def update_conversation(self, name, key, new_state):
+        key_text = json.dumps(list(key))
+        if new_state is None:
+            self._conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key_text))
+        else:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                (name, key_text, json.dumps(new_state)),
+            )
+
+    async def flush(self):
+        self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        self._conn.close()
+
+    # ---- not stored ---------------------------------------------------
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
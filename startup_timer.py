@@ -0,0 +1,36 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Records how long each startup phase takes and logs a breakdown."""
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - begin)
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds))
+
+    def report(self, title="Startup timing"):
+        total = time.perf_counter() - self.started
+        with self._lock:
+            phases = list(self.phases)
+        lines = [f"{title} ({total * 1000:.0f} ms since start):"]
+        lines += [f"  {name:<24} {seconds * 1000:8.1f} ms" for name, seconds in phases]
+        logger.info("\n".join(lines))
+        return phases
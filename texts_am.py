@@ -27,7 +27,9 @@ TEXTS = {
         "preview": "preview 👀 ቅድመ እይታ",
         "share_contact": "📱 አድራሻ ያጋሩ",
         "confirm": "✅ አረጋግጥ",
-        "cancel": "❌ ሰርዝ"
+        "cancel": "❌ ሰርዝ",
+        "search_any": "ሁሉም",
+        "search_run": "🔍 ፈልግ"
     },
     "messages": {
         "start": "👋 እንኳን ደህና መጡ! አዲስ የቤት ማስታወቂያ ለመለጠፍ  /post ይጠቀሙ።",
@@ -61,18 +63,27 @@ TEXTS = {
         "confirm_prompt": "ሁሉም መረጃ ትክክል ነው?",
         "success": "✅ የንብረት ማስታወቂያዎ በተሳካ ሁኔታ ተለጥፏል! /start ",
         "canceled": "❌ ማስታወቂያ ማስቀመጥ ተሰርዟል። /start",
+        "draft_expired": "⌛ ያልተጠናቀቀው ማስታወቂያዎ ጊዜው አልፎበታል። እንደገና ለመጀመር /post ይጫኑ።",
         "operation_canceled": "❌ ክዋኔው ተሰርዟል። /start",
         "sheet_error": "የማስታወቂያ መዝገብ ስህተት: {}",
+        "already_posted": "ℹ️ ይህ ማስታወቂያ ቀድሞውኑ ተለጥፏል። /start",
+        "incomplete_data": "⚠️ አንዳንድ መረጃዎች ይጎድላሉ። እባክዎ በ /post እንደገና ይጀምሩ።",
         "invalid_location": "እባክዎ ትክክለኛ አካባቢ  ያስገቡ:",
         "invalid_price": "እባክዎ ትክክለኛ ዋጋ ያስገቡ:",
         "invalid_contact": "እባክዎ ትክክለኛ 10-ዲጂት ስልክ ቁጥር ያስገቡ:",
         "contact_format_example": "(ምሳሌ: 0911223344)",
+        "search_menu": "🔍 ማስታወቂያ ፍለጋ፣ ማጣሪያዎችን ይምረጡ እና ፈልግ የሚለውን ይጫኑ።\nቦታና ዋጋ ለመወሰን: /search ቦሌ 5000-20000",
+        "search_results": "🔍 የተገኙ ማስታወቂያዎች:\n\n",
+        "search_result": "🆔 {id} | {rent_or_sell} | {property_use}\n📍 {location} | 💰 {price}\n📞 {contact}\n\n",
+        "search_no_results": "ምንም ማስታወቂያ አልተገኘም።",
+        "search_expired": "ፍለጋው ጊዜው አልፏል። እባክዎ /search እንደገና ይጀምሩ።",
         "footer":  "\n ተጨማሪ ቤቶችን ለማየት JOIN >> https://t.me/+joMOH-vpCvZhMGY0 \n አዲስ የቤት ማስታወቂያ ለመለጠፍ >> @Betkiray_V5_bot ", 
         "help": """
         📚 የቤት ማስታወቂያ ቦት መመሪያ 📚 እንደዚህ አይነት ማስታወቂያ ለመለጠፍ በቴሌግራም ቦት @Betkiray_V5_bot ወይም @busi_admin ማናገር ወይም በ 0993550504 መደወል እና ማስመዝገብ ይችላሉ  \n https://t.me/bet_kiray_et 
 
         🔹 /start - ቦቱን ለመጠቀም ይጀምሩ
         🔹 /post - አዲስ ማስታወቂያ ለመለጠፍ
+        🔹 /search - ማስታወቂያዎችን ለመፈለግ
         🔹 /cancel - ለማቋረጥ 
         🔹 /help - ይህን መመሪያ ያሳያል
 
@@ -0,0 +1,82 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# The base class's limit, high enough that its semaphore never makes an update wait
+UNBOUNDED = 2 ** 31 - 1
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's updates in order.
+
+    Up to ``limit`` updates run at once. Updates from the same user (or chat,
+    when there is no user) are serialised through a per-user lock; asyncio
+    locks wake waiters in FIFO order, so ConversationHandler state
+    transitions for one user happen in the order the updates arrived. The
+    per-user lock is taken before a concurrency slot, so a user's queued
+    updates (an album, a burst of messages) wait without holding slots other
+    users need. process_update takes the base class's semaphore before
+    do_process_update runs, so that one is sized UNBOUNDED and the slots
+    are a semaphore of this class's own. Locks are dropped as soon as nobody
+    holds or waits for them, so memory tracks active users only.
+    """
+
+    __slots__ = ("limit", "_locks", "_slots", "_running")
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(UNBOUNDED)
+        self.limit = max_concurrent_updates
+        self._locks = {}
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._running = 0
+
+    @staticmethod
+    def ordering_key(update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+            if update.effective_chat is not None:
+                return ("chat", update.effective_chat.id)
+        return None
+
+    def active_keys(self):
+        return len(self._locks)
+
+    @property
+    def running_updates(self):
+        """Updates holding a concurrency slot (not those waiting behind their user's lock)"""
+        return self._running
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self._running += 1
+            try:
+                await coroutine
+            finally:
+                self._running -= 1
+
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
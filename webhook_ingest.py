@@ -0,0 +1,137 @@
+import asyncio
+import hmac
+import json
+import logging
+from collections import deque
+
+from aiohttp import web
+from telegram import Update
+
+from metrics import REGISTRY
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib parser works, just slower
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+WEBHOOK_DUPLICATES = REGISTRY.counter("webhook_duplicate_updates", "Redelivered webhook updates that were dropped")
+WEBHOOK_REJECTED = REGISTRY.counter("webhook_rejected_updates", "Webhook updates answered 503 because the backlog was full")
+WEBHOOK_INVALID = REGISTRY.counter("webhook_invalid_updates", "Webhook bodies dropped because they couldn't be decoded")
+
+
+class RecentIds:
+    """The last ``size`` update_ids seen, in fixed memory: a ring buffer plus a set for O(1) lookups"""
+
+    def __init__(self, size):
+        self._order = deque(maxlen=size)
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def add(self, update_id):
+        """Remember an id; returns False if it was already among the recent ones"""
+        if update_id in self._seen:
+            return False
+        if len(self._order) == self._order.maxlen:
+            self._seen.discard(self._order[0])
+        self._order.append(update_id)
+        self._seen.add(update_id)
+        return True
+
+
+class WebhookIngestor:
+    """Accepts Telegram webhook POSTs and feeds them to the application.
+
+    The request handler only checks the secret token and body size, copies the
+    raw body into a bounded queue and answers 200. JSON decoding and
+    ``Update.de_json`` happen in a worker task, off the request path. When the
+    backlog (this queue plus the application's update queue) is full the
+    handler answers 503 and Telegram redelivers later.
+
+    Telegram also redelivers updates it thinks failed, e.g. when our answer
+    was slow. The last ``dedup_window`` update_ids are remembered and a
+    repeat is dropped before ``Update.de_json``, so handlers never run twice
+    for one update.
+    """
+
+    def __init__(self, bot, update_queue, secret_token, max_pending=1000, max_body_bytes=256 * 1024,
+                 dedup_window=1000):
+        self.bot = bot
+        self.update_queue = update_queue
+        self.secret_token = secret_token.encode() if secret_token else None
+        self.max_pending = max_pending
+        self.max_body_bytes = max_body_bytes
+        self.rejected = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self._recent = RecentIds(dedup_window)
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="webhook-ingest")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # Hand whatever was already accepted to the application first
+        while not self._queue.empty():
+            self._decode(self._queue.get_nowait())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def depth(self):
+        return self._queue.qsize()
+
+    async def handle(self, request: web.Request):
+        if self.secret_token is not None:
+            sent = request.headers.get(SECRET_HEADER, "").encode()
+            if not hmac.compare_digest(sent, self.secret_token):
+                return web.Response(status=403)
+
+        if request.content_length is not None and request.content_length > self.max_body_bytes:
+            return web.Response(status=413)
+
+        if self._queue.full() or self._queue.qsize() + self.update_queue.qsize() >= self.max_pending:
+            self.rejected += 1
+            WEBHOOK_REJECTED.inc()
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        body = await request.read()
+        if len(body) > self.max_body_bytes:
+            return web.Response(status=413)
+        self._queue.put_nowait(body)
+        return web.Response(text="OK")
+
+    def _decode(self, body):
+        try:
+            data = json_loads(body)
+            if not self._recent.add(data["update_id"]):
+                self.duplicates += 1
+                WEBHOOK_DUPLICATES.inc()
+                return
+            update = Update.de_json(data, self.bot)
+        except Exception as e:
+            self.invalid += 1
+            WEBHOOK_INVALID.inc()
+            logger.warning(f"Dropping undecodable webhook body: {e}")
+            return
+        self.update_queue.put_nowait(update)
+
+    async def _run(self):
+        while True:
+            body = await self._queue.get()
+            self._decode(body)
+            # Let the request handlers run between bursts of decoding
+            await asyncio.sleep(0)